@@ -1,93 +1,256 @@
+import math
 import numpy as np
+from statistics import NormalDist
+from collections import namedtuple
+from scipy.special import ndtr, ndtri
 
-from py_vollib.black_scholes import black_scholes as bs
-from py_vollib.black_scholes.greeks.analytical import delta,gamma,vega
+SECONDS_PER_YEAR = 86400*365
 
-def black_scholes(timestamp: float, underlying_price: float, strike: float, expiration: float, volatility: float, option):
-    S = underlying_price
-    K = strike
-    T = max(expiration - timestamp, 0) /(86400*365)
-    v = volatility
+Greeks = namedtuple('Greeks', ['price', 'delta', 'gamma', 'vega', 'theta'])
+_NORMAL = NormalDist()
+
+# Array kernel, r = 0 and same conventions as py_vollib:
+# T in years, vega is the change of price for 1% change of volatility, theta the change of price per day.
+# S, K, T and sigma can be floats or numpy arrays that broadcast together.
+
+def years_to_expiration(timestamp, expiration):
+    return np.maximum(expiration - timestamp, 0) / SECONDS_PER_YEAR
+
+def _is_put(option):
+    if option in ('put', 'p'):
+        return True
+    if option in ('call', 'c'):
+        return False
+    raise ValueError("Invalid option type")
+
+def _is_scalar(*args):
+    for x in args:
+        if not isinstance(x, (float, int, np.number)):
+            return False
+    return True
+
+def _as_float64(*args):
+    # scipy ufuncs do not support np.longdouble
+    return tuple(np.asarray(x, dtype=np.float64) for x in args)
+
+def _pdf(x):
+    return np.exp(-0.5 * x * x) / np.sqrt(2 * np.pi)
+
+def _d1_d2(S, K, T, sigma):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vol_sqrt_t = sigma * np.sqrt(T)
+        d1 = (np.log(S / K) + 0.5 * vol_sqrt_t * vol_sqrt_t) / vol_sqrt_t
+    return d1, d1 - vol_sqrt_t
+
+def _price(S, K, d1, d2, put):
+    if put:
+        price = K * ndtr(-d2) - S * ndtr(-d1)
+        intrinsic = np.maximum(K - S, 0)
+    else:
+        price = S * ndtr(d1) - K * ndtr(d2)
+        intrinsic = np.maximum(S - K, 0)
+    # expired option (or zero volatility) is worth its intrinsic value
+    return np.where(np.isfinite(d1), price, intrinsic)[()]
+
+# numpy has a large overhead for single values, so scalars are priced with math
+def _scalar_greeks(S, K, T, sigma, put):
+    S, K, T, sigma = float(S), float(K), float(T), float(sigma)
+    vol_sqrt_t = sigma * math.sqrt(T)
+    log_moneyness = math.log(S / K)
+    if vol_sqrt_t == 0:
+        d1 = math.copysign(math.inf, log_moneyness) if log_moneyness != 0 else math.nan
+        d2 = d1
+    else:
+        d1 = (log_moneyness + 0.5 * vol_sqrt_t * vol_sqrt_t) / vol_sqrt_t
+        d2 = d1 - vol_sqrt_t
+    cdf_d1 = 0.5 * math.erfc(-d1 / math.sqrt(2))
+    pdf_d1 = math.exp(-0.5 * d1 * d1) / math.sqrt(2 * math.pi)
+    if not math.isfinite(d1):
+        price = max(K - S, 0.0) if put else max(S - K, 0.0)
+    elif put:
+        price = K * 0.5 * math.erfc(d2 / math.sqrt(2)) - S * 0.5 * math.erfc(d1 / math.sqrt(2))
+    else:
+        price = S * cdf_d1 - K * 0.5 * math.erfc(-d2 / math.sqrt(2))
+    s_sigma = S * sigma
+    gamma = pdf_d1 / (s_sigma * math.sqrt(T)) if vol_sqrt_t != 0 else math.nan
+    # theta = -S * pdf_d1 * sigma / (2 * sqrt(T)) / 365, from gamma
+    theta = gamma * (s_sigma * s_sigma * (-0.5 / 365))
+    return Greeks(
+        price,
+        cdf_d1 - 1.0 if put else cdf_d1,
+        gamma,
+        S * pdf_d1 * math.sqrt(T) * 0.01,
+        theta
+    )
+
+def bs_price(S, K, T, sigma, option):
+    put = _is_put(option)
+    if _is_scalar(S, K, T, sigma):
+        return _scalar_greeks(S, K, T, sigma, put).price
+    S, K, T, sigma = _as_float64(S, K, T, sigma)
+    d1, d2 = _d1_d2(S, K, T, sigma)
+    return _price(S, K, d1, d2, put)
 
-    if option == 'call':
-        option = 'c'
-    if option == 'put':
-        option = 'p'
+def bs_delta(S, K, T, sigma, option):
+    put = _is_put(option)
+    if _is_scalar(S, K, T, sigma):
+        return _scalar_greeks(S, K, T, sigma, put).delta
+    S, K, T, sigma = _as_float64(S, K, T, sigma)
+    d1, _ = _d1_d2(S, K, T, sigma)
+    if put:
+        return ndtr(d1) - 1.0
+    return ndtr(d1)
 
-    return bs(option,S,K,T,0,v)
+def bs_gamma(S, K, T, sigma):
+    if _is_scalar(S, K, T, sigma):
+        return _scalar_greeks(S, K, T, sigma, False).gamma
+    S, K, T, sigma = _as_float64(S, K, T, sigma)
+    d1, _ = _d1_d2(S, K, T, sigma)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _pdf(d1) / (S * sigma * np.sqrt(T))
+
+def bs_vega(S, K, T, sigma):
+    if _is_scalar(S, K, T, sigma):
+        return _scalar_greeks(S, K, T, sigma, False).vega
+    S, K, T, sigma = _as_float64(S, K, T, sigma)
+    d1, _ = _d1_d2(S, K, T, sigma)
+    return S * _pdf(d1) * np.sqrt(T) * 0.01
+
+def bs_theta(S, K, T, sigma):
+    # same for calls and puts with r = 0
+    if _is_scalar(S, K, T, sigma):
+        return _scalar_greeks(S, K, T, sigma, False).theta
+    S, K, T, sigma = _as_float64(S, K, T, sigma)
+    d1, _ = _d1_d2(S, K, T, sigma)
+    s_sigma = S * sigma
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return _pdf(d1) / (s_sigma * np.sqrt(T)) * (s_sigma * s_sigma * (-0.5 / 365))
+
+def bs_greeks(S, K, T, sigma, option):
+    # price, delta, gamma, vega and theta in one pass
+    put = _is_put(option)
+    if _is_scalar(S, K, T, sigma):
+        return _scalar_greeks(S, K, T, sigma, put)
+    S, K, T, sigma = _as_float64(S, K, T, sigma)
+    d1, d2 = _d1_d2(S, K, T, sigma)
+    pdf_d1 = _pdf(d1)
+    sqrt_t = np.sqrt(T)
+    cdf_d1 = ndtr(d1)
+    s_sigma = S * sigma
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gamma = pdf_d1 / (s_sigma * sqrt_t)
+    return Greeks(
+        _price(S, K, d1, d2, put),
+        cdf_d1 - 1.0 if put else cdf_d1,
+        gamma,
+        S * pdf_d1 * sqrt_t * 0.01,
+        gamma * (s_sigma * s_sigma * (-0.5 / 365))
+    )
+
+# Scalar functions, timestamps and expirations are in seconds
+
+def black_scholes(timestamp: float, underlying_price: float, strike: float, expiration: float, volatility: float, option):
+    T = max(expiration - timestamp, 0) / SECONDS_PER_YEAR
+    return bs_price(underlying_price, strike, T, volatility, option)
 
-    
 def black_scholes_vega_call(timestamp: float, underlying_price: float, strike: float, expiration: float, volatility: float):
-    S = underlying_price
-    K = strike
-    T = max(expiration - timestamp, 0) /(86400*365)
-    v = volatility
+    T = max(expiration - timestamp, 0) / SECONDS_PER_YEAR
+    return bs_vega(underlying_price, strike, T, volatility)
 
-    return vega('c',S,K,T,0,v) 
-    
 def black_scholes_delta_call(timestamp: float, underlying_price: float, strike: float, expiration: float, volatility: float):
-    S = underlying_price
-    K = strike
-    T = max(expiration - timestamp, 0) /(86400*365)
-    v = volatility     
-
-    return delta('c',S,K,T,0,v)
+    T = max(expiration - timestamp, 0) / SECONDS_PER_YEAR
+    return bs_delta(underlying_price, strike, T, volatility, 'call')
 
 def black_scholes_delta_put(timestamp: float, underlying_price: float, strike: float, expiration: float, volatility: float):
-    S = underlying_price
-    K = strike
-    T = max(expiration - timestamp, 0) /(86400*365)
-    v = volatility 
-    return delta('p',S,K,T,0,v)
+    T = max(expiration - timestamp, 0) / SECONDS_PER_YEAR
+    return bs_delta(underlying_price, strike, T, volatility, 'put')
+
+# With r = 0 the delta of a call is N(d1), so the strike is found by inverting
+# the normal CDF. The strike is rounded to two significant digits, truncated or
+# ceiled, whichever gives delta closer to target_delta.
+# Target deltas 0 and 1 (-1 and 0 for puts) are clamped by _DELTA_EPS, so their strikes are finite.
+_DELTA_EPS = np.finfo(np.float64).eps
+
+def strike_for_delta(target_delta, timestamp, underlying_price, expiration, volatility, option):
+    put = _is_put(option)
+    if _is_scalar(target_delta, timestamp, underlying_price, expiration, volatility):
+        return _scalar_strike_for_delta(target_delta, timestamp, underlying_price, expiration, volatility, put)
+    S, T, sigma = _as_float64(underlying_price, years_to_expiration(timestamp, expiration), volatility)
+    d1 = ndtri(np.clip(target_delta + 1.0 if put else target_delta, _DELTA_EPS, 1.0 - _DELTA_EPS))
+    vol_sqrt_t = sigma * np.sqrt(T)
+    strike = S * np.exp(0.5 * vol_sqrt_t * vol_sqrt_t - d1 * vol_sqrt_t)
+
+    decimals = 1 - np.trunc(np.log10(strike))
+    strike_t = trunc(strike, decimals)
+    strike_c = ceil(strike, decimals)
+    diff_t = np.abs(bs_delta(S, strike_t, T, sigma, option) - target_delta)
+    diff_c = np.abs(bs_delta(S, strike_c, T, sigma, option) - target_delta)
+    return np.where(diff_c < diff_t, strike_c, strike_t)[()]
+
+def _scalar_strike_for_delta(target_delta, timestamp, underlying_price, expiration, volatility, put):
+    S, sigma = float(underlying_price), float(volatility)
+    T = max(expiration - timestamp, 0) / SECONDS_PER_YEAR
+    d1 = _NORMAL.inv_cdf(min(max(target_delta + 1.0 if put else target_delta, _DELTA_EPS), 1.0 - _DELTA_EPS))
+    vol_sqrt_t = sigma * math.sqrt(T)
+    strike = S * math.exp(0.5 * vol_sqrt_t * vol_sqrt_t - d1 * vol_sqrt_t)
+
+    decimals = 1 - math.trunc(math.log10(strike))
+    scale = 10.0**abs(decimals)
+    if decimals >= 0:
+        strike_t = math.trunc(strike*scale)/scale
+        strike_c = math.ceil(strike*scale)/scale
+    else:
+        strike_t = float(math.trunc(strike/scale)*scale)
+        strike_c = float(math.ceil(strike/scale)*scale)
+    diff_t = abs(_scalar_greeks(S, strike_t, T, sigma, put).delta - target_delta)
+    diff_c = abs(_scalar_greeks(S, strike_c, T, sigma, put).delta - target_delta)
+    if diff_c < diff_t:
+        return strike_c
+    return strike_t
 
 def strike_for_delta_call(target_delta: float, timestamp: float, underlying_price: float, expiration: float, volatility: float):
+    return strike_for_delta(target_delta, timestamp, underlying_price, expiration, volatility, 'call')
+
+def strike_for_delta_put(target_delta: float, timestamp: float, underlying_price: float, expiration: float, volatility: float):
+    return strike_for_delta(target_delta, timestamp, underlying_price, expiration, volatility, 'put')
+
+# Previous solver, bisection over [0, 10*S] until delta is within eps of target_delta.
+# Kept as the reference strike_for_delta is tested against (tests/test_black_scholes.py).
+def strike_for_delta_bisect(target_delta: float, timestamp: float, underlying_price: float, expiration: float, volatility: float, option):
+    if _is_put(option):
+        delta_fn = black_scholes_delta_put
+    else:
+        delta_fn = black_scholes_delta_call
     low, high = 0, 10*underlying_price
     eps = 0.01
     while True:
         strike = low + (high - low)/2
-        curr_call_delta = black_scholes_delta_call(timestamp, underlying_price, strike, expiration, volatility)
-        if np.abs(curr_call_delta - target_delta) <= eps:
+        curr_delta = delta_fn(timestamp, underlying_price, strike, expiration, volatility)
+        if np.abs(curr_delta - target_delta) <= eps:
             digits_to_round = int(np.trunc(np.log10(strike)))
             strike_t = trunc(strike,decimals=1 - digits_to_round)
             strike_c = ceil(strike, decimals=1 - digits_to_round)
-            delta_t = black_scholes_delta_call(timestamp, underlying_price, strike_t, expiration, volatility)
-            delta_c = black_scholes_delta_call(timestamp, underlying_price, strike_c, expiration, volatility)
+            delta_t = delta_fn(timestamp, underlying_price, strike_t, expiration, volatility)
+            delta_c = delta_fn(timestamp, underlying_price, strike_c, expiration, volatility)
             diff_t = np.abs(delta_t - target_delta)
             diff_c = np.abs(delta_c - target_delta)
             if diff_c < diff_t:
                 return strike_c
             else:
                 return strike_t
-        if curr_call_delta > target_delta:
+        if curr_delta > target_delta:
             low = strike
         else:
             high = strike
-    
-def strike_for_delta_put(target_delta: float, timestamp: float, underlying_price: float, expiration: float, volatility: float):
-    low, high = 0, 10*underlying_price
-    eps = 0.01
-    while True:
-        strike = low + (high - low)/2
-        curr_put_delta = black_scholes_delta_put(timestamp, underlying_price, strike, expiration, volatility)
-        if np.abs(curr_put_delta - target_delta) <= eps:
-            digits_to_round = int(np.trunc(np.log10(strike)))
-            strike_t = trunc(strike,decimals=1 - digits_to_round)
-            strike_c = ceil(strike, decimals=1 - digits_to_round)
-            delta_t = black_scholes_delta_put(timestamp, underlying_price, strike_t, expiration, volatility)
-            delta_c = black_scholes_delta_put(timestamp, underlying_price, strike_c, expiration, volatility)
-            diff_t = np.abs(delta_t - target_delta)
-            diff_c = np.abs(delta_c - target_delta)
-            if diff_c < diff_t:
-                return strike_c
-            else:
-                return strike_t
-        if curr_put_delta < target_delta:
-            high = strike
-        else:
-            low = strike
+
+# Rounding to decimals places, decimals can be negative and an array.
+# Scaling by an exact power of ten keeps e.g. 720 from becoming 720.0000000000001
+def _round_with(fn, x, decimals):
+    scale = 10.0**np.abs(decimals)
+    return np.where(decimals >= 0, fn(x*scale)/scale, fn(x/scale)*scale)[()]
 
 def ceil(x, decimals = 0):
-    return np.ceil(x*10**decimals)/10**decimals
+    return _round_with(np.ceil, x, decimals)
 
 def trunc(x, decimals = 0): 
-    return np.trunc(x*10**decimals)/10**decimals
\ No newline at end of file
+    return _round_with(np.trunc, x, decimals)
\ No newline at end of file
@@ -0,0 +1,39 @@
+import math
+
+# black_scholes._scalar_greeks compiled with numba for the kernels of simulation_numba and order_flow.
+# numba is optional, without it bs_greeks is plain python.
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# float division by zero gives inf like numpy scalars, e.g. for a put priced 0 at expiry
+if numba is not None:
+    _jit = numba.njit(cache=True, error_model='numpy')
+else:
+    _jit = lambda fn: fn
+
+
+@_jit
+def bs_greeks(S, K, T, sigma, put):
+    # price, delta, gamma, vega and theta, same conventions as black_scholes
+    vol_sqrt_t = sigma * math.sqrt(T)
+    log_moneyness = math.log(S / K)
+    if vol_sqrt_t == 0:
+        d1 = math.copysign(math.inf, log_moneyness) if log_moneyness != 0 else math.nan
+        d2 = d1
+    else:
+        d1 = (log_moneyness + 0.5 * vol_sqrt_t * vol_sqrt_t) / vol_sqrt_t
+        d2 = d1 - vol_sqrt_t
+    cdf_d1 = 0.5 * math.erfc(-d1 / math.sqrt(2))
+    pdf_d1 = math.exp(-0.5 * d1 * d1) / math.sqrt(2 * math.pi)
+    if not math.isfinite(d1):
+        price = max(K - S, 0.0) if put else max(S - K, 0.0)
+    elif put:
+        price = K * 0.5 * math.erfc(d2 / math.sqrt(2)) - S * 0.5 * math.erfc(d1 / math.sqrt(2))
+    else:
+        price = S * cdf_d1 - K * 0.5 * math.erfc(-d2 / math.sqrt(2))
+    s_sigma = S * sigma
+    gamma = pdf_d1 / (s_sigma * math.sqrt(T)) if vol_sqrt_t != 0 else math.nan
+    theta = gamma * (s_sigma * s_sigma * (-0.5 / 365))
+    return price, (cdf_d1 - 1.0 if put else cdf_d1), gamma, S * pdf_d1 * math.sqrt(T) * 0.01, theta
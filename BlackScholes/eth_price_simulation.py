@@ -1,6 +1,5 @@
 import pandas as pd
 import numpy as np
-import random
 
 def log_returns(price_series,interval):
     return (np.log(price_series/
@@ -11,8 +10,8 @@ def standardized_returns(returns):
     sig = np.std(returns)
     return (returns-np.repeat(mu,len(returns)))/sig
 
-def unstandardized_returns(returns, mu,sig):
-    tmp = np.array(returns,dtype=np.longdouble)*sig+mu
+def unstandardized_returns(returns, mu,sig, dtype=np.float64):
+    tmp = np.array(returns,dtype=dtype)*sig+mu
     return tmp
     #return np.where(tmp > -1, tmp, -0.99999)
     #return [x if x> -1 else -0.99 for x in tmp]
@@ -30,32 +29,108 @@ def get_price_np(arr,p0):
     prices = np.exp(np.cumsum(arr))*p0
     return np.insert(prices,0,p0)
 
+def get_prices_np(paths,p0):
+    # get_price_np of every row
+    prices = np.exp(np.cumsum(paths,axis=1))*p0
+    return np.insert(prices,0,p0,axis=1)
+
 def create_sample_path(returns, **kwargs):
+    # single path of create_sample_paths
+    return list(create_sample_paths(returns, 1, **kwargs)[0])
+
+def create_sample_paths(returns, num_paths, **kwargs):
+    # block bootstrap of num_paths paths at once, returns array (num_paths, sample_length)
     sample_length=kwargs.get('sample_length',10) #desired length of output sample 
     min_connected_original=kwargs.get('min_connected_original',1) #minimum amount of subsequent datapoints that are drawn together
     max_connected_original=kwargs.get('max_connected_original',1) #see above, but upper limit - should be interval where autocorrelation is insignificant
     with_replacement = kwargs.get('with_replacement',1) #draw with (1) or without (0) replacement from original sample
+    rng = kwargs.get('rng',None) #numpy Generator, or one Generator per path
+    if rng is None:
+        rng = np.random.default_rng()
 
-    length = 0
-    sample_path=[]
-    
+    returns = np.asarray(returns)
     if (with_replacement==0) & (sample_length >= len(returns)):
         print('Cant do without replacement to achieve sample length, do with replacement')
         with_replacement = 1
 
-    returns_copy = returns.copy() 
-    while length < sample_length:
-        this_length = random.randint(min_connected_original,max_connected_original)
-        if length + this_length>sample_length:
-            this_length = sample_length-length
-
-        start = random.randint(1,len(returns_copy)-this_length)
-        sample_path += returns_copy[start:start+this_length]
-        if with_replacement==0:
-            del returns_copy[start:start+this_length]
-        length += this_length
-    
-    return sample_path
+    if isinstance(rng, np.random.Generator):
+        lengths, starts = _draw_blocks(rng, num_paths, len(returns), sample_length,
+            min_connected_original, max_connected_original, with_replacement)
+    else:
+        draws = [_draw_blocks(path_rng, 1, len(returns), sample_length,
+            min_connected_original, max_connected_original, with_replacement) for path_rng in rng]
+        lengths = np.concatenate([d[0] for d in draws])
+        starts = np.concatenate([d[1] for d in draws])
+
+    if with_replacement==0:
+        index = _draw_without_replacement(starts, lengths, sample_length)
+    else:
+        index = _block_index(starts, lengths)
+    return returns[index]
+
+def _draw_blocks(rng, num_paths, num_returns, sample_length, min_connected, max_connected, with_replacement):
+    # block lengths of every path, the last block is cut to sample_length
+    # and the blocks after it have zero length
+    max_blocks = -(-sample_length // min_connected)
+    lengths = rng.integers(min_connected, max_connected + 1, size=(num_paths, max_blocks))
+    ends = np.minimum(np.cumsum(lengths, axis=1), sample_length)
+    lengths = np.diff(ends, axis=1, prepend=0)
+
+    if with_replacement==0:
+        # start is a rank in the returns that were not drawn yet
+        remaining = num_returns - (ends - lengths)
+    else:
+        remaining = num_returns
+    starts = rng.integers(1, remaining - lengths + 1)
+    return lengths, starts
+
+def path_rngs(seed, start, stop):
+    # independent Generator for paths start..stop, path i uses spawn key (i,) of the seed,
+    # so a path does not depend on how paths are split into chunks or processes
+    return [np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(i,))) for i in range(start, stop)]
+
+def _block_index(starts, lengths):
+    # index of every element of consecutive blocks (start, start + length)
+    flat_lengths = lengths.ravel()
+    block = np.repeat(np.arange(flat_lengths.size), flat_lengths)
+    first = np.cumsum(flat_lengths) - flat_lengths
+    return (starts.ravel()[block] + np.arange(block.size) - first[block]).reshape(len(starts), -1)
+
+def _draw_without_replacement(starts, lengths, sample_length):
+    """
+    Index of blocks drawn without replacement, starts are ranks among the returns not drawn yet.
+    Instead of deleting from a list every drawn block is kept as (alive returns before it, length),
+    the original index of rank r is r plus the length of the blocks with at most r alive returns before them.
+    """
+    num_paths, num_blocks = lengths.shape
+    max_length = max(int(lengths.max()), 1)
+    offsets = np.arange(max_length)
+    before = np.zeros(lengths.shape, dtype=np.int32)
+    drawn = np.zeros(lengths.shape, dtype=np.int32)
+    index = np.empty((num_paths, sample_length), dtype=np.int64)
+    filled = np.zeros(num_paths, dtype=np.int64)
+    for j in range(num_blocks):
+        start = starts[:, j]
+        length = lengths[:, j]
+        if not length.any():
+            break
+        b = before[:, :j]
+        d = drawn[:, :j]
+        shift = (d * (b <= start[:, None])).sum(axis=1)
+        # blocks drawn earlier that lie between the returns of this block
+        rows, k = np.nonzero((b > start[:, None]) & (b < (start + length)[:, None]))
+        jumps = np.bincount(rows * max_length + b[rows, k] - start[rows], weights=d[rows, k], minlength=num_paths * max_length)
+        block = (start + shift)[:, None] + offsets + np.cumsum(jumps.reshape(num_paths, max_length), axis=1).astype(np.int64)
+
+        rows, t = np.nonzero(offsets < length[:, None])
+        index[rows, filled[rows] + t] = block[rows, t]
+        filled += length
+
+        end = (start + length)[:, None]
+        before[:, :j] = np.where(b >= end, b - length[:, None], np.minimum(b, start[:, None]))
+        before[:, j] = start
+        drawn[:, j] = length
+    return index
 
 def make_df_price_simulation(series_returns,num_paths,sample_length, p0, **kwargs):
     #creates simulated pathes based on input timeseries
@@ -92,13 +167,14 @@ def make_df_price_simulation(series_returns,num_paths,sample_length, p0, **kwarg
     
     series_std_returns=standardized_returns(series_returns)
 
-    for j in range(num_paths):
-            
-        sample_std_returns = create_sample_path(list(series_std_returns),
+    samples_std_returns = create_sample_paths(series_std_returns, num_paths,
                                         sample_length = sample_length,
                                         min_connected_original = min_connected,
                                         max_connected_original = max_connected,
-                                        with_replacement = with_replacement)
+                                        with_replacement = with_replacement,
+                                        rng = kwargs.get('rng',None))
+    for j in range(num_paths):
+        sample_std_returns = samples_std_returns[j]
         sample_returns=unstandardized_returns(sample_std_returns,mu,sigma) # we will use our distribution
         dct_returns[str(j)]=sample_returns
         dct_std_returns[str(j)]=sample_std_returns
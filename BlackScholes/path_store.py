@@ -0,0 +1,67 @@
+import json
+import struct
+import numpy as np
+
+# Raw path file:
+#   8 bytes magic, 8 bytes header length (little endian),
+#   json header (dtype, shape, generator params, seed) padded with spaces,
+#   paths in C order starting at a page boundary, so it can be opened with np.memmap.
+MAGIC = b'OTSPATH1'
+ALIGNMENT = 4096
+EXTENSION = '.paths'
+
+
+def is_path_store(file):
+    with open(file, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def _data_offset(header_length):
+    offset = len(MAGIC) + 8 + header_length
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def create_path_store(file, shape, dtype, params=None, seed=None):
+    """
+    Create an empty path file and return it as writable memmap,
+    paths can be written chunk by chunk without holding all of them in memory.
+    """
+    header = json.dumps({
+        'dtype': np.dtype(dtype).str,
+        'shape': list(shape),
+        'params': params or {},
+        'seed': seed,
+    }).encode('utf-8')
+    offset = _data_offset(len(header))
+    header = header.ljust(offset - len(MAGIC) - 8)
+    with open(file, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+    return np.memmap(file, dtype=dtype, mode='r+', offset=offset, shape=tuple(shape))
+
+
+def read_header(file):
+    with open(file, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{file} is not a path file")
+        header_length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+    header['offset'] = _data_offset(header_length)
+    return header
+
+
+def open_path_store(file, mode='r'):
+    """
+    Open a path file as memmap without reading it,
+    pages are shared between processes that open the same file.
+    """
+    header = read_header(file)
+    paths = np.memmap(file, dtype=np.dtype(header['dtype']), mode=mode, offset=header['offset'], shape=tuple(header['shape']))
+    return paths, header
+
+
+def save_paths(file, paths, params=None, seed=None):
+    store = create_path_store(file, paths.shape, paths.dtype, params=params, seed=seed)
+    store[:] = paths
+    store.flush()
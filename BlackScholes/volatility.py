@@ -13,6 +13,21 @@ def calculateRV(data, window, factor):
   RV = RV.dropna()
   return RV
 
+def calculateRVBatch(prices, window, factor):
+  # calculateRV of every column of prices (n_steps, n_paths) in one pass,
+  # rolling sums come from cumulative sums of the log returns instead of pandas rolling per path
+  # row k of the result belongs to row k + window*factor of prices, like the index of calculateRV
+  n = window*factor
+  logPrices = np.log(np.asarray(prices))
+  returns = np.diff(logPrices, axis=0)
+  # sum of the returns in a window is the difference of log prices at its ends
+  mean = (logPrices[n:] - logPrices[:-n])/n
+  squares = np.empty((len(returns) + 1,) + returns.shape[1:], dtype=returns.dtype)
+  squares[0] = 0
+  np.cumsum(returns**2, axis=0, out=squares[1:])
+  var = np.maximum((squares[n:] - squares[:-n])/n - mean**2, 0)
+  return np.sqrt(var)*np.sqrt(factor*365)
+
 def calculateIVConstant(RV, c,clap):
   return np.minimum(RV + c,clap)
 
@@ -1,8 +1,32 @@
 import math
+import numpy as np
+from collections import namedtuple
 from BlackScholes import black_scholes
+
+# markets of an amm are stored in preallocated columns that double when full
+INITIAL_CAPACITY = 64
+# IV of the amm is per second
+SQRT_SECONDS_PER_YEAR = math.sqrt(86400*365)
+# fees are at most this percent of the collateral of a trade
+COLLATERAL_FEE_CAP = 12.5
+# bounds of the IV set by trades, per second (20% and 200% per year)
+MIN_IV = 0.0000356
+MAX_IV = 0.000356
+
+# value of the pool in collateral, greeks of its markets weighted by their exposure relative to the trade size,
+# the call delta hedged by strategies and the bToken and wToken balances of the markets that are not settled
+Risk = namedtuple('Risk', ['value', 'delta', 'gamma', 'vega', 'theta', 'callDelta', 'bBalance', 'wBalance'])
+# markets of BatchMinterAmm.activeColumns that are not settled: mask, strikes (NaN for settled markets),
+# bToken and wToken reserves and exposure (0 for settled markets) and the reserves of every path
+Positions = namedtuple('Positions', ['active', 'strike', 'bReserve', 'wReserve', 'exposure', 'bBalance', 'wBalance'])
+
+def _grow(column, capacity, fill):
+    grown = np.full(column.shape[:-1] + (capacity,), fill, dtype=column.dtype)
+    grown[..., :column.shape[-1]] = column
+    return grown
+
 class Market:
-    strike = None
-    expiration = None
+    __slots__ = ('strike', 'expiration')
     
     def __init__(self, strike, expiration):
         self.strike = strike
@@ -35,59 +59,87 @@ class Market:
         return "Strike: {}, Expiration Date: {} \n".format(self.strike, self.expiration)
 
 class MinterAmm:
-    markets = []
-    bTokenReserve = []
-    wTokenReserve = []
-    collateralReserve = 0.0
-    feePercent = 0.0
-    settledMarkets = []
-    currentPrice = None
-    timestamp = None
-    IV = None
-    targetIV = None
-    ivUpdated = None
-    ivDecayRate = None
-    impactMultiplier = None
-    accruedFees = 0.0
+    """
+    Market state is kept in numpy columns indexed by market index,
+    activeMarkets holds the indexes of markets that are not settled yet,
+    so settle and valuation do not scan settled markets.
+    quotes caches the current IV and price of every market and option type (see _quote),
+    quoteHits and quoteMisses count its lookups.
+    """
+    __slots__ = (
+        'markets', 'strikes', 'expirations', 'bTokenReserve', 'wTokenReserve', 'IV', 'ivUpdated',
+        'settledMarkets', 'activeMarkets', 'collateralReserve', 'feePercent', 'currentPrice', 'timestamp',
+        'targetIV', 'ivDecayRate', 'impactMultiplier', 'accruedFees', 'quotes', 'quoteHits', 'quoteMisses'
+    )
     
     def __init__(self, collateralReserve, feePercent, markets, targetIV, ivDecayRate, timestamp):
-        self.markets = markets
-        self.bTokenReserve = [0.0 for i in range(len(markets))]
-        self.wTokenReserve = [0.0 for i in range(len(markets))]
-        self.settledMarkets = [False for i in range(len(markets))]
-        self.IV = [targetIV for i in range(len(markets))]
+        self.markets = []
+        self.strikes = np.zeros(INITIAL_CAPACITY)
+        self.expirations = np.zeros(INITIAL_CAPACITY)
+        self.bTokenReserve = np.zeros(INITIAL_CAPACITY)
+        self.wTokenReserve = np.zeros(INITIAL_CAPACITY)
+        self.settledMarkets = np.zeros(INITIAL_CAPACITY, dtype=bool)
+        self.IV = np.zeros(INITIAL_CAPACITY)
+        self.ivUpdated = np.zeros(INITIAL_CAPACITY)
+        self.activeMarkets = []
         self.timestamp = timestamp
-        self.ivUpdated = [timestamp for i in range(len(markets))]
         self.targetIV = targetIV
         self.collateralReserve = collateralReserve
         self.feePercent = feePercent
         self.ivDecayRate = ivDecayRate
+        self.currentPrice = None
+        self.impactMultiplier = None
+        self.accruedFees = 0.0
+        self.quotes = {}
+        self.quoteHits = 0
+        self.quoteMisses = 0
+        self.addMarkets(markets)
         
     def setCurrentPrice(self, price):
+        if price != self.currentPrice:
+            self.quotes.clear()
         self.currentPrice = price
         
     def addMarkets(self, markets):
-        index = len(self.markets)
         for market in markets:    
+            index = len(self.markets)
+            if index == len(self.strikes):
+                self._grow(2 * index)
             self.markets.append(market)
-            self.IV.append(self.targetIV)
-            self.bTokenReserve.append(0.0)
-            self.wTokenReserve.append(0.0)
-            self.ivUpdated.append(self.timestamp.timestamp())
-            self.settledMarkets.append(False)
+            self.strikes[index] = market.strike
+            self.expirations[index] = market.expiration
+            self.IV[index] = self.targetIV
+            self.bTokenReserve[index] = 0.0
+            self.wTokenReserve[index] = 0.0
+            self.ivUpdated[index] = self.timestamp
+            self.settledMarkets[index] = False
+            self.activeMarkets.append(index)
+
+    def _grow(self, capacity):
+        self.strikes = _grow(self.strikes, capacity, 0.0)
+        self.expirations = _grow(self.expirations, capacity, 0.0)
+        self.bTokenReserve = _grow(self.bTokenReserve, capacity, 0.0)
+        self.wTokenReserve = _grow(self.wTokenReserve, capacity, 0.0)
+        self.settledMarkets = _grow(self.settledMarkets, capacity, False)
+        self.IV = _grow(self.IV, capacity, 0.0)
+        self.ivUpdated = _grow(self.ivUpdated, capacity, 0.0)
     
+    # timestamps and expirations are epoch seconds
     def setTimestamp(self, timestamp):
+        if timestamp != self.timestamp:
+            self.quotes.clear()
         self.timestamp = timestamp  
         
     def setTargetIV(self, targetIV):
+        self.quotes.clear()
         self.targetIV = targetIV    
         
     # Return IV for a market with decay
     def getCurrentIV(self, marketIndex):
         # the iv is quoted in seconds
         iv = self.IV[marketIndex]
-        # decay = self.getExposure(marketIndex) * self.ivDecayRate * (self.timestamp.timestamp() - self.ivUpdated[marketIndex])
-        decay = self.ivDecayRate * (self.timestamp.timestamp() - self.ivUpdated[marketIndex])
+        # decay = self.getExposure(marketIndex) * self.ivDecayRate * (self.timestamp - self.ivUpdated[marketIndex])
+        decay = self.ivDecayRate * (self.timestamp - self.ivUpdated[marketIndex])
         
         if iv < self.targetIV:
             return min(self.targetIV, iv + decay)
@@ -96,25 +148,24 @@ class MinterAmm:
     
     def updateIV(self, marketIndex, priceWithSlippage, optionType):
         market = self.markets[marketIndex]
-        spotPrice = self.getPriceForMarket(marketIndex, optionType)
-                
-        currentIV = self.getCurrentIV(marketIndex) * math.sqrt(86400*365)        
+        currentIV, spotPrice = self._quote(marketIndex, optionType)
         
         # vega - change in price based on change in iv
-        vega = black_scholes.black_scholes_vega_call(self.timestamp.timestamp(), self.currentPrice,  market.strike, market.expiration.timestamp(), currentIV)/self.currentPrice
+        vega = black_scholes.black_scholes_vega_call(self.timestamp, self.currentPrice,  market.strike, market.expiration, currentIV)/self.currentPrice
         # vega = max(vega, 1e-4)
         
         # change IV to reflect the slippage
         priceDiff = priceWithSlippage - spotPrice
                 
-        newIV = (currentIV + priceDiff / vega) / math.sqrt(86400*365)
+        newIV = (currentIV + priceDiff / vega) / SQRT_SECONDS_PER_YEAR
         
         #if newIV > 0.000356:
         #    print('High IV:', newIV, priceWithSlippage, spotPrice, vega, self.collateralReserve, self.timestamp, market.expiration, self.getCurrentIV(marketIndex), self.currentPrice)
         
         # min 20%, max 200%
-        self.IV[marketIndex] = max(min(newIV, 0.000356), 0.0000356)
-        self.ivUpdated[marketIndex] = self.timestamp.timestamp()
+        self.IV[marketIndex] = max(min(newIV, MAX_IV), MIN_IV)
+        self.ivUpdated[marketIndex] = self.timestamp
+        self.quotes.pop(marketIndex, None)
         
     def getVirtualReserves(self, marketIndex, optionType):
         bTokenBalance = self.bTokenBalance(marketIndex)
@@ -152,11 +203,30 @@ class MinterAmm:
         return bTokenVirtualBalance, wTokenVirtualBalance
     
     def getPriceForMarket(self, marketIndex, optionType):
-        market = self.markets[marketIndex]
-        iv = self.getCurrentIV(marketIndex)*math.sqrt(86400*365)
-        price = black_scholes.black_scholes(self.timestamp.timestamp(), self.currentPrice,  market.strike, market.expiration.timestamp(),iv, optionType )/self.currentPrice
         # set lower bound on option price
-        return price # max(price, 0.0001)
+        return self._quote(marketIndex, optionType)[1] # max(price, 0.0001)
+
+    # Current IV (per year) and price of a market. A quote depends on the timestamp, the current price,
+    # the target IV and the IV of the market, it is kept until one of them changes through
+    # setTimestamp, setCurrentPrice, setTargetIV or updateIV
+    def _quote(self, marketIndex, optionType):
+        quotes = self.quotes.get(marketIndex)
+        if quotes is None:
+            quotes = self.quotes[marketIndex] = {}
+        quote = quotes.get(optionType)
+        if quote is not None:
+            self.quoteHits += 1
+            return quote
+        self.quoteMisses += 1
+        market = self.markets[marketIndex]
+        iv = self.getCurrentIV(marketIndex)*SQRT_SECONDS_PER_YEAR
+        price = black_scholes.black_scholes(self.timestamp, self.currentPrice,  market.strike, market.expiration,iv, optionType )/self.currentPrice
+        quote = quotes[optionType] = (iv, price)
+        return quote
+
+    def quoteStats(self):
+        lookups = self.quoteHits + self.quoteMisses
+        return {'hits': self.quoteHits, 'misses': self.quoteMisses, 'hit_rate': self.quoteHits / lookups if lookups else 0.0}
         
     # sell bToken    
     def bTokenGetCollateralOut(self, marketIndex, bTokenAmount, optionType):
@@ -206,14 +276,40 @@ class MinterAmm:
         fee = self.calcFee(wTokenAmount, wTokenAmount - collateralAmount)
         return collateralAmount + fee, fee
     
+    # Quotes of many trade sizes of a market, the virtual reserves are computed once.
+    # Like getPriceB, positive amounts sell and negative amounts buy tokens.
+    # Returns arrays of the collateral (fee included, as from the GetCollateral functions), the fee
+    # and the price per token. Sizes the pool can not fill are NaN.
+    def bTokenQuotes(self, marketIndex, deltaB, optionType):
+        bTokenBalance, wTokenBalance = self.getVirtualReserves(marketIndex, optionType)
+        return self._batchQuotes(deltaB, bTokenBalance, wTokenBalance, True)
+
+    def wTokenQuotes(self, marketIndex, deltaW, optionType):
+        bTokenBalance, wTokenBalance = self.getVirtualReserves(marketIndex, optionType)
+        return self._batchQuotes(deltaW, wTokenBalance, bTokenBalance, False)
+
+    def _batchQuotes(self, delta, balance, otherBalance, bToken):
+        # balance is the virtual reserve of the traded token, same operations as the GetCollateral functions
+        delta = np.asarray(delta, dtype=np.float64)
+        amount = np.abs(delta)
+        sell = delta > 0
+        with np.errstate(invalid='ignore', divide='ignore'):
+            toSquare = amount + balance + otherBalance
+            collateralOut = (toSquare - np.sqrt(toSquare ** 2 - (amount * otherBalance * 4))) / 2
+            toSquare = balance + otherBalance - amount
+            collateralIn = (np.sqrt(toSquare ** 2 + (amount * otherBalance * 4)) + amount - balance - otherBalance) / 2
+            collateralAmount = np.where(sell, collateralOut, collateralIn)
+            fee = self.calcFees(amount, collateralAmount if bToken else amount - collateralAmount)
+            collateralAmount = np.where(sell, collateralAmount - fee, collateralAmount + fee)
+            price = collateralAmount / amount
+        return collateralAmount, fee, price
+
+    # slippage of buying (or selling) bTokenAmount bTokens in percent of the price, bTokenAmount can be an array of sizes
     def getSlippage(self, marketIndex, bTokenAmount, optionType, buy=True,):
-        if buy:
-            collateralAmount, fee = self.bTokenGetCollateralIn(marketIndex, bTokenAmount, optionType)
-        else:
-            collateralAmount, fee = self.bTokenGetCollateralOut(marketIndex, bTokenAmount, optionType)
-        priceWithSlippage = collateralAmount / bTokenAmount 
-        spotPrice = self.getPriceForMarket(marketIndex)
-        return (priceWithSlippage / spotPrice - 1)*100
+        bTokenAmount = np.asarray(bTokenAmount, dtype=np.float64)
+        _, _, priceWithSlippage = self.bTokenQuotes(marketIndex, -bTokenAmount if buy else bTokenAmount, optionType)
+        spotPrice = self.getPriceForMarket(marketIndex, optionType)
+        return ((priceWithSlippage / spotPrice - 1)*100)[()]
         
     def bTokenBuy(self, marketIndex, bTokenAmount, optionType):      
         if self.settledMarkets[marketIndex]: raise Exception("Market already settled")
@@ -233,7 +329,7 @@ class MinterAmm:
         
         self.bTokenReserve[marketIndex] -= bTokenAmount
         # Update IV
-        self.updateIV(marketIndex, (collateralAmount - fee) / bTokenAmount)
+        self.updateIV(marketIndex, (collateralAmount - fee) / bTokenAmount, optionType)
         
         return collateralAmount
 
@@ -259,16 +355,16 @@ class MinterAmm:
             self.wTokenReserve[marketIndex] -= toClose
             
         # Update IV
-        self.updateIV(marketIndex, (collateralAmount + fee) / bTokenAmount)
+        self.updateIV(marketIndex, (collateralAmount + fee) / bTokenAmount, optionType)
                 
         return collateralAmount
     
-    def wTokenBuy(self, marketIndex, wTokenAmount):      
+    def wTokenBuy(self, marketIndex, wTokenAmount, optionType):      
         if self.settledMarkets[marketIndex]: raise Exception("Market already settled")
             
         priorExposure = self.getExposure(marketIndex)
         
-        collateralAmount, fee = self.wTokenGetCollateralIn(marketIndex, wTokenAmount)
+        collateralAmount, fee = self.wTokenGetCollateralIn(marketIndex, wTokenAmount, optionType)
         self.collateralReserve += collateralAmount - fee
         self.accruedFees += fee
         
@@ -284,7 +380,7 @@ class MinterAmm:
         self.wTokenReserve[marketIndex] -= wTokenAmount
         
         # Update IV
-        self.updateIV(marketIndex, 1 - (collateralAmount - fee) / wTokenAmount)
+        self.updateIV(marketIndex, 1 - (collateralAmount - fee) / wTokenAmount, optionType)
         
         return collateralAmount
 
@@ -310,7 +406,7 @@ class MinterAmm:
             self.wTokenReserve[marketIndex] -= toClose
                 
         # Update IV
-        self.updateIV(marketIndex, 1 - (collateralAmount + fee) / wTokenAmount)
+        self.updateIV(marketIndex, 1 - (collateralAmount + fee) / wTokenAmount, optionType)
                 
         return collateralAmount
     
@@ -344,13 +440,11 @@ class MinterAmm:
         
     def getPriceB(self, marketIndex, deltaB, optionType):
         # Positive = sell, negative = buy
-        collateralAmount, fee = self.bTokenGetCollateralOut(marketIndex, deltaB, optionType) if deltaB > 0 else self.bTokenGetCollateralIn(marketIndex, -deltaB, bTokenBuy)
-        return collateralAmount / abs(deltaB)
+        return self.bTokenQuotes(marketIndex, deltaB, optionType)[2][()]
 
     def getPriceW(self, marketIndex, deltaW, optionType):
         # Positive = sell, negative = buy
-        collateralAmount, fee = self.wTokenGetCollateralOut(marketIndex, deltaW, optionType) if deltaW > 0 else self.wTokenGetCollateralIn(marketIndex, -deltaW)
-        return collateralAmount / abs(deltaW)
+        return self.wTokenQuotes(marketIndex, deltaW, optionType)[2][()]
     
     def getExposure(self, marketIndex):
         bBalance = self.bTokenBalance(marketIndex)
@@ -358,20 +452,26 @@ class MinterAmm:
         return bBalance - wBalance
     
     def calcFee(self, notionalAmount, collateralAmount):
-        collateralFeeCap = 12.5
         notionalFee = notionalAmount * self.feePercent / 100
-        collateralFee = collateralAmount * collateralFeeCap / 100
+        collateralFee = collateralAmount * COLLATERAL_FEE_CAP / 100
         
         return min(notionalFee, collateralFee)    
+
+    # calcFee of arrays
+    def calcFees(self, notionalAmount, collateralAmount):
+        return np.minimum(notionalAmount * self.feePercent / 100, collateralAmount * COLLATERAL_FEE_CAP / 100)
     
     def settle(self, option, hedged_value = 0):
         settledIV = []
         buyerShares = []
         writerShares = []
         self.collateralReserve+=hedged_value
-        for i in range(len(self.markets)):
+        active = []
+        for i in self.activeMarkets:
             market = self.markets[i]
-            if not self.settledMarkets[i] and market.expiration <= self.timestamp:
+            if self.expirations[i] > self.timestamp:
+                active.append(i)
+            else:
                 # print("Settled")
                 bBalance = self.bTokenBalance(i)
                 wBalance = self.wTokenBalance(i)
@@ -384,34 +484,253 @@ class MinterAmm:
                 settledIV.append(self.getCurrentIV(i))
                 buyerShares.append(buyerShare)
                 writerShares.append(writerShare)
+        self.activeMarkets = active
         return settledIV, buyerShares, writerShares
                 
     def force_settle_all_markets(self, option):
-        for i in range(len(self.markets)):
+        for i in self.activeMarkets:
             market = self.markets[i]
-            if not self.settledMarkets[i]:
-                # print("Settled")
-                bBalance = self.bTokenBalance(i)
-                wBalance = self.wTokenBalance(i)
-                buyerShare, writerShare = market.getSettlementAmounts(self.currentPrice, option)
-                #print(buyerShare, writerShare)
-                self.collateralReserve += bBalance * buyerShare + wBalance * writerShare
-                self.bTokenReserve[i] = 0.0
-                self.wTokenReserve[i] = 0.0
-                self.settledMarkets[i] = True
+            # print("Settled")
+            bBalance = self.bTokenBalance(i)
+            wBalance = self.wTokenBalance(i)
+            buyerShare, writerShare = market.getSettlementAmounts(self.currentPrice, option)
+            #print(buyerShare, writerShare)
+            self.collateralReserve += bBalance * buyerShare + wBalance * writerShare
+            self.bTokenReserve[i] = 0.0
+            self.wTokenReserve[i] = 0.0
+            self.settledMarkets[i] = True
+        self.activeMarkets = []
                 
     
+    # bPrices of the markets that are not settled, in order of activeMarkets
     def getPoolValue(self, bPrices):
-        poolValue = self.collateralReserve
-        ny_settled = list(filter(lambda x: x == False, self.settledMarkets))
-        for i in range(len(ny_settled)):
-            bPrice = bPrices[i]
-            wPrice = 1 - bPrice
-            bBalance = self.bTokenBalance(i)
-            wBalance = self.wTokenBalance(i)
-            poolValue += bPrice * bBalance + wPrice * wBalance
-            
-        return poolValue
+        active = np.asarray(self.activeMarkets, dtype=np.int64)
+        bPrices = np.asarray(bPrices, dtype=np.float64)[:len(active)]
+        bBalance = self.bTokenReserve[active]
+        wBalance = self.wTokenReserve[active]
+        return self.collateralReserve + np.sum(bPrices * bBalance + (1 - bPrices) * wBalance)
+
+    # Greeks of the markets that are not settled, in order of activeMarkets, at the current price and timestamp,
+    # one computation over all markets. A single market is priced with scalars, numpy has a large overhead for single values.
+    def getMarketGreeks(self, IV, optionType):
+        active = self.activeMarkets
+        if len(active) == 1:
+            i = active[0]
+            T = max(self.expirations[i] - self.timestamp, 0) / black_scholes.SECONDS_PER_YEAR
+            return black_scholes.bs_greeks(self.currentPrice, self.strikes[i], T, IV, optionType)
+        T = black_scholes.years_to_expiration(self.timestamp, self.expirations[active])
+        return black_scholes.bs_greeks(self.currentPrice, self.strikes[active], T, IV, optionType)
+
+    # Risk of the pool from getMarketGreeks in one computation over the markets that are not settled.
+    # Put markets get their call delta from put-call parity (r = 0), so every greek is evaluated once.
+    def getRisk(self, IV, optionType, tradeSize):
+        active = self.activeMarkets
+        greeks = self.getMarketGreeks(IV, optionType)
+        bPrice = greeks.price / self.currentPrice
+        if len(active) == 1:
+            bBalance = self.bTokenReserve[active[0]]
+            wBalance = self.wTokenReserve[active[0]]
+            value = self.collateralReserve + (bPrice * bBalance + (1 - bPrice) * wBalance)
+            weight = (bBalance - wBalance) / tradeSize
+            delta = greeks.delta * weight
+            callDelta = (greeks.delta + 1.0) * weight if optionType == 'put' else delta
+            return Risk(value, delta, greeks.gamma * weight, greeks.vega * weight, greeks.theta * weight, callDelta, bBalance, wBalance)
+        bBalance = self.bTokenReserve[active]
+        wBalance = self.wTokenReserve[active]
+        value = self.collateralReserve + np.sum(bPrice * bBalance + (1 - bPrice) * wBalance)
+        weights = (bBalance - wBalance) / tradeSize
+        delta, gamma, vega, theta = np.sum(np.array(greeks[1:]) * weights, axis=1)
+        callDelta = np.sum((greeks.delta + 1.0) * weights) if optionType == 'put' else delta
+        return Risk(value, delta, gamma, vega, theta, callDelta, np.sum(bBalance), np.sum(wBalance))
+
     # def hedge(poolDelta):
         
-        
\ No newline at end of file
+        
+
+class BatchMinterAmm:
+    """
+    One MinterAmm per path for the batched simulation.
+    Market columns are 2-D arrays (n_paths, capacity), every path lists its own markets
+    and marketCount is the number of markets of every path.
+    Columns before firstActive are settled on every path, settle and valuation start at firstActive.
+    positions caches getPositions until settle, addMarkets or bTokenBuyDirect change them.
+    """
+    __slots__ = (
+        'n_paths', 'strikes', 'expirations', 'bTokenReserve', 'wTokenReserve', 'settledMarkets',
+        'marketCount', 'columnCount', 'firstActive', 'collateralReserve', 'currentPrice', 'timestamp', 'positions'
+    )
+
+    def __init__(self, n_paths, collateralReserve, timestamp):
+        self.n_paths = n_paths
+        self.strikes = np.full((n_paths, INITIAL_CAPACITY), np.nan)
+        self.expirations = np.zeros((n_paths, INITIAL_CAPACITY))
+        self.bTokenReserve = np.zeros((n_paths, INITIAL_CAPACITY))
+        self.wTokenReserve = np.zeros((n_paths, INITIAL_CAPACITY))
+        self.settledMarkets = np.ones((n_paths, INITIAL_CAPACITY), dtype=bool)
+        self.marketCount = np.zeros(n_paths, dtype=np.int64)
+        # columns used by some path, the maximum of marketCount
+        self.columnCount = 0
+        self.firstActive = 0
+        self.collateralReserve = np.full(n_paths, collateralReserve, dtype=np.float64)
+        self.currentPrice = None
+        self.timestamp = timestamp
+        self.positions = None
+
+    def setCurrentPrice(self, price):
+        self.currentPrice = price
+
+    def setTimestamp(self, timestamp):
+        self.timestamp = timestamp
+
+    def addMarkets(self, strike, expiration, listed):
+        # one new market on the listed paths, returns its index (-1 on other paths)
+        count = self.columnCount + 1
+        if count > self.strikes.shape[1]:
+            capacity = 2 * self.strikes.shape[1]
+            self.strikes = _grow(self.strikes, capacity, np.nan)
+            self.expirations = _grow(self.expirations, capacity, 0.0)
+            self.bTokenReserve = _grow(self.bTokenReserve, capacity, 0.0)
+            self.wTokenReserve = _grow(self.wTokenReserve, capacity, 0.0)
+            self.settledMarkets = _grow(self.settledMarkets, capacity, True)
+        rows = np.flatnonzero(listed)
+        index = self.marketCount[rows]
+        self.strikes[rows, index] = np.broadcast_to(strike, listed.shape)[rows]
+        self.expirations[rows, index] = expiration
+        self.bTokenReserve[rows, index] = 0.0
+        self.wTokenReserve[rows, index] = 0.0
+        self.settledMarkets[rows, index] = False
+        self.marketCount[rows] += 1
+        self.columnCount = self.marketCount.max(initial=0)
+        self.positions = None
+        # paths that skipped listings add markets before firstActive
+        if len(rows):
+            self.firstActive = min(self.firstActive, index.min())
+        return np.where(listed, self.marketCount - 1, -1)
+
+    def lastMarket(self):
+        return self.marketCount - 1
+
+    def activeColumns(self):
+        # columns of the markets that can be active on some path
+        return slice(self.firstActive, self.columnCount)
+
+    def getPositions(self):
+        # Positions of the markets of activeColumns, arrays (n_paths, markets)
+        if self.positions is None:
+            columns = self.activeColumns()
+            active = ~self.settledMarkets[:, columns]
+            bReserve = np.where(active, self.bTokenReserve[:, columns], 0.0)
+            wReserve = np.where(active, self.wTokenReserve[:, columns], 0.0)
+            self.positions = Positions(
+                active,
+                np.where(active, self.strikes[:, columns], np.nan),
+                bReserve,
+                wReserve,
+                bReserve - wReserve,
+                np.sum(bReserve, axis=1),
+                np.sum(wReserve, axis=1)
+            )
+        return self.positions
+
+    def _take(self, column, marketIndex, fill):
+        rows = np.arange(self.n_paths)
+        return np.where(marketIndex >= 0, column[rows, np.maximum(marketIndex, 0)], fill)
+
+    def strike(self, marketIndex):
+        # NaN on paths without a market
+        return self._take(self.strikes, marketIndex, np.nan)
+
+    def isActive(self, marketIndex):
+        return ~self._take(self.settledMarkets, marketIndex, True)
+
+    def bTokenBalance(self, marketIndex):
+        return self._take(self.bTokenReserve, marketIndex, 0.0)
+
+    def wTokenBalance(self, marketIndex):
+        return self._take(self.wTokenReserve, marketIndex, 0.0)
+
+    def getExposure(self, marketIndex):
+        return self.bTokenBalance(marketIndex) - self.wTokenBalance(marketIndex)
+
+    def bTokenBuyDirect(self, marketIndex, bTokenAmount, collateralAmount, option):
+        # MinterAmm.bTokenBuyDirect on the paths with marketIndex >= 0
+        listed = marketIndex >= 0
+        rows = np.flatnonzero(listed)
+        index = marketIndex[rows]
+        self.collateralReserve[rows] += collateralAmount[rows]
+
+        # Mint tokens
+        toMint = bTokenAmount[rows] - self.bTokenReserve[rows, index]
+        minted = toMint > 0
+        mintRows, mintIndex, toMint = rows[minted], index[minted], toMint[minted]
+        if option == 'call':
+            self.collateralReserve[mintRows] -= toMint
+        else:
+            self.collateralReserve[mintRows] -= toMint * self.strikes[mintRows, mintIndex]
+        self.bTokenReserve[mintRows, mintIndex] += toMint
+        self.wTokenReserve[mintRows, mintIndex] += toMint
+
+        self.bTokenReserve[rows, index] -= bTokenAmount[rows]
+        self.positions = None
+        return collateralAmount
+
+    def settle(self, option, hedged_value = 0):
+        # settles expired markets of every path in one computation over the columns from firstActive,
+        # returns the mean shares of the markets settled on every path (NaN if none was settled)
+        self.collateralReserve += hedged_value
+        columns = self.activeColumns()
+        expired = ~self.settledMarkets[:, columns] & (self.expirations[:, columns] <= self.timestamp)
+        settled = expired.sum(axis=1)
+        if not settled.any():
+            return np.full(self.n_paths, np.nan), np.full(self.n_paths, np.nan)
+        strike = self.strikes[:, columns]
+        price = self.currentPrice[:, None]
+        if option == 'call':
+            itm = price > strike
+            writerShare = np.where(itm, strike / price, 1.0)
+            buyerShare = np.where(itm, 1.0 - writerShare, 0.0)
+        else:
+            itm = price < strike
+            writerShare = np.where(itm, price, strike)
+            buyerShare = np.where(itm, strike - writerShare, 0.0)
+        bReserve = self.bTokenReserve[:, columns]
+        wReserve = self.wTokenReserve[:, columns]
+        self.collateralReserve += np.sum(np.where(expired, bReserve * buyerShare + wReserve * writerShare, 0.0), axis=1)
+        bReserve[expired] = 0.0
+        wReserve[expired] = 0.0
+        self.settledMarkets[:, columns] |= expired
+        self.positions = None
+        with np.errstate(invalid='ignore'):
+            buyerShares = np.sum(np.where(expired, buyerShare, 0.0), axis=1) / settled
+            writerShares = np.sum(np.where(expired, writerShare, 0.0), axis=1) / settled
+        stop = columns.stop
+        while self.firstActive < stop and self.settledMarkets[:, self.firstActive].all():
+            self.firstActive += 1
+        return np.where(settled > 0, buyerShares, np.nan), np.where(settled > 0, writerShares, np.nan)
+
+    # Greeks of the markets of activeColumns of every path, arrays (n_paths, markets) in one computation.
+    # Greeks of settled markets are NaN.
+    def getMarketGreeks(self, IV, optionType):
+        columns = self.activeColumns()
+        T = black_scholes.years_to_expiration(self.timestamp, self.expirations[:, columns])
+        return black_scholes.bs_greeks(self.currentPrice[:, None], self.getPositions().strike, T, IV[:, None], optionType)
+
+    # MinterAmm.getRisk of every path, arrays (n_paths,) from one computation over paths and markets
+    def getRisk(self, IV, optionType, tradeSize):
+        positions = self.getPositions()
+        active = positions.active
+        greeks = self.getMarketGreeks(IV, optionType)
+        weights = positions.exposure / tradeSize[:, None]
+        bPrice = greeks.price / self.currentPrice[:, None]
+        value = self.collateralReserve + np.sum(np.where(active, bPrice * positions.bReserve + (1 - bPrice) * positions.wReserve, 0.0), axis=1)
+        delta, gamma, vega, theta = np.sum(np.where(active, np.array(greeks[1:]) * weights, 0.0), axis=2)
+        callDelta = np.sum(np.where(active, (greeks.delta + 1.0) * weights, 0.0), axis=1) if optionType == 'put' else delta
+        return Risk(value, delta, gamma, vega, theta, callDelta, positions.bBalance, positions.wBalance)
+
+    # last market of every path that is not settled (-1 if none), from the mask of getPositions
+    def lastActiveMarket(self, active):
+        width = active.shape[1]
+        if width == 0:
+            return np.full(self.n_paths, -1)
+        last = width - 1 - np.argmax(active[:, ::-1], axis=1)
+        return np.where(active.any(axis=1), self.firstActive + last, -1)
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from BlackScholes import black_scholes
+
+SECONDS_PER_HOUR = 3600
+SECONDS_PER_DAY = 24*SECONDS_PER_HOUR
+# 1970-01-01 is a Thursday, weekday 3
+EPOCH_WEEKDAY = 3
+EXPIRY_WEEKDAY = 4
+EXPIRY_HOUR = 8
+
+
+def is_expiration(timestamps):
+    # utils.is_expiration for epoch seconds (UTC)
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    days, seconds = np.divmod(timestamps, SECONDS_PER_DAY)
+    return ((days + EPOCH_WEEKDAY) % 7 == EXPIRY_WEEKDAY) & (seconds // SECONDS_PER_HOUR == EXPIRY_HOUR)
+
+
+def next_expiry(timestamps):
+    # utils.get_next_expiry for epoch seconds (UTC), friday 8:00 of the day or of the next friday
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    days = timestamps // SECONDS_PER_DAY
+    friday = days + (EXPIRY_WEEKDAY - (days + EPOCH_WEEKDAY)) % 7
+    return friday * SECONDS_PER_DAY + EXPIRY_HOUR * SECONDS_PER_HOUR
+
+
+class Clock(object):
+    """
+    Simulation clock, precomputed for every step of the horizon.
+    timestamps are int64 epoch seconds, is_expiry marks the steps where markets settle and are listed,
+    next_expiry_index is the first expiry step after every step (n_steps if there is none),
+    week counts the expiry steps up to every step (-1 before the first),
+    expiration is the expiration of the market listed at the last expiry step
+    and time_to_expiry the years left until it.
+    """
+
+    def __init__(self, dates):
+        self.dates = pd.DatetimeIndex(dates)
+        self.n_steps = len(self.dates)
+        self.timestamps = self.dates.asi8 // 10**9
+        self.is_expiry = is_expiration(self.timestamps)
+
+        steps = np.arange(self.n_steps)
+        expiry_steps = np.flatnonzero(self.is_expiry)
+        self.next_expiry_index = np.append(expiry_steps, self.n_steps)[np.searchsorted(expiry_steps, steps, side='right')]
+        self.week = np.cumsum(self.is_expiry) - 1
+
+        # markets are listed at an expiry step and expire the week after
+        last_expiry = np.maximum.accumulate(np.where(self.is_expiry, steps, -1))
+        listed = np.where(last_expiry >= 0, self.timestamps[np.maximum(last_expiry, 0)], self.timestamps)
+        self.expiration = next_expiry(listed + SECONDS_PER_DAY)
+        self.time_to_expiry = black_scholes.years_to_expiration(self.timestamps, self.expiration)
+
+    @classmethod
+    def from_start(cls, start_time, n_steps):
+        # hourly clock from start_time
+        return cls(pd.date_range(start=start_time, periods=n_steps, freq='1H'))
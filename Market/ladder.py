@@ -0,0 +1,36 @@
+import numpy as np
+
+from Market import clock
+
+
+class Ladder(object):
+    """
+    Markets listed by the pool at every expiry step: one market for every target delta and tenor.
+    A tenor of w weeks lists a market every w weeks that expires w weeks later,
+    so tenors (1, 4) are weekly markets plus overlapping 4-week (monthly) ones.
+    Weeks count the expiry steps of the simulation, the first expiry step is week 0.
+    The collateral of the pool at a listing is split equally between the markets listed.
+    Ladder([target_delta]) is the single weekly market of the simulation.
+    """
+
+    def __init__(self, target_deltas, tenors=(1,)):
+        self.target_deltas = [float(delta) for delta in np.atleast_1d(target_deltas)]
+        self.tenors = sorted(set(int(tenor) for tenor in np.atleast_1d(tenors)))
+        if not self.target_deltas or not self.tenors:
+            raise ValueError("A ladder needs at least one target delta and one tenor")
+        if self.tenors[0] < 1:
+            raise ValueError("Tenors are in weeks and have to be at least 1")
+
+    def is_single(self):
+        return len(self.target_deltas) == 1 and self.tenors == [1]
+
+    def listings(self, week):
+        # target delta and tenor of every market listed at the expiry step of week, in listing order
+        return [(delta, tenor) for tenor in self.tenors if week % tenor == 0 for delta in self.target_deltas]
+
+    def expiration(self, weekly_expiration, tenor):
+        # expiration of a market of tenor weeks listed at a step whose weekly market expires at weekly_expiration
+        return weekly_expiration + (tenor - 1) * 7 * clock.SECONDS_PER_DAY
+
+    def __repr__(self):
+        return f"Ladder({self.target_deltas}, {self.tenors})"
@@ -0,0 +1,447 @@
+import math
+import numpy as np
+import pandas as pd
+
+from BlackScholes import black_scholes, black_scholes_numba
+from Market import amm_market
+
+# Order flow replay: trader orders (bToken and wToken buys and sells) are sent to a MinterAmm
+# in time order, with the underlying price of an hourly price path.
+# Orders are generated as a seeded Poisson process or read from a recorded file.
+# The python engine calls the MinterAmm methods, the numba engine runs the same arithmetic
+# in a compiled kernel and writes the final state back to the amm.
+
+# numba is optional, without it the numba engine falls back to the python engine
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# float division by zero gives inf like numpy scalars in MinterAmm, e.g. for a put priced 0 at expiry
+if numba is not None:
+    _jit = numba.njit(cache=True, error_model='numpy')
+else:
+    _jit = lambda fn: fn
+
+ENGINES = ['numba', 'python']
+KINDS = ['b_buy', 'b_sell', 'w_buy', 'w_sell']
+B_BUY, B_SELL, W_BUY, W_SELL = range(len(KINDS))
+# probabilities of the kinds of generated orders
+DEFAULT_MIX = [0.4, 0.2, 0.2, 0.2]
+# status of an order in the event log
+FILLED, EXPIRED, UNFILLABLE = 0, 1, 2
+STATUSES = ['filled', 'expired', 'unfillable']
+
+ORDER_DTYPE = np.dtype([('timestamp', np.int64), ('market', np.int32), ('kind', np.int8), ('amount', np.float64)])
+# one row per order: the order, its status and for filled orders the collateral paid (buys) or received (sells),
+# the fee and the IV (per year) of the market after the trade
+EVENT_DTYPE = np.dtype([
+    ('timestamp', np.int64), ('market', np.int32), ('kind', np.int8), ('status', np.int8),
+    ('amount', np.float64), ('collateral', np.float64), ('fee', np.float64), ('iv', np.float64),
+])
+STEP_COLUMNS = ['pool_value', 'collateral_reserve', 'accrued_fees']
+
+
+def available():
+    return numba is not None
+
+
+def poisson_orders(start, stop, rate, n_markets=1, mean_size=1.0, mix=DEFAULT_MIX, seed=None, expirations=None):
+    """
+    Orders arriving as a Poisson process of rate orders per hour between the timestamps start and stop.
+    Kinds are drawn with the probabilities mix (in the order of KINDS), markets uniformly
+    and amounts from an exponential distribution with mean mean_size.
+    With the expirations of the markets (sorted), markets are drawn among those not expired at the order.
+    """
+    rng = np.random.default_rng(seed)
+    n = rng.poisson(rate * (stop - start) / 3600)
+    orders = np.empty(n, dtype=ORDER_DTYPE)
+    # given their number, the arrival times of a Poisson process are uniform
+    orders['timestamp'] = np.sort(rng.integers(start, stop, n))
+    if expirations is None:
+        orders['market'] = rng.integers(0, n_markets, n)
+    else:
+        # first market not expired at every order, orders after the last expiration go to the last market
+        first = np.minimum(np.searchsorted(expirations, orders['timestamp'], side='right'), n_markets - 1)
+        orders['market'] = first + np.floor(rng.random(n) * (n_markets - first)).astype(np.int64)
+    orders['kind'] = rng.choice(len(KINDS), n, p=mix)
+    orders['amount'] = rng.exponential(mean_size, n)
+    return orders
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Parquet order files require pyarrow: pip install pyarrow, or use .csv or .npy")
+    return pyarrow
+
+
+def write_orders(file, orders):
+    # .npy keeps the array, .csv and .parquet have the columns of ORDER_DTYPE with kinds as names
+    if file.endswith('.npy'):
+        np.save(file, orders)
+        return
+    frame = pd.DataFrame({name: orders[name] for name in ORDER_DTYPE.names})
+    frame['kind'] = np.asarray(KINDS)[frame['kind']]
+    if file.endswith('.parquet'):
+        _import_pyarrow()
+        frame.to_parquet(file, index=False)
+    else:
+        frame.to_csv(file, index=False)
+
+
+def read_orders(file):
+    # orders of write_orders or any file with these columns, sorted by timestamp
+    if file.endswith('.npy'):
+        orders = np.load(file).astype(ORDER_DTYPE)
+    else:
+        if file.endswith('.parquet'):
+            _import_pyarrow()
+            frame = pd.read_parquet(file)
+        else:
+            frame = pd.read_csv(file, float_precision='round_trip')
+        orders = np.empty(len(frame), dtype=ORDER_DTYPE)
+        for name in ['timestamp', 'market', 'amount']:
+            orders[name] = frame[name]
+        kinds = frame['kind'].astype(str)
+        unknown = set(kinds) - set(KINDS)
+        if unknown:
+            raise ValueError(f"Unknown order kinds {sorted(unknown)}")
+        orders['kind'] = kinds.map({kind: i for i, kind in enumerate(KINDS)})
+    return orders[np.argsort(orders['timestamp'], kind='stable')]
+
+
+def replay(amm, orders, timestamps, prices, optionType, engine='numba'):
+    """
+    Sends orders (ORDER_DTYPE, sorted by timestamp) to amm, every order is traded at the price
+    of the last step of the hourly path (timestamps, prices) before it.
+    Markets expired at a step are settled at its price, like MinterAmm.settle in the simulation.
+    Returns the event log (EVENT_DTYPE) and the steps: pool value, collateral reserve, accrued fees
+    and IV (per year) of every market at every step, after settlement and before the orders of the step.
+    Orders of expired or settled markets are not traded, nor are orders without a finite quote,
+    e.g. of a put priced 0 near expiration.
+    """
+    if optionType not in ('call', 'put'):
+        raise ValueError("optionType must be call or put")
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+    if len(orders) and (orders['timestamp'][0] < timestamps[0] or np.any(np.diff(orders['timestamp']) < 0)):
+        raise ValueError("Orders must be sorted by timestamp and start after the first step")
+    if len(orders) and (orders['market'].min() < 0 or orders['market'].max() >= len(amm.markets)):
+        raise ValueError("Orders of unknown markets")
+    if engine == 'numba' and not available():
+        print("[!] numba is not installed, using the python engine")
+        engine = 'python'
+    # first order of every step
+    bounds = np.searchsorted(orders['timestamp'], timestamps, side='left')
+    bounds = np.append(bounds, len(orders))
+    bounds[0] = 0
+    events = np.empty(len(orders), dtype=EVENT_DTYPE)
+    for name in ORDER_DTYPE.names:
+        events[name] = orders[name]
+    n_markets = len(amm.markets)
+    steps = {column: np.empty(len(timestamps)) for column in STEP_COLUMNS}
+    steps['iv'] = np.empty((len(timestamps), n_markets))
+    if engine == 'numba':
+        _replay_numba(amm, orders, timestamps, prices, bounds, optionType, events, steps)
+    elif engine == 'python':
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            _replay_python(amm, orders, timestamps, prices, bounds, optionType, events, steps)
+    else:
+        raise ValueError(f"Unknown engine {engine}")
+    return events, steps
+
+
+def _replay_python(amm, orders, timestamps, prices, bounds, optionType, events, steps):
+    trades = {B_BUY: amm.bTokenBuy, B_SELL: amm.bTokenSell, W_BUY: amm.wTokenBuy, W_SELL: amm.wTokenSell}
+    quotes = {B_BUY: amm.bTokenGetCollateralIn, B_SELL: amm.bTokenGetCollateralOut,
+        W_BUY: amm.wTokenGetCollateralIn, W_SELL: amm.wTokenGetCollateralOut}
+    order_timestamps = orders['timestamp'].tolist()
+    order_markets = orders['market'].tolist()
+    order_kinds = orders['kind'].tolist()
+    order_amounts = orders['amount'].tolist()
+    status = events['status']
+    collateral = events['collateral']
+    fees = events['fee']
+    ivs = events['iv']
+    for k in range(len(timestamps)):
+        price = prices[k]
+        amm.setTimestamp(int(timestamps[k]))
+        amm.setCurrentPrice(price)
+        amm.settle(optionType)
+        poolValue = amm.collateralReserve
+        for m in amm.activeMarkets:
+            bPrice = amm.getPriceForMarket(m, optionType)
+            poolValue += bPrice * amm.bTokenBalance(m) + (1 - bPrice) * amm.wTokenBalance(m)
+        steps['pool_value'][k] = poolValue
+        steps['collateral_reserve'][k] = amm.collateralReserve
+        steps['accrued_fees'][k] = amm.accruedFees
+        for m in range(len(amm.markets)):
+            steps['iv'][k, m] = amm.getCurrentIV(m) * amm_market.SQRT_SECONDS_PER_YEAR
+        for i in range(bounds[k], bounds[k + 1]):
+            m = order_markets[i]
+            kind = order_kinds[i]
+            amount = order_amounts[i]
+            amm.setTimestamp(order_timestamps[i])
+            if amm.settledMarkets[m] or order_timestamps[i] >= amm.expirations[m]:
+                status[i] = EXPIRED
+                continue
+            # a trade without a finite quote would fail or break the amm state
+            try:
+                quote, fee = quotes[kind](m, amount, optionType)
+            except ValueError:
+                quote = math.nan
+            if not math.isfinite(quote):
+                status[i] = UNFILLABLE
+                continue
+            trades[kind](m, amount, optionType)
+            status[i] = FILLED
+            collateral[i] = quote
+            fees[i] = fee
+            ivs[i] = amm.IV[m] * amm_market.SQRT_SECONDS_PER_YEAR
+    not_filled = status != FILLED
+    collateral[not_filled] = np.nan
+    fees[not_filled] = np.nan
+    ivs[not_filled] = np.nan
+
+
+def _replay_numba(amm, orders, timestamps, prices, bounds, optionType, events, steps):
+    n = len(amm.markets)
+    strikes = np.ascontiguousarray(amm.strikes[:n])
+    expirations = np.ascontiguousarray(amm.expirations[:n])
+    bReserve = amm.bTokenReserve[:n].copy()
+    wReserve = amm.wTokenReserve[:n].copy()
+    IV = amm.IV[:n].copy()
+    ivUpdated = amm.ivUpdated[:n].copy()
+    settled = amm.settledMarkets[:n].copy()
+    state = np.array([amm.collateralReserve, amm.accruedFees, amm.feePercent, amm.targetIV, amm.ivDecayRate], dtype=np.float64)
+    put = optionType == 'put'
+    _replay(orders['timestamp'], orders['market'], orders['kind'], orders['amount'], timestamps, prices, bounds,
+        strikes, expirations, bReserve, wReserve, IV, ivUpdated, settled, state, put, 2.0,
+        events['status'], events['collateral'], events['fee'], events['iv'],
+        steps['pool_value'], steps['collateral_reserve'], steps['accrued_fees'], steps['iv'])
+    # the amm ends in the state of the python engine
+    amm.bTokenReserve[:n] = bReserve
+    amm.wTokenReserve[:n] = wReserve
+    amm.IV[:n] = IV
+    amm.ivUpdated[:n] = ivUpdated
+    amm.settledMarkets[:n] = settled
+    amm.activeMarkets = [m for m in amm.activeMarkets if not settled[m]]
+    amm.collateralReserve = state[0]
+    amm.accruedFees = state[1]
+    amm.setTimestamp(int(max(timestamps[-1], orders['timestamp'][-1])) if len(orders) else int(timestamps[-1]))
+    amm.setCurrentPrice(prices[-1])
+    amm.quotes.clear()
+
+
+def steps_frame(timestamps, steps):
+    # steps of replay as a DataFrame indexed by date, with an iv_<market> column per market
+    index = pd.to_datetime(np.asarray(timestamps), unit='s', utc=True).rename('date')
+    frame = pd.DataFrame({column: steps[column] for column in STEP_COLUMNS}, index=index)
+    for m in range(steps['iv'].shape[1]):
+        frame[f'iv_{m}'] = steps['iv'][:, m]
+    return frame
+
+
+def summary(events, steps, seconds=None):
+    # counts per kind and status, fees and final pool value of a replay, orders per second with the replay time
+    out = {'orders': len(events)}
+    for s, name in enumerate(STATUSES):
+        out[name] = int(np.sum(events['status'] == s))
+    filled = events[events['status'] == FILLED]
+    for k, kind in enumerate(KINDS):
+        out[kind] = int(np.sum(filled['kind'] == k))
+    out['fees'] = float(np.sum(filled['fee']))
+    out['final_pool_value'] = float(steps['pool_value'][-1])
+    if seconds is not None:
+        out['seconds'] = seconds
+        out['orders_per_second'] = len(events) / seconds if seconds > 0 else math.inf
+    return out
+
+
+# Kernel: the arithmetic of MinterAmm in the same order of operations.
+# Python min and max keep their first argument unless the second is smaller (larger),
+# _min and _max do the same so NaNs propagate like in MinterAmm.
+
+@_jit
+def _min(a, b):
+    return b if b < a else a
+
+
+@_jit
+def _max(a, b):
+    return b if b > a else a
+
+
+@_jit
+def _years(timestamp, expiration):
+    # black_scholes.years_to_expiration
+    return _max(expiration - timestamp, 0.0) / black_scholes.SECONDS_PER_YEAR
+
+
+@_jit
+def _current_iv(IV, ivUpdated, m, timestamp, targetIV, ivDecayRate):
+    iv = IV[m]
+    decay = ivDecayRate * (timestamp - ivUpdated[m])
+    if iv < targetIV:
+        return _min(targetIV, iv + decay)
+    return _max(targetIV, iv - decay)
+
+
+@_jit
+def _virtual_reserves(bBalance, wBalance, collateralReserve, bTokenPrice):
+    bTokenBalanceMax = bBalance + collateralReserve
+    wTokenBalanceMax = wBalance + collateralReserve
+    wTokenPrice = 1.0 - bTokenPrice
+    if bTokenPrice <= wTokenPrice:
+        bTokenVirtualBalance = bTokenBalanceMax
+        wTokenVirtualBalance = bTokenVirtualBalance * bTokenPrice / wTokenPrice
+        if wTokenVirtualBalance > wTokenBalanceMax:
+            wTokenVirtualBalance = wTokenBalanceMax
+            bTokenVirtualBalance = wTokenVirtualBalance * wTokenPrice / bTokenPrice
+    else:
+        wTokenVirtualBalance = wTokenBalanceMax
+        bTokenVirtualBalance = wTokenVirtualBalance * wTokenPrice / bTokenPrice
+        if bTokenVirtualBalance > bTokenBalanceMax:
+            bTokenVirtualBalance = bTokenBalanceMax
+            wTokenVirtualBalance = bTokenVirtualBalance * bTokenPrice / wTokenPrice
+    return bTokenVirtualBalance, wTokenVirtualBalance
+
+
+@_jit
+def _quote(kind, amount, bBalance, wBalance, feePercent, two):
+    # collateral (fee included) and fee of the GetCollateral functions, NaN if the pool can not fill it.
+    # Squares are x ** two with two known only at run time, numba compiles x ** 2 to x * x
+    # which is not always equal to the pow() of python floats
+    if kind == B_SELL:
+        toSquare = amount + bBalance + wBalance
+        root = toSquare ** two - (amount * wBalance * 4)
+        if root < 0:
+            return math.nan, math.nan
+        collateralAmount = (toSquare - math.sqrt(root)) / 2
+        fee = _min(amount * feePercent / 100, collateralAmount * amm_market.COLLATERAL_FEE_CAP / 100)
+        return collateralAmount - fee, fee
+    if kind == B_BUY:
+        sumBalance = bBalance + wBalance
+        toSquare = sumBalance - amount if sumBalance > amount else amount - sumBalance
+        collateralAmount = (math.sqrt(toSquare ** two + (amount * wBalance * 4)) + amount - bBalance - wBalance) / 2
+        fee = _min(amount * feePercent / 100, collateralAmount * amm_market.COLLATERAL_FEE_CAP / 100)
+        return collateralAmount + fee, fee
+    if kind == W_SELL:
+        toSquare = amount + wBalance + bBalance
+        root = toSquare ** two - (amount * bBalance * 4)
+        if root < 0:
+            return math.nan, math.nan
+        collateralAmount = (toSquare - math.sqrt(root)) / 2
+        fee = _min(amount * feePercent / 100, (amount - collateralAmount) * amm_market.COLLATERAL_FEE_CAP / 100)
+        return collateralAmount - fee, fee
+    sumBalance = wBalance + bBalance
+    toSquare = sumBalance - amount
+    collateralAmount = (math.sqrt(toSquare ** two + (amount * bBalance * 4)) + amount - wBalance - bBalance) / 2
+    fee = _min(amount * feePercent / 100, (amount - collateralAmount) * amm_market.COLLATERAL_FEE_CAP / 100)
+    return collateralAmount + fee, fee
+
+
+@_jit
+def _replay(order_ts, order_market, order_kind, order_amount, timestamps, prices, bounds,
+        strikes, expirations, bReserve, wReserve, IV, ivUpdated, settled, state, put, two,
+        status, collateral, fees, ivs, pool_value, collateral_reserve, accrued_fees, step_iv):
+    collateralReserve, accruedFees, feePercent, targetIV, ivDecayRate = state[0], state[1], state[2], state[3], state[4]
+    sqrt_year = amm_market.SQRT_SECONDS_PER_YEAR
+    for k in range(len(timestamps)):
+        S = prices[k]
+        timestamp = timestamps[k]
+        # MinterAmm.settle and Market.getSettlementAmounts
+        for m in range(len(strikes)):
+            if settled[m] or expirations[m] > timestamp:
+                continue
+            K = strikes[m]
+            if put:
+                writerShare = K if S >= K else S
+                buyerShare = K - writerShare
+            else:
+                writerShare = 1.0 if S <= K else K / S
+                buyerShare = 1.0 - writerShare
+            collateralReserve += bReserve[m] * buyerShare + wReserve[m] * writerShare
+            bReserve[m] = 0.0
+            wReserve[m] = 0.0
+            settled[m] = True
+        poolValue = collateralReserve
+        for m in range(len(strikes)):
+            iv = _current_iv(IV, ivUpdated, m, timestamp, targetIV, ivDecayRate)
+            if not settled[m]:
+                bPrice = black_scholes_numba.bs_greeks(S, strikes[m], _years(timestamp, expirations[m]), iv * sqrt_year, put)[0] / S
+                poolValue += bPrice * bReserve[m] + (1 - bPrice) * wReserve[m]
+            step_iv[k, m] = iv * sqrt_year
+        pool_value[k] = poolValue
+        collateral_reserve[k] = collateralReserve
+        accrued_fees[k] = accruedFees
+        for i in range(bounds[k], bounds[k + 1]):
+            m = order_market[i]
+            kind = order_kind[i]
+            amount = order_amount[i]
+            timestamp = order_ts[i]
+            collateral[i] = math.nan
+            fees[i] = math.nan
+            ivs[i] = math.nan
+            if settled[m] or timestamp >= expirations[m]:
+                status[i] = EXPIRED
+                continue
+            currentIV = _current_iv(IV, ivUpdated, m, timestamp, targetIV, ivDecayRate) * sqrt_year
+            price, _, _, vega, _ = black_scholes_numba.bs_greeks(S, strikes[m], _years(timestamp, expirations[m]), currentIV, put)
+            spotPrice = price / S
+            bVirtual, wVirtual = _virtual_reserves(bReserve[m], wReserve[m], collateralReserve, spotPrice)
+            quote, fee = _quote(kind, amount, bVirtual, wVirtual, feePercent, two)
+            if not math.isfinite(quote):
+                status[i] = UNFILLABLE
+                continue
+            bBalance = bReserve[m]
+            wBalance = wReserve[m]
+            if kind == B_BUY:
+                collateralReserve += quote - fee
+                toMint = amount - bBalance
+                if toMint > 0:
+                    collateralReserve -= toMint
+                    bReserve[m] += toMint
+                    wReserve[m] += toMint
+                bReserve[m] -= amount
+                priceWithSlippage = (quote - fee) / amount
+            elif kind == B_SELL:
+                collateralReserve -= quote + fee
+                bReserve[m] += amount
+                toClose = _min(bReserve[m], wReserve[m])
+                if toClose > 0:
+                    collateralReserve += toClose
+                    bReserve[m] -= toClose
+                    wReserve[m] -= toClose
+                priceWithSlippage = (quote + fee) / amount
+            elif kind == W_BUY:
+                collateralReserve += quote - fee
+                toMint = amount - wBalance
+                if toMint > 0:
+                    collateralReserve -= toMint
+                    bReserve[m] += toMint
+                    wReserve[m] += toMint
+                wReserve[m] -= amount
+                priceWithSlippage = 1 - (quote - fee) / amount
+            else:
+                collateralReserve -= quote + fee
+                wReserve[m] += amount
+                toClose = _min(bReserve[m], wReserve[m])
+                if toClose > 0:
+                    collateralReserve += toClose
+                    bReserve[m] -= toClose
+                    wReserve[m] -= toClose
+                priceWithSlippage = 1 - (quote + fee) / amount
+            accruedFees += fee
+            # MinterAmm.updateIV
+            newIV = (currentIV + (priceWithSlippage - spotPrice) / (vega / S)) / sqrt_year
+            IV[m] = _max(_min(newIV, amm_market.MAX_IV), amm_market.MIN_IV)
+            ivUpdated[m] = timestamp
+            status[i] = FILLED
+            collateral[i] = quote
+            fees[i] = fee
+            ivs[i] = IV[m] * sqrt_year
+    state[0] = collateralReserve
+    state[1] = accruedFees
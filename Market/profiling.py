@@ -0,0 +1,153 @@
+import os
+import time
+import pstats
+import cProfile
+import functools
+import contextlib
+from collections import Counter, defaultdict
+
+from BlackScholes import black_scholes
+
+# Opt-in instrumentation of simulation runs (runStrategy.py --profile).
+# A job starts a Profiler, the simulation loops add the time of their phases to it with lap()
+# and the Black-Scholes functions count their calls while it is active.
+# Without an active Profiler active() is None and the loops skip the timers.
+
+# phases timed inside the simulation loops, the rest are phases of a job
+SIMULATION_PHASES = ['settle', 'strike_search', 'pricing', 'hedge', 'record']
+JOB_PHASES = ['paths', 'simulation', 'write']
+# counted Black-Scholes functions, a call on arrays counts once
+# and calls made by another counted function are counted too
+COUNTED = [
+    'bs_price', 'bs_delta', 'bs_gamma', 'bs_vega', 'bs_theta', 'bs_greeks',
+    'black_scholes', 'black_scholes_vega_call', 'black_scholes_delta_call', 'black_scholes_delta_put',
+    'strike_for_delta', 'strike_for_delta_call', 'strike_for_delta_put', 'strike_for_delta_bisect',
+]
+
+_active = None
+
+
+def active():
+    return _active
+
+
+class Profiler(object):
+    """
+    Phase timers, Black-Scholes call counts and wall/CPU time of the code run between start() and stop(),
+    with cprofile=True also a cProfile.Profile of it.
+    """
+
+    def __init__(self, cprofile=False):
+        self.phases = defaultdict(float)
+        self.calls = Counter()
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.wall = 0.0
+        self.cpu = 0.0
+
+    def lap(self, phase, start):
+        # adds the time since start to phase and returns the end, which starts the next phase
+        now = time.perf_counter()
+        self.phases[phase] += now - start
+        return now
+
+    def start(self):
+        global _active
+        if _active is not None:
+            raise RuntimeError("A profiler is already active")
+        self._originals = {name: getattr(black_scholes, name) for name in COUNTED}
+        for name, fn in self._originals.items():
+            setattr(black_scholes, name, self._counted(name, fn))
+        _active = self
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+
+    def stop(self):
+        global _active
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        self.wall += time.perf_counter() - self._wall
+        self.cpu += time.process_time() - self._cpu
+        for name, fn in self._originals.items():
+            setattr(black_scholes, name, fn)
+        _active = None
+
+    def _counted(self, name, fn):
+        calls = self.calls
+        @functools.wraps(fn)
+        def counted(*args, **kwargs):
+            calls[name] += 1
+            return fn(*args, **kwargs)
+        return counted
+
+    def report(self):
+        return {
+            'pid': os.getpid(),
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'phases': dict(self.phases),
+            'bs_calls': dict(self.calls),
+        }
+
+
+@contextlib.contextmanager
+def phase(name):
+    # times a block as phase name of the active profiler, does nothing without one
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profiler.lap(name, start)
+
+
+def merge_reports(reports):
+    # sums of wall and CPU time, phases and call counts of job reports
+    merged = {'jobs': len(reports), 'wall': 0.0, 'cpu': 0.0, 'phases': Counter(), 'bs_calls': Counter()}
+    for report in reports:
+        merged['wall'] += report['wall']
+        merged['cpu'] += report['cpu']
+        merged['phases'].update(report['phases'])
+        merged['bs_calls'].update(report['bs_calls'])
+    merged['phases'] = dict(merged['phases'])
+    merged['bs_calls'] = dict(merged['bs_calls'])
+    # time of the simulation outside the timed phases, e.g. engines without phase timers
+    simulated = sum(merged['phases'].get(name, 0.0) for name in SIMULATION_PHASES)
+    if 'simulation' in merged['phases']:
+        merged['phases']['simulation_other'] = merged['phases']['simulation'] - simulated
+    return merged
+
+
+def run_report(reports, wall, **run):
+    # report of a run from the reports of its jobs, totals and sums per worker process
+    workers = defaultdict(list)
+    for report in reports:
+        workers[report['pid']].append(report)
+    return {
+        'run': run,
+        'wall': wall,
+        'total': merge_reports(reports),
+        'workers': {str(pid): merge_reports(worker) for pid, worker in workers.items()},
+        'jobs': reports,
+    }
+
+
+def job_stats_name(pid, chunk_id, *cell):
+    return '-'.join(str(x) for x in ('job', pid, *cell, chunk_id)) + '.pstats'
+
+
+def merge_stats(directory):
+    # merges the cProfile dumps of the jobs of every worker into worker-<pid>.pstats
+    dumps = defaultdict(list)
+    for name in sorted(os.listdir(directory)):
+        if name.startswith('job-') and name.endswith('.pstats'):
+            dumps[name.split('-')[1]].append(os.path.join(directory, name))
+    for pid, files in dumps.items():
+        pstats.Stats(*files).dump_stats(os.path.join(directory, f'worker-{pid}.pstats'))
+        for file in files:
+            os.remove(file)
+    return sorted(dumps)
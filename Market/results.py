@@ -0,0 +1,221 @@
+import os
+import glob
+import shutil
+import numpy as np
+import pandas as pd
+
+# Every cell (flag, mu, sigma) has four results:
+# unStdPaths and prices are path matrices (one column per path),
+# dfs and pool_values are per-hour records of every path.
+PATH_RESULTS = ['unStdPaths', 'prices']
+RECORD_RESULTS = ['dfs', 'pool_values']
+RESULTS = PATH_RESULTS + RECORD_RESULTS
+# --summary-only writes the summaries of Market/summary.py instead, rows are indexed by
+SUMMARY_INDEX = {
+    'path_summary': ['epoch_id'],
+    'weekly_summary': ['epoch_id', 'date'],
+}
+
+
+def result_name(name, selected_strategy, num_paths, flag, mu, sigma):
+    return f'{name}-{selected_strategy}-{num_paths}-{flag}-{mu}-{sigma}'
+
+
+def part_name(chunk_id):
+    return f'part-{chunk_id:05d}'
+
+
+class ResultWriter(object):
+    """
+    Writes the results of one cell chunk by chunk.
+    prepare() is called once before the chunks are scheduled,
+    write_chunk() by the workers for every chunk of paths
+    and close() once all chunks are written.
+    results selects the results that are written, the others are ignored by write_chunk.
+    """
+    extension = None
+
+    def __init__(self, saveDir, selected_strategy, num_paths, flag, mu, sigma, results=RESULTS):
+        self.saveDir = saveDir
+        self.names = {name: result_name(name, selected_strategy, num_paths, flag, mu, sigma) for name in results}
+
+    def path(self, name):
+        return os.path.join(self.saveDir, self.names[name] + self.extension)
+
+    def parts_dir(self, name):
+        return os.path.join(self.saveDir, '.parts', self.names[name])
+
+    def prepare(self):
+        for name in self.names:
+            for path in [self.path(name), self.parts_dir(name)]:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.exists(path):
+                    os.remove(path)
+            os.makedirs(self.parts_dir(name))
+
+    def write_chunk(self, chunk_id, unStdPaths=None, prices=None, dfs=None, pool_values=None, **summaries):
+        frames = dict(zip(RESULTS, [unStdPaths, prices, dfs, pool_values]), **summaries)
+        for name in self.names:
+            frame = frames[name]
+            self.write_part(name, os.path.join(self.parts_dir(name), part_name(chunk_id)), frame)
+
+    def write_part(self, name, path, frame):
+        raise NotImplementedError
+
+    def close(self, num_chunks):
+        pass
+
+
+class CSVWriter(ResultWriter):
+    """
+    Same files as before, parts are merged into one csv per result
+    """
+    extension = '.csv'
+
+    def write_part(self, name, path, frame):
+        frame.to_csv(path + self.extension)
+
+    def close(self, num_chunks):
+        for name in self.names:
+            parts = [os.path.join(self.parts_dir(name), part_name(i) + self.extension) for i in range(num_chunks)]
+            if name in PATH_RESULTS:
+                _merge_csv_columns(parts, self.path(name))
+            else:
+                _merge_csv_rows(parts, self.path(name))
+            shutil.rmtree(self.parts_dir(name))
+        _remove_empty_dir(os.path.join(self.saveDir, '.parts'))
+
+
+class ParquetWriter(ResultWriter):
+    """
+    Every result is a directory of parquet files, one per chunk of paths.
+    Path matrices are stored in long format (date, epoch_id, value).
+    """
+    extension = '.parquet'
+    compression = 'zstd'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        _import_pyarrow()
+
+    def write_part(self, name, path, frame):
+        pa, pq = _import_pyarrow()
+        if name in PATH_RESULTS:
+            frame = _to_long(frame)
+        else:
+            frame = _typed_records(frame)
+        table = pa.Table.from_pandas(frame, preserve_index=False)
+        pq.write_table(table, path + self.extension, compression=self.compression)
+
+    def close(self, num_chunks):
+        for name in self.names:
+            os.replace(self.parts_dir(name), self.path(name))
+        _remove_empty_dir(os.path.join(self.saveDir, '.parts'))
+
+
+WRITERS = {
+    'parquet': ParquetWriter,
+    'csv': CSVWriter,
+}
+
+
+def get_writer(fmt, saveDir, selected_strategy, num_paths, flag, mu, sigma, results=RESULTS):
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown output format {fmt}")
+    return WRITERS[fmt](saveDir, selected_strategy, num_paths, flag, mu, sigma, results)
+
+
+def load_results(saveDir, name, selected_strategy, num_paths, flag, mu, sigma, columns=None):
+    """
+    Load one result of a cell, written in any format.
+    Path matrices are returned with one column per path, records indexed by date
+    and summaries by SUMMARY_INDEX. columns selects the columns of records to read.
+    """
+    path = os.path.join(saveDir, result_name(name, selected_strategy, num_paths, flag, mu, sigma))
+    if os.path.isdir(path + ParquetWriter.extension):
+        pa, pq = _import_pyarrow()
+        parts = sorted(glob.glob(os.path.join(path + ParquetWriter.extension, '*' + ParquetWriter.extension)))
+        if columns is not None and name in RECORD_RESULTS:
+            columns = ['date'] + [c for c in columns if c != 'date']
+        table = pa.concat_tables([pq.read_table(part, columns=columns if name in RECORD_RESULTS else None) for part in parts])
+        frame = table.to_pandas()
+        if name in PATH_RESULTS:
+            return _to_wide(frame)
+        return frame.set_index(SUMMARY_INDEX.get(name, 'date'))
+    if os.path.exists(path + CSVWriter.extension):
+        if name in SUMMARY_INDEX:
+            index = SUMMARY_INDEX[name]
+            return pd.read_csv(path + CSVWriter.extension, index_col=list(range(len(index))), parse_dates=[c for c in index if c == 'date'])
+        frame = pd.read_csv(path + CSVWriter.extension, index_col=0, parse_dates=True)
+        if columns is not None and name in RECORD_RESULTS:
+            frame = frame[columns]
+        return frame
+    raise FileNotFoundError(f"No results for {path}")
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Parquet output requires pyarrow: pip install pyarrow, or use --format csv")
+    return pa, pq
+
+
+def _typed_records(frame):
+    frame = frame.reset_index()
+    types = {}
+    for column in frame.columns:
+        if column == 'epoch_id':
+            types[column] = np.int32
+        elif column != 'date':
+            # np.longdouble is not supported by arrow
+            types[column] = np.float64
+    return frame.astype(types)
+
+
+def _to_long(frame):
+    # rows ordered by path and then by date
+    num_dates, num_paths = frame.shape
+    return pd.DataFrame({
+        'date': frame.index[np.tile(np.arange(num_dates), num_paths)],
+        'epoch_id': np.repeat(frame.columns.to_numpy().astype(np.int32), num_dates),
+        'value': frame.to_numpy(dtype=np.float64).T.ravel(),
+    })
+
+
+def _to_wide(frame):
+    epoch_ids = pd.unique(frame['epoch_id'])
+    num_dates = len(frame) // len(epoch_ids)
+    values = frame['value'].to_numpy().reshape(len(epoch_ids), num_dates).T
+    index = pd.DatetimeIndex(frame['date'].iloc[:num_dates], name='date')
+    return pd.DataFrame(values, index=index, columns=epoch_ids)
+
+
+def _merge_csv_rows(parts, target):
+    with open(target, 'w') as out:
+        for i, part in enumerate(parts):
+            with open(part) as f:
+                header = f.readline()
+                if i == 0:
+                    out.write(header)
+                shutil.copyfileobj(f, out)
+
+
+def _merge_csv_columns(parts, target):
+    # line by line, the date column is taken from the first part only
+    files = [open(part) for part in parts]
+    try:
+        with open(target, 'w') as out:
+            for lines in zip(*files):
+                row = [lines[0].rstrip('\n')] + [line.rstrip('\n').split(',', 1)[1] for line in lines[1:]]
+                out.write(','.join(row) + '\n')
+    finally:
+        for f in files:
+            f.close()
+
+
+def _remove_empty_dir(path):
+    if os.path.isdir(path) and not os.listdir(path):
+        os.rmdir(path)
@@ -4,17 +4,38 @@ import os
 import pandas as pd
 import numpy as np
 import sys
-import datetime
-from datetime import timedelta
+import time
 
 currentdir = os.path.dirname(os.getcwd())
 sys.path.insert(0,currentdir)
 
 from BlackScholes import black_scholes
-from Market import amm_market, utils
+from Market import amm_market, utils, clock, profiling
+from Market.ladder import Ladder
+
+DF_COLUMNS = ['date',
+    'epoch_id', 'market_index', 'volume_buy', 'implied_vol','reserve_b','reserve_w','underlying_price',
+    'theoretical_price', 'strike', 'pool_position_delta', 'pool_gamma', 'pool_vega', 'pool_theta', 'per_position_delta'
+]
+POOL_VALUE_COLUMNS = [
+    'date','epoch_id',
+    'pool_value_usd', 'pool_value', 'hedge_value','settled_pool_value',
+    'buyerShare', 'writerShare','collateral_reserve'
+]
+# columns recorded for every path and step by the batched engines
+RECORD_COLUMNS = DF_COLUMNS[2:] + POOL_VALUE_COLUMNS[2:]
+# steps recorded between updates of a summary
+SUMMARY_BLOCK = 168
 
 # Simulation of perpetual
 # Position ->
+# Every step is recorded into a column of record, an array (len(RECORD_COLUMNS), n_steps).
+# A record given by the caller is filled in place and nothing is returned,
+# so the records of many paths can share one allocation.
+# The pool lists the markets of ladder at every expiry step (ladder.Ladder, by default one weekly market of target_delta),
+# records are of the whole pool: reserves, volume and greeks are sums over the markets, strike and market_index
+# are of the last market that is not settled, theoretical_price the mean of the last listing
+# and buyerShare, writerShare the mean of the markets settled at the step.
 def simulation(
     epoch_id,
     price_series,
@@ -24,15 +45,16 @@ def simulation(
     my_strategy,
     min_iv = 0.0,
     target_delta = 0.1,
-    isPut=False
+    isPut=False,
+    record=None,
+    ladder=None
     ):
-    df = []
-    pool_value = []
-    ivTooLow = False
     if isPut:
         optionType = 'put'
     else:
         optionType = 'call'
+    if ladder is None:
+        ladder = Ladder([target_delta])
 
 
     # We move to closest friday at 8:00 UTC from_start_time
@@ -43,23 +65,38 @@ def simulation(
 
 
     IV = implied_vol_series[current_time]
-    amm = amm_market.MinterAmm(collateralReserve, 0.0, [], IV, 0, current_time.timestamp())
+    amm = amm_market.MinterAmm(collateralReserve, 0.0, [], IV, 0, int(current_time.timestamp()))
 
     my_strategy.setAmm(amm)
     my_strategy.getNewTradeSize() # We init trade_size
     trade_size = np.NaN
     theoretical_price = np.NaN
 
+    # times of every step are precomputed, no datetimes in the loop
+    sim_clock = clock.Clock(implied_vol_series[current_time:].index)
+    timestamps = sim_clock.timestamps.tolist()
+    is_expiry = sim_clock.is_expiry.tolist()
+    expirations = sim_clock.expiration.tolist()
+    weeks = sim_clock.week.tolist()
+    returnFrames = record is None
+    if returnFrames:
+        record = np.empty((len(RECORD_COLUMNS), sim_clock.n_steps))
+    elif record.shape != (len(RECORD_COLUMNS), sim_clock.n_steps):
+        raise ValueError(f"record must have shape {(len(RECORD_COLUMNS), sim_clock.n_steps)}")
+
     #convert To numpy to speed up
     price_series = price_series[current_time:].to_numpy()
     implied_vol_series = implied_vol_series[current_time:].to_numpy()
-
-    
+    # phase timers of runStrategy.py --profile
+    prof = profiling.active()
 
     # implied_vol_series.indexes[-1] is end time
     for i in range(implied_vol_series.size):
         price = price_series[i]
         IV = implied_vol_series[i]
+        current_time = timestamps[i]
+        if prof is not None:
+            t = time.perf_counter()
         amm.setTimestamp(current_time)
         amm.setCurrentPrice(price)
         # If its friday do a direct buy and settle your current options if they are ITM
@@ -71,17 +108,14 @@ def simulation(
         perDelta = np.NaN
         perPnL = np.NaN
         # The first run have to be friday and we setup market!!!!!!!
-        if utils.is_expiration(current_time):
-            ivTooLow = False
+        if is_expiry[i]:
             # we calculate PnL from hedging
             perPnL = my_strategy.getPnL(price)
             _, buyerShares, writerShares = amm.settle(optionType,perPnL)
-            if len(buyerShares) > 1 or len(writerShares) > 1:
-                raise ValueError("We should have just one market")
             if len(buyerShares) > 0:
-                buyerShare = buyerShares[0]
+                buyerShare = np.mean(buyerShares)
             if len(writerShares) > 0:
-                writerShare = writerShares[0]
+                writerShare = np.mean(writerShares)
             settledPoolValue = amm.collateralReserve
 
             # We close the remaining positions
@@ -89,38 +123,59 @@ def simulation(
             perDelta = my_strategy.getDelta() 
 
             # We do not sell below some value
-            if IV < min_iv:
-                ivTooLow = True
-            else: 
-                expiration = utils.get_next_expiry(current_time + datetime.timedelta(days=1)) # we have to move to the next week to calculate expiration
-                if isPut:
-                    strike = black_scholes.strike_for_delta_put(target_delta, current_time.timestamp(), price, expiration.timestamp(), IV)
-                else:
-                    strike = black_scholes.strike_for_delta_call(target_delta, current_time.timestamp(), price, expiration.timestamp(), IV)
-                market = amm_market.Market(strike, expiration)
-                amm.addMarkets([market])
-
-
-                #trade_size from strategy
+            if not IV < min_iv:
+                listings = ladder.listings(weeks[i])
+                if prof is not None:
+                    t = prof.lap('settle', t)
+                markets = []
+                for delta, tenor in listings:
+                    expiration = ladder.expiration(expirations[i], tenor)
+                    strike = black_scholes.strike_for_delta(delta, current_time, price, expiration, IV, optionType)
+                    markets.append(amm_market.Market(strike, expiration))
+                if prof is not None:
+                    t = prof.lap('strike_search', t)
+                first = len(amm.markets)
+                amm.addMarkets(markets)
+
+
+                #trade_size from strategy, split between the markets listed
                 #trade_size = amm.collateralReserve
                 trade_size = my_strategy.getNewTradeSize()
-
-                market_index = len(amm.markets) - 1
-                market = amm.markets[market_index]
-                theoretical_price = black_scholes.black_scholes(current_time.timestamp(), price, market.strike, market.expiration.timestamp(), IV, optionType) / price
-                payment_amount = trade_size * theoretical_price
-                amm.bTokenBuyDirect(market_index, trade_size, payment_amount, optionType)
+                size = trade_size / len(markets)
+
+                theoretical_prices = []
+                for market_index, market in enumerate(markets, first):
+                    T = max(market.expiration - current_time, 0) / black_scholes.SECONDS_PER_YEAR
+                    if prof is not None:
+                        t = prof.lap('settle', t)
+                    price_per_collateral = black_scholes.bs_price(price, market.strike, T, IV, optionType) / price
+                    if prof is not None:
+                        t = prof.lap('pricing', t)
+                    payment_amount = size * price_per_collateral
+                    amm.bTokenBuyDirect(market_index, size, payment_amount, optionType)
+                    theoretical_prices.append(price_per_collateral)
+                theoretical_price = np.mean(theoretical_prices)
 
                 #strategyUpdate
-                my_strategy.setMarket(market)
+                my_strategy.setMarket(markets[-1])
+            if prof is not None:
+                t = prof.lap('settle', t)
 
 
-        if not ivTooLow:
-            # we hedge here
+        hasMarkets = len(amm.activeMarkets) > 0
+        if hasMarkets:
+            # value and greeks of the pool, shared by hedging and the records
             trade_size = my_strategy.getLastTradeSize()
+            risk = amm.getRisk(IV, optionType, trade_size)
+            my_strategy.setRisk(risk)
+            if prof is not None:
+                t = prof.lap('pricing', t)
+            # we hedge here
             my_strategy.hedge(current_time, price, IV)
             perPnL = my_strategy.getPnL(price)
             perDelta = my_strategy.getDelta()
+            if prof is not None:
+                t = prof.lap('hedge', t)
           
 
 
@@ -128,35 +183,22 @@ def simulation(
 
         poolValue = amm.collateralReserve
         poolPositionDelta = 0
-        poolExposure = 0
+        poolGamma = 0
+        poolVega = 0
+        poolTheta = 0
         bBalance = np.NaN
         wBalance = np.NaN
         strike = np.NaN
         market_index = np.NaN
-        if not ivTooLow:
-            # get value of all open markets
-            #eps = np.finfo(np.longdouble).eps
-            #toRound = -int(np.log(eps))
-            market_index = len(amm.markets) - 1
-            m = amm.markets[market_index]
-            bTokenPrice = black_scholes.black_scholes(current_time.timestamp(), price, m.strike, m.expiration.timestamp(), IV, optionType)
-            bPrice =  bTokenPrice/ price
-            wPrice = 1 - bPrice
-            bBalance = amm.bTokenBalance(market_index)
-            wBalance = amm.wTokenBalance(market_index)
-            poolValue += bPrice * bBalance + wPrice * wBalance
-            if isPut:
-                marketPositionDelta = - black_scholes.black_scholes_delta_put(current_time.timestamp(), price, m.strike, m.expiration.timestamp(), IV)
-            else:
-                marketPositionDelta = - black_scholes.black_scholes_delta_call(current_time.timestamp(), price, m.strike, m.expiration.timestamp(), IV) 
-            poolPositionDelta += marketPositionDelta
-            poolExposure += amm.getExposure(market_index)
-
-            strike = market.strike
-
-
-        df.append([current_time,
-            epoch_id,
+        if hasMarkets:
+            # value of all open markets
+            poolValue, poolPositionDelta, poolGamma, poolVega, poolTheta, _, bBalance, wBalance = risk
+            market_index = amm.activeMarkets[-1]
+            strike = amm.strikes[market_index]
+
+
+        # in the order of RECORD_COLUMNS
+        record[:, i] = (
             market_index,
             trade_size,
             IV,
@@ -166,12 +208,10 @@ def simulation(
             theoretical_price,
             strike,
             poolPositionDelta,
-            perDelta]
-        )
-        
-        pool_value.append([
-            current_time,
-            epoch_id, 
+            poolGamma,
+            poolVega,
+            poolTheta,
+            perDelta,
             poolValue * price,
             poolValue,
             perPnL,
@@ -179,23 +219,222 @@ def simulation(
             buyerShare,
             writerShare,
             amm.collateralReserve
-        ])
-
-        # at the end we inceremnt time
-        current_time += timedelta(hours=1)
+        )
+        if prof is not None:
+            prof.lap('record', t)
 
         ############# end for loop ################### 
 
 
-    df = pd.DataFrame(df, columns=[ 'date',
-        'epoch_id', 'market_index', 'volume_buy', 'implied_vol','reserve_b','reserve_w','underlying_price',
-        'theoretical_price', 'strike', 'pool_position_delta', 'per_position_delta'
-    ])
-    pool_value = pd.DataFrame(pool_value,columns=[
-        'date','epoch_id',
-        'pool_value_usd', 'pool_value', 'hedge_value','settled_pool_value',
-        'buyerShare', 'writerShare','collateral_reserve'
-    ])
-    df = df.set_index('date')
-    pool_value = pool_value.set_index('date')
-    return df, pool_value
\ No newline at end of file
+    if returnFrames:
+        with profiling.phase('record'):
+            return records_to_frames([epoch_id], sim_clock.dates, {column: record[k, None] for k, column in enumerate(RECORD_COLUMNS)})
+
+# batched methods and the methods they replace in the python engine
+BATCH_METHODS = [('hedge', 'hedgeBatch'), ('canHedge', 'canHedgeBatch')]
+
+def _defined_by(cls, name):
+    # class of the mro of cls that defines name, None if it is not defined
+    for base in cls.__mro__:
+        if name in vars(base):
+            return base
+    return None
+
+def supports_batch(my_strategy):
+    # strategies with the batched protocol (canHedgeBatch, hedgeBatch) can be advanced for all paths at once.
+    # A batched method has to be defined by the same class as the method it replaces,
+    # so a subclass that changes hedge (or canHedge) only is simulated path by path.
+    cls = type(my_strategy)
+    for method, batch in BATCH_METHODS:
+        if _defined_by(cls, batch) is None:
+            return False
+        scalar = _defined_by(cls, method)
+        if scalar is not None and scalar is not _defined_by(cls, batch):
+            return False
+    return True
+
+
+# Batched version of simulation, every path is advanced together
+# price_paths and implied_vol_paths are DataFrames with one column per path
+# The markets of the ladder are valued, settled and aggregated in one computation over paths and markets.
+def simulation_batch(
+    epoch_ids,
+    price_paths,
+    implied_vol_paths,
+    start_time,
+    collateralReserve,
+    my_strategy,
+    min_iv = 0.0,
+    target_delta = 0.1,
+    isPut=False,
+    summary=None,
+    ladder=None
+    ):
+    if not supports_batch(my_strategy):
+        raise ValueError("Strategy can not be simulated in batch")
+    if isPut:
+        optionType = 'put'
+    else:
+        optionType = 'call'
+    if ladder is None:
+        ladder = Ladder([target_delta])
+
+    current_time = utils.get_next_expiry(start_time)
+
+    sim_clock = clock.Clock(implied_vol_paths[current_time:].index)
+    dates = sim_clock.dates
+    # rows are time steps, columns are paths
+    prices = np.asarray(price_paths[current_time:].to_numpy(), dtype=np.float64)
+    ivs = np.asarray(implied_vol_paths[current_time:].to_numpy(), dtype=np.float64)
+    n_steps, n_paths = ivs.shape
+
+    # amm and strategy state of every path
+    amm = amm_market.BatchMinterAmm(n_paths, collateralReserve, sim_clock.timestamps[0])
+    trade_size = np.full(n_paths, np.nan)
+    theoretical_price = np.full(n_paths, np.nan)
+    # perpetual of every path as running aggregates, like utils.Perpetual
+    perpSize = np.zeros(n_paths)
+    perpEntry = np.zeros(n_paths)
+    lastTradeSize = np.full(n_paths, collateralReserve, dtype=np.float64)
+    lastHedged = np.full(n_paths, getattr(my_strategy, 'lasthedged', utils.start_time.timestamp()), dtype=np.float64)
+
+    # records of every path, shape (n_paths, n_steps)
+    # with a summary just a block of steps is kept and passed to it when full
+    block = n_steps if summary is None else min(n_steps, SUMMARY_BLOCK)
+    record = {column: np.full((n_paths, block), np.nan) for column in RECORD_COLUMNS}
+    if summary is not None:
+        summary.start(epoch_ids, sim_clock)
+    # phase timers of runStrategy.py --profile
+    prof = profiling.active()
+
+    for i in range(n_steps):
+        j = i % block
+        if prof is not None:
+            t = time.perf_counter()
+        timestamp = sim_clock.timestamps[i]
+        price = prices[i]
+        IV = ivs[i]
+        amm.setTimestamp(timestamp)
+        amm.setCurrentPrice(price)
+
+        settledPoolValue = np.nan
+        buyerShare = np.full(n_paths, np.nan)
+        writerShare = np.full(n_paths, np.nan)
+        expiry = sim_clock.is_expiry[i]
+        perPnL = np.full(n_paths, np.nan)
+        perDelta = np.full(n_paths, np.nan)
+        if expiry:
+            # settle the expired markets of every path with the PnL from hedging
+            perPnL = perpSize - perpEntry/price
+            buyerShare, writerShare = amm.settle(optionType, perPnL)
+            settledPoolValue = amm.collateralReserve.copy()
+
+            # We close the remaining positions
+            perpSize[:] = 0.0
+            perpEntry[:] = 0.0
+            perDelta = perpSize/lastTradeSize
+
+            # We do not sell below some value
+            listed = ~(IV < min_iv)
+            if listed.any():
+                listings = ladder.listings(sim_clock.week[i])
+                # trade_size from strategy, split between the markets listed
+                trade_size[listed] = amm.collateralReserve[listed]
+                lastTradeSize[listed] = trade_size[listed]
+                size = trade_size / len(listings)
+                theoretical_prices = []
+                for delta, tenor in listings:
+                    expiration = ladder.expiration(sim_clock.expiration[i], tenor)
+                    strike = np.full(n_paths, np.nan)
+                    if prof is not None:
+                        t = prof.lap('settle', t)
+                    strike[listed] = black_scholes.strike_for_delta(delta, timestamp, price[listed], expiration, IV[listed], optionType)
+                    if prof is not None:
+                        t = prof.lap('strike_search', t)
+                    market_index = amm.addMarkets(strike, expiration, listed)
+                    T = black_scholes.years_to_expiration(timestamp, expiration)
+                    if prof is not None:
+                        t = prof.lap('settle', t)
+                    price_per_collateral = np.full(n_paths, np.nan)
+                    price_per_collateral[listed] = black_scholes.bs_price(price[listed], strike[listed], T, IV[listed], optionType) / price[listed]
+                    if prof is not None:
+                        t = prof.lap('pricing', t)
+                    amm.bTokenBuyDirect(market_index, size, size * price_per_collateral, optionType)
+                    theoretical_prices.append(price_per_collateral[listed])
+                theoretical_price[listed] = np.mean(theoretical_prices, axis=0)
+            if prof is not None:
+                t = prof.lap('settle', t)
+
+        if expiry or i == 0:
+            # the markets of every path change only at expiry steps
+            active = amm.getPositions().active
+            hasMarkets = active.any(axis=1)
+            last = amm.lastActiveMarket(active)
+            lastStrike = np.where(hasMarkets, amm.strike(last), np.nan)
+        # value and greeks of the pool of every path, shared by hedging and the records
+        risk = amm.getRisk(IV, optionType, lastTradeSize)
+        if prof is not None:
+            t = prof.lap('pricing', t)
+
+        # we hedge here, strategies hedge with the call delta
+        hedging = np.flatnonzero(hasMarkets)
+        hedging = hedging[my_strategy.canHedgeBatch(timestamp, lastHedged[hedging])]
+        if len(hedging):
+            lastHedged[hedging] = timestamp
+            # hedgeBatch takes the call delta of the markets, the pool is short of them
+            trades = my_strategy.hedgeBatch(timestamp, price[hedging], IV[hedging], -risk.callDelta[hedging], perpSize[hedging], lastTradeSize[hedging])
+            perpSize[hedging] += trades
+            perpEntry[hedging] += price[hedging]*trades
+        perPnL[hasMarkets] = perpSize[hasMarkets] - perpEntry[hasMarkets]/price[hasMarkets]
+        perDelta[hasMarkets] = perpSize[hasMarkets]/lastTradeSize[hasMarkets]
+        if prof is not None:
+            t = prof.lap('hedge', t)
+
+        record['market_index'][:, j] = np.where(hasMarkets, last, np.nan)
+        record['volume_buy'][:, j] = trade_size
+        record['implied_vol'][:, j] = IV
+        record['reserve_b'][:, j] = np.where(hasMarkets, risk.bBalance, np.nan)
+        record['reserve_w'][:, j] = np.where(hasMarkets, risk.wBalance, np.nan)
+        record['underlying_price'][:, j] = price
+        record['theoretical_price'][:, j] = theoretical_price
+        record['strike'][:, j] = lastStrike
+        record['pool_position_delta'][:, j] = risk.delta
+        record['pool_gamma'][:, j] = risk.gamma
+        record['pool_vega'][:, j] = risk.vega
+        record['pool_theta'][:, j] = risk.theta
+        record['per_position_delta'][:, j] = perDelta
+        record['pool_value_usd'][:, j] = risk.value * price
+        record['pool_value'][:, j] = risk.value
+        record['hedge_value'][:, j] = perPnL
+        record['settled_pool_value'][:, j] = settledPoolValue
+        record['buyerShare'][:, j] = buyerShare
+        record['writerShare'][:, j] = writerShare
+        record['collateral_reserve'][:, j] = amm.collateralReserve
+        if summary is not None and (j == block - 1 or i == n_steps - 1):
+            summary.update(slice(None), slice(i - j, i + 1), {column: values[:, :j + 1] for column, values in record.items()})
+        if prof is not None:
+            prof.lap('record', t)
+
+    ############# end for loop ###################
+
+    if summary is not None:
+        return summary
+    with profiling.phase('record'):
+        return records_to_frames(epoch_ids, dates, record)
+
+
+# record holds a (n_paths, n_steps) array for every column of df and pool_value,
+# rows are ordered by path and then by date, as if every path was simulated alone.
+# The columns of the frames are views of contiguous records, they are not copied.
+def records_to_frames(epoch_ids, dates, record):
+    n_paths, n_steps = record['pool_value'].shape
+    index = dates[np.tile(np.arange(n_steps), n_paths)].rename('date')
+    epoch_id = np.repeat(np.asarray(epoch_ids), n_steps)
+    market_index = record['market_index'].ravel()
+    if not np.isnan(market_index).any():
+        market_index = market_index.astype(np.int64)
+    df = {'epoch_id': epoch_id, 'market_index': market_index}
+    df.update((column, record[column].ravel()) for column in DF_COLUMNS[3:])
+    pool_value = {'epoch_id': epoch_id}
+    pool_value.update((column, record[column].ravel()) for column in POOL_VALUE_COLUMNS[2:])
+    return pd.DataFrame(df, index=index, copy=False), pd.DataFrame(pool_value, index=index, copy=False)
@@ -0,0 +1,251 @@
+import math
+import multiprocessing
+import numpy as np
+
+from BlackScholes import black_scholes, black_scholes_numba
+from Market import utils, strategy, clock, simulation
+
+# numba is optional, without it the kernel is plain python and run_simulation
+# falls back to the python engine
+try:
+    import numba
+except ImportError:
+    numba = None
+
+if numba is not None:
+    _jit = numba.njit(cache=True, parallel=True)
+    _prange = numba.prange
+else:
+    _jit = lambda fn: fn
+    _prange = range
+
+# paths simulated by one kernel call when the records go to a summary
+SUMMARY_PATHS = 64
+
+# strategies with a kernel: kind and the parameters of hedge
+NO_HEDGE, INTERVAL_HEDGE, NON_POSITIVE_HEDGE = 0, 1, 2
+
+# column of every record in the kernel output
+_COLUMN = {column: i for i, column in enumerate(simulation.RECORD_COLUMNS)}
+(_MARKET_INDEX, _VOLUME_BUY, _IMPLIED_VOL, _RESERVE_B, _RESERVE_W, _UNDERLYING_PRICE, _THEORETICAL_PRICE,
+ _STRIKE, _POOL_POSITION_DELTA, _POOL_GAMMA, _POOL_VEGA, _POOL_THETA, _PER_POSITION_DELTA, _POOL_VALUE_USD,
+ _POOL_VALUE, _HEDGE_VALUE, _SETTLED_POOL_VALUE, _BUYER_SHARE, _WRITER_SHARE, _COLLATERAL_RESERVE) = range(len(_COLUMN))
+
+
+def available():
+    return numba is not None
+
+
+def strategy_params(my_strategy):
+    """
+    Kind and parameters (interval in seconds, target delta or max negative, range) of a strategy,
+    None for strategies the kernel does not know. Subclasses may change hedge, so types must match.
+    """
+    if type(my_strategy) is strategy.AbstractStrategy:
+        return NO_HEDGE, 0.0, 0.0, 0.0
+    if type(my_strategy) is strategy.DeltaIntervalHedgeStrategy:
+        return INTERVAL_HEDGE, float(my_strategy.interval), float(my_strategy.target_delta), float(my_strategy.range)
+    if type(my_strategy) is strategy.DeltaNonPositiveHedgeStrategy:
+        return NON_POSITIVE_HEDGE, float(my_strategy.interval), float(my_strategy.max_negative), 0.0
+    return None
+
+
+def supports(my_strategy):
+    return available() and strategy_params(my_strategy) is not None
+
+
+def limit_threads():
+    # The kernel runs its paths on numba threads, one per core by default. In the workers of a process pool
+    # (runStrategy.py and sweep.py -c) every worker is already one core, so the kernel runs on one thread.
+    if numba is not None and multiprocessing.current_process().name != 'MainProcess':
+        numba.set_num_threads(1)
+
+
+@_jit
+def _simulate(prices, ivs, strikes, timestamps, is_expiry, expirations, time_to_expiry,
+        collateralReserve, min_iv, put, kind, interval, param, hedge_range, lastHedgedStart, out):
+    # simulation.simulation_batch path by path, every path has one market at a time:
+    # the market listed at the last expiry, settled at the next one
+    n_steps, n_paths = prices.shape
+    for p in _prange(n_paths):
+        collateral = collateralReserve
+        marketCount = 0
+        strike = math.nan
+        expiration = 0
+        bReserve = 0.0
+        wReserve = 0.0
+        settled = True
+        ivTooLow = False
+        trade_size = math.nan
+        theoretical_price = math.nan
+        perpSize = 0.0
+        perpEntry = 0.0
+        lastTradeSize = collateralReserve
+        lastHedged = lastHedgedStart
+
+        for i in range(n_steps):
+            price = prices[i, p]
+            IV = ivs[i, p]
+            timestamp = timestamps[i]
+            T = time_to_expiry[i]
+            settledPoolValue = math.nan
+            buyerShare = math.nan
+            writerShare = math.nan
+            perPnL = math.nan
+            perDelta = math.nan
+            if is_expiry[i]:
+                # settle the expired market with the PnL from hedging
+                perPnL = perpSize - perpEntry/price
+                collateral += perPnL
+                if not settled and expiration <= timestamp:
+                    if put:
+                        writerShare = price if price < strike else strike
+                        buyerShare = strike - writerShare if price < strike else 0.0
+                    else:
+                        writerShare = strike / price if price > strike else 1.0
+                        buyerShare = 1.0 - writerShare if price > strike else 0.0
+                    collateral += bReserve * buyerShare + wReserve * writerShare
+                    bReserve = 0.0
+                    wReserve = 0.0
+                    settled = True
+                settledPoolValue = collateral
+
+                # We close the remaining positions
+                perpSize = 0.0
+                perpEntry = 0.0
+                perDelta = perpSize/lastTradeSize
+
+                # We do not sell below some value
+                ivTooLow = IV < min_iv
+                if not ivTooLow:
+                    strike = strikes[i, p]
+                    expiration = expirations[i]
+                    bReserve = 0.0
+                    wReserve = 0.0
+                    settled = False
+                    marketCount += 1
+
+                    trade_size = collateral
+                    lastTradeSize = trade_size
+                    theoretical_price = black_scholes_numba.bs_greeks(price, strike, T, IV, put)[0] / price
+                    # MinterAmm.bTokenBuyDirect
+                    collateral += trade_size * theoretical_price
+                    toMint = trade_size - bReserve
+                    if toMint > 0:
+                        collateral -= toMint * strike if put else toMint
+                        bReserve += toMint
+                        wReserve += toMint
+                    bReserve -= trade_size
+
+            active = not ivTooLow
+            marketStrike = strike if marketCount > 0 and not settled else math.nan
+            # MinterAmm.getRisk, greeks weighted by the exposure relative to the trade size
+            bTokenPrice, marketDelta, marketGamma, marketVega, marketTheta = black_scholes_numba.bs_greeks(price, marketStrike, T, IV, put)
+            weight = (bReserve - wReserve) / lastTradeSize
+            poolDelta = marketDelta * weight
+            callDelta = (marketDelta + 1.0) * weight if put else poolDelta
+
+            # we hedge here, strategies hedge with the call delta
+            if active and kind != NO_HEDGE and (timestamp - lastHedged) >= interval:
+                lastHedged = timestamp
+                totalDelta = callDelta + perpSize/lastTradeSize
+                trade = 0.0
+                if kind == INTERVAL_HEDGE:
+                    if abs(totalDelta - param) >= hedge_range:
+                        trade = (param - totalDelta)*lastTradeSize
+                else:
+                    # both trades of hedge can apply
+                    if totalDelta >= 0:
+                        trade += -totalDelta*lastTradeSize
+                    if totalDelta <= param:
+                        trade += -(totalDelta - param)*lastTradeSize
+                perpSize += trade
+                perpEntry += price*trade
+            if active:
+                perPnL = perpSize - perpEntry/price
+                perDelta = perpSize/lastTradeSize
+
+            # Consolidate results
+            poolValue = collateral
+            if active:
+                bPrice = bTokenPrice / price
+                poolValue += bPrice * bReserve + (1 - bPrice) * wReserve
+            out[_MARKET_INDEX, p, i] = marketCount - 1 if active else math.nan
+            out[_VOLUME_BUY, p, i] = trade_size
+            out[_IMPLIED_VOL, p, i] = IV
+            out[_RESERVE_B, p, i] = bReserve if active else math.nan
+            out[_RESERVE_W, p, i] = wReserve if active else math.nan
+            out[_UNDERLYING_PRICE, p, i] = price
+            out[_THEORETICAL_PRICE, p, i] = theoretical_price
+            out[_STRIKE, p, i] = marketStrike if active else math.nan
+            out[_POOL_POSITION_DELTA, p, i] = poolDelta if active else 0.0
+            out[_POOL_GAMMA, p, i] = marketGamma * weight if active else 0.0
+            out[_POOL_VEGA, p, i] = marketVega * weight if active else 0.0
+            out[_POOL_THETA, p, i] = marketTheta * weight if active else 0.0
+            out[_PER_POSITION_DELTA, p, i] = perDelta
+            out[_POOL_VALUE_USD, p, i] = poolValue * price
+            out[_POOL_VALUE, p, i] = poolValue
+            out[_HEDGE_VALUE, p, i] = perPnL
+            out[_SETTLED_POOL_VALUE, p, i] = settledPoolValue
+            out[_BUYER_SHARE, p, i] = buyerShare
+            out[_WRITER_SHARE, p, i] = writerShare
+            out[_COLLATERAL_RESERVE, p, i] = collateral
+
+
+# Same arguments and results as simulation.simulation_batch,
+# the hourly loop of every path runs in a compiled kernel
+def simulation_numba(
+    epoch_ids,
+    price_paths,
+    implied_vol_paths,
+    start_time,
+    collateralReserve,
+    my_strategy,
+    min_iv = 0.0,
+    target_delta = 0.1,
+    isPut=False,
+    summary=None
+    ):
+    params = strategy_params(my_strategy)
+    if params is None:
+        raise ValueError("Strategy can not be simulated with numba")
+    kind, interval, param, hedge_range = params
+    optionType = 'put' if isPut else 'call'
+    limit_threads()
+
+    current_time = utils.get_next_expiry(start_time)
+    sim_clock = clock.Clock(implied_vol_paths[current_time:].index)
+    prices = np.ascontiguousarray(price_paths[current_time:].to_numpy(), dtype=np.float64)
+    ivs = np.ascontiguousarray(implied_vol_paths[current_time:].to_numpy(), dtype=np.float64)
+    n_steps, n_paths = ivs.shape
+
+    # strikes do not depend on the state, they are found for all listings at once
+    strikes = np.full((n_steps, n_paths), np.nan)
+    listing = sim_clock.is_expiry[:, None] & (ivs >= min_iv)
+    steps, paths = np.nonzero(listing)
+    if len(steps):
+        strikes[steps, paths] = black_scholes.strike_for_delta(target_delta, sim_clock.timestamps[steps],
+            prices[steps, paths], sim_clock.expiration[steps], ivs[steps, paths], optionType)
+
+    # with a summary the kernel records a block of paths at a time
+    block = n_paths if summary is None else min(n_paths, SUMMARY_PATHS)
+    out = np.empty((len(simulation.RECORD_COLUMNS), block, n_steps))
+    if summary is not None:
+        summary.start(epoch_ids, sim_clock)
+    time_to_expiry = np.asarray(sim_clock.time_to_expiry, dtype=np.float64)
+    lastHedged = float(getattr(my_strategy, 'lasthedged', utils.start_time.timestamp()))
+    for start in range(0, n_paths, block):
+        rows = slice(start, min(start + block, n_paths))
+        n_rows = rows.stop - rows.start
+        if n_rows < out.shape[1]:
+            # contiguous, so the kernel is not compiled again for a strided layout
+            out = np.empty((len(simulation.RECORD_COLUMNS), n_rows, n_steps))
+        _simulate(np.ascontiguousarray(prices[:, rows]), np.ascontiguousarray(ivs[:, rows]), np.ascontiguousarray(strikes[:, rows]),
+            sim_clock.timestamps, sim_clock.is_expiry, sim_clock.expiration, time_to_expiry, float(collateralReserve),
+            float(min_iv), isPut, kind, interval, param, hedge_range, lastHedged, out)
+        if summary is not None:
+            summary.update(rows, slice(0, n_steps), {column: out[i] for column, i in _COLUMN.items()})
+    if summary is not None:
+        return summary
+    record = {column: out[i] for column, i in _COLUMN.items()}
+    return simulation.records_to_frames(epoch_ids, sim_clock.dates, record)
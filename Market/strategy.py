@@ -1,17 +1,25 @@
+import datetime
 from . import utils
 
-from BlackScholes import black_scholes
 import numpy as np
 
 
 class AbstractStrategy(object):
     """
     The strategy can not modify state of Amm and market
+
+    canHedgeBatch and hedgeBatch are the batched protocol, used by the vectorized engine.
+    They get arrays of all paths at a time step and do not change the strategy:
+    canHedgeBatch returns the paths that hedge at current_time given their last hedge time,
+    hedgeBatch returns the perpetual trade of every path given the call delta of its markets
+    (weighted by their exposure relative to the trade size), its perpetual position and its trade size.
+    A subclass that overrides hedge or canHedge has to override its batched method too (simulation.supports_batch).
     """
 
     def __init__(self):
         self.amm = None
         self.currentMarket = None
+        self.currentRisk = None
         self.lastTradeSize = None
 
 
@@ -21,6 +29,16 @@ class AbstractStrategy(object):
     def setMarket(self,market):
         self.currentMarket = market
 
+    def setRisk(self, risk):
+        # amm.getRisk of the current step, set by the simulation before hedge
+        self.currentRisk = risk
+
+    def getCallDelta(self, IV):
+        # call delta of the pool relative to the trade size, from the risk of the step if it is set
+        if self.currentRisk is None:
+            return self.amm.getRisk(IV, 'call', self.getLastTradeSize()).callDelta
+        return self.currentRisk.callDelta
+
     def getPnL(self,price):
         return 0
 
@@ -43,12 +61,19 @@ class AbstractStrategy(object):
     def hedge(self,current_time, price, IV):
         pass
 
+    def canHedgeBatch(self, current_time, lastHedged):
+        return np.zeros(np.shape(lastHedged), dtype=bool)
+
+    def hedgeBatch(self, current_time, price, IV, delta, position, tradeSize):
+        return np.zeros(np.shape(price))
+
 class DeltaAbstractHedgeStrategy(AbstractStrategy):
 
     def __init__(self,interval):
         super().__init__()
-        self.interval = interval
-        self.lasthedged = utils.start_time
+        # current_time of hedge is in epoch seconds
+        self.interval = interval.total_seconds() if isinstance(interval, datetime.timedelta) else interval
+        self.lasthedged = utils.start_time.timestamp()
         self.perpetual = utils.Perpetual()
 
     def getPnL(self,price):
@@ -72,6 +97,9 @@ class DeltaAbstractHedgeStrategy(AbstractStrategy):
             return False
         self.lasthedged = current_time
         return True
+
+    def canHedgeBatch(self, current_time, lastHedged):
+        return (current_time - lastHedged) >= self.interval
         
         
 class DeltaIntervalHedgeStrategy(DeltaAbstractHedgeStrategy):
@@ -85,12 +113,7 @@ class DeltaIntervalHedgeStrategy(DeltaAbstractHedgeStrategy):
             return
         # Do hedging
         tradeSize = self.getLastTradeSize()
-        delta = - black_scholes.black_scholes_delta_call(
-            current_time.timestamp(),
-            price,
-            self.currentMarket.strike,
-            self.currentMarket.expiration.timestamp(),
-            IV)
+        delta = self.getCallDelta(IV)
         # We calculate relative delta to trade_size
         perDelta = self.perpetual.getPositionSize()/tradeSize
 
@@ -101,6 +124,11 @@ class DeltaIntervalHedgeStrategy(DeltaAbstractHedgeStrategy):
             size = self.target_delta - totalDelta
             self.perpetual.addPosition(size*tradeSize, price)
 
+    def hedgeBatch(self, current_time, price, IV, delta, position, tradeSize):
+        totalDelta = - delta + position/tradeSize
+        diff = np.abs(totalDelta - self.target_delta)
+        return np.where(diff >= self.range, (self.target_delta - totalDelta)*tradeSize, 0.0)
+
 
 class DeltaNonPositiveHedgeStrategy(DeltaAbstractHedgeStrategy):
     def __init__(self, interval, max_negative):
@@ -111,12 +139,7 @@ class DeltaNonPositiveHedgeStrategy(DeltaAbstractHedgeStrategy):
         if not self.canHedge(current_time):
             return
         tradeSize = self.getLastTradeSize()
-        delta = - black_scholes.black_scholes_delta_call(
-            current_time.timestamp(),
-            price,
-            self.currentMarket.strike,
-            self.currentMarket.expiration.timestamp(),
-            IV)
+        delta = self.getCallDelta(IV)
         # We calculate relative delta to trade_size
         perDelta = self.perpetual.getPositionSize()/tradeSize
 
@@ -130,4 +153,8 @@ class DeltaNonPositiveHedgeStrategy(DeltaAbstractHedgeStrategy):
             size = totalDelta - self.max_negative
             self.perpetual.addPosition(-size*tradeSize, price)
 
-
+    def hedgeBatch(self, current_time, price, IV, delta, position, tradeSize):
+        totalDelta = - delta + position/tradeSize
+        # both trades of hedge can apply
+        trades = np.where(totalDelta >= 0, -totalDelta*tradeSize, 0.0)
+        return trades + np.where(totalDelta <= self.max_negative, -(totalDelta - self.max_negative)*tradeSize, 0.0)
@@ -0,0 +1,162 @@
+import numpy as np
+import pandas as pd
+
+# Summary mode: the per-hour records are reduced online by accumulators instead of being returned,
+# so a chunk of paths needs memory for its summaries only.
+# Engines call start() once with the epoch ids and clock of the chunk, then update() with
+# blocks of consecutive steps of some paths, in time order for every path.
+
+DEFAULT_QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+
+
+class Accumulator(object):
+    """
+    rows selects paths of the chunk (slice or index array), steps is a slice of steps
+    and values holds an array (rows, steps) for every column of simulation.RECORD_COLUMNS.
+    result() returns the DataFrame of the chunk.
+    """
+    name = None
+
+    def start(self, epoch_ids, sim_clock):
+        self.epoch_ids = np.asarray(epoch_ids)
+        self.dates = sim_clock.dates
+        self.is_expiry = sim_clock.is_expiry
+        self.n_paths = len(self.epoch_ids)
+
+    def update(self, rows, steps, values):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+class PathSummary(Accumulator):
+    """
+    One row per path: final pool value, max drawdown of pool_value_usd (relative to its running peak),
+    PnL of the perpetual settled at expiries and number of weeks with a listed market.
+    """
+    name = 'path_summary'
+
+    def start(self, epoch_ids, sim_clock):
+        super().start(epoch_ids, sim_clock)
+        self.final_pool_value_usd = np.full(self.n_paths, np.nan)
+        self.final_pool_value = np.full(self.n_paths, np.nan)
+        self.final_collateral_reserve = np.full(self.n_paths, np.nan)
+        self.peak = np.full(self.n_paths, -np.inf)
+        self.max_drawdown = np.zeros(self.n_paths)
+        self.hedge_pnl = np.zeros(self.n_paths)
+        self.weeks_listed = np.zeros(self.n_paths, dtype=np.int64)
+        self.previous = _previous(self.n_paths)
+
+    def update(self, rows, steps, values):
+        value = values['pool_value_usd']
+        peak = np.fmax(self.peak[rows][:, None], np.fmax.accumulate(value, axis=1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drawdown = 1 - value/peak
+        self.max_drawdown[rows] = np.fmax(self.max_drawdown[rows], np.fmax.reduce(drawdown, axis=1))
+        self.peak[rows] = peak[:, -1]
+        self.final_pool_value_usd[rows] = value[:, -1]
+        self.final_pool_value[rows] = values['pool_value'][:, -1]
+        self.final_collateral_reserve[rows] = values['collateral_reserve'][:, -1]
+        expiry = np.flatnonzero(self.is_expiry[steps])
+        if len(expiry):
+            self.hedge_pnl[rows] += np.sum(_settled_hedge(self.previous, rows, values, expiry), axis=1)
+            self.weeks_listed[rows] += np.sum(~np.isnan(values['market_index'][:, expiry]), axis=1)
+        _keep_previous(self.previous, rows, values)
+
+    def result(self):
+        return pd.DataFrame({
+            'final_pool_value_usd': self.final_pool_value_usd,
+            'final_pool_value': self.final_pool_value,
+            'final_collateral_reserve': self.final_collateral_reserve,
+            'max_drawdown': self.max_drawdown,
+            'hedge_pnl': self.hedge_pnl,
+            'weeks_listed': self.weeks_listed,
+        }, index=pd.Index(self.epoch_ids, name='epoch_id'))
+
+
+class WeeklySummary(Accumulator):
+    """
+    One row per path and expiry: the settlement, the PnL of the perpetual settled with it and the market listed after it.
+    """
+    name = 'weekly_summary'
+    columns = ['settled_pool_value', 'hedge_pnl', 'buyerShare', 'writerShare', 'pool_value_usd', 'strike', 'implied_vol', 'volume_buy']
+
+    def start(self, epoch_ids, sim_clock):
+        super().start(epoch_ids, sim_clock)
+        self.week_of_step = np.cumsum(self.is_expiry) - 1
+        n_weeks = int(np.sum(self.is_expiry))
+        self.weeks = {column: np.full((self.n_paths, n_weeks), np.nan) for column in self.columns}
+        self.previous = _previous(self.n_paths)
+
+    def update(self, rows, steps, values):
+        expiry = np.flatnonzero(self.is_expiry[steps])
+        if len(expiry):
+            index = np.arange(self.n_paths)[rows][:, None]
+            weeks = self.week_of_step[steps][expiry][None, :]
+            for column in self.columns:
+                if column == 'hedge_pnl':
+                    self.weeks[column][index, weeks] = _settled_hedge(self.previous, rows, values, expiry)
+                else:
+                    self.weeks[column][index, weeks] = values[column][:, expiry]
+        _keep_previous(self.previous, rows, values)
+
+    def result(self):
+        n_weeks = self.weeks[self.columns[0]].shape[1]
+        index = pd.MultiIndex.from_arrays([
+            np.repeat(self.epoch_ids, n_weeks),
+            np.tile(self.dates[self.is_expiry], self.n_paths),
+        ], names=['epoch_id', 'date'])
+        return pd.DataFrame({column: self.weeks[column].ravel() for column in self.columns}, index=index)
+
+
+# The perpetual is closed at an expiry before hedge_value is recorded, the PnL settled into the pool
+# comes from the perpetual of the step before: size - entry/price, with entry = (size - hedge_value)*price of the step before.
+# Accumulators keep the last step of the previous block for it.
+PREVIOUS_COLUMNS = ['per_position_delta', 'volume_buy', 'hedge_value', 'underlying_price']
+
+def _previous(n_paths):
+    return {column: np.full(n_paths, np.nan) for column in PREVIOUS_COLUMNS}
+
+def _keep_previous(previous, rows, values):
+    for column in PREVIOUS_COLUMNS:
+        previous[column][rows] = values[column][:, -1]
+
+def _settled_hedge(previous, rows, values, expiry):
+    before = {column: np.concatenate([previous[column][rows][:, None], values[column][:, :-1]], axis=1)[:, expiry]
+        for column in PREVIOUS_COLUMNS}
+    size = before['per_position_delta'] * before['volume_buy']
+    settled = size - (size - before['hedge_value']) * before['underlying_price'] / values['underlying_price'][:, expiry]
+    # no perpetual when no market was listed
+    return np.where(np.isnan(before['hedge_value']), 0.0, settled)
+
+
+ACCUMULATORS = {accumulator.name: accumulator for accumulator in [PathSummary, WeeklySummary]}
+
+
+class Summary(object):
+    """
+    Accumulators of a chunk, engines use it like a single accumulator.
+    """
+
+    def __init__(self, names):
+        unknown = set(names) - set(ACCUMULATORS)
+        if unknown:
+            raise ValueError(f"Unknown summaries {sorted(unknown)}")
+        self.accumulators = [ACCUMULATORS[name]() for name in names]
+
+    def start(self, epoch_ids, sim_clock):
+        for accumulator in self.accumulators:
+            accumulator.start(epoch_ids, sim_clock)
+
+    def update(self, rows, steps, values):
+        for accumulator in self.accumulators:
+            accumulator.update(rows, steps, values)
+
+    def results(self):
+        return {accumulator.name: accumulator.result() for accumulator in self.accumulators}
+
+
+def quantiles(path_summary, qs=DEFAULT_QUANTILES):
+    # cross-path quantiles of the path summary, exact as it has one row per path
+    return path_summary.quantile(qs).rename_axis('quantile')
@@ -2,12 +2,18 @@ import os
 import sys
 import datetime
 import random
+import numpy as np
 
 currentdir = os.path.dirname(os.getcwd())
 sys.path.insert(0,currentdir)
 start_time = datetime.datetime(2021,1,1,8,tzinfo=datetime.timezone.utc)
 IV_WINDOW = 30
 SAMPLE_LENGTH = 365*24 + IV_WINDOW*24
+# dtype of returns and prices in the simulation, longdouble was used before and is kept as reference
+PRECISIONS = {'float64': np.float64, 'longdouble': np.longdouble}
+# paths can also be stored as float32, they are computed with float64
+STORE_PRECISIONS = dict(PRECISIONS, float32=np.float32)
+DEFAULT_PRECISION = 'float64'
 
 def is_expiration(d):
     return d.weekday() == 4 and d.hour == 8
@@ -26,25 +32,60 @@ def select_delta(strat = None):
 
 
 class Perpetual(object):
+    """
+    Perpetual positions as running aggregates, size and PnL are O(1).
+    PnL of a position is (current_price - entry)/current_price * size,
+    so the sum is netSize - entrySum / current_price.
+    The positions since the last closeAll are kept in a preallocated array (price, size, closed) for close.
+    With trade_log the array keeps every trade, see tradeLog.
+    """
 
-    def __init__(self):
-        #(price at bying, size)
-        self._positions = []
+    def __init__(self, trade_log=False, capacity=1024):
+        self._size = 0
+        self._entry = 0
+        self._history = trade_log
+        self._log = np.empty((capacity, 2))
+        self._closed = np.zeros(capacity, dtype=bool)
+        self._count = 0
+        # first trade of the open positions
+        self._first = 0
 
     def addPosition(self, size, current_price):
-        self._positions.append((current_price,size))
+        self._size += size
+        self._entry += current_price*size
+        if self._count == len(self._log):
+            self._log = np.concatenate([self._log, np.empty_like(self._log)])
+            self._closed = np.concatenate([self._closed, np.zeros_like(self._closed)])
+        self._log[self._count] = (current_price, size)
+        self._count += 1
 
     def close(self,idx):
-        del self._positions[idx]
+        trade = self._first + np.flatnonzero(~self._closed[self._first:self._count])[idx]
+        current_price, size = self._log[trade]
+        self._size -= size
+        self._entry -= current_price*size
+        self._closed[trade] = True
 
     def closeAll(self):
-        self._positions = []
+        self._size = 0
+        self._entry = 0
+        if self._history:
+            self._closed[self._first:self._count] = True
+            self._first = self._count
+        else:
+            # closed positions are not kept without trade log
+            self._closed[:self._count] = False
+            self._count = 0
+            self._first = 0
 
     def getPositionSize(self):
-        return sum(map(lambda x:x[1],self._positions))
+        return self._size
 
     def getPnL(self,current_price):
-        PnL = 0
-        for pos in self._positions:
-            PnL += ((current_price - pos[0])/current_price)*pos[1]
-        return PnL
\ No newline at end of file
+        return self._size - self._entry/current_price
+
+    def tradeLog(self):
+        # (price, size, closed) of every trade
+        if not self._history:
+            raise ValueError("Perpetual was created without trade log")
+        return self._log[:self._count], self._closed[:self._count]
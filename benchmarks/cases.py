@@ -0,0 +1,242 @@
+import shutil
+import tempfile
+import datetime
+import functools
+import numpy as np
+
+from BlackScholes import black_scholes, eth_price_simulation, volatility
+from Market import amm_market, order_flow, simulation, simulation_numba, results, utils
+from Market.ladder import Ladder
+import runStrategy
+import orderFlow
+
+# Benchmarks of the simulator hot paths on synthetic data generated here.
+# A benchmark prepares its data and returns the function that is timed,
+# repeat is the number of timings (see run.py).
+# A function with an items attribute processes that many items per call, e.g. orders,
+# and min_rate is the throughput (items per second) the benchmark must reach.
+BENCHMARKS = {}
+
+STRATEGIES = [
+    ('AbstractStrategy', []),
+    ('DeltaIntervalHedgeStrategy', [datetime.timedelta(hours=3), -0.4, 0.1]),
+    ('DeltaNonPositiveHedgeStrategy', [datetime.timedelta(hours=3), -0.5]),
+]
+SEED = 0
+
+
+def benchmark(name, repeat=5, min_rate=None):
+    def register(setup):
+        BENCHMARKS[name] = (setup, repeat, min_rate)
+        return setup
+    return register
+
+
+@functools.lru_cache(maxsize=None)
+def synthetic_paths(num_paths):
+    return np.random.default_rng(SEED).standard_normal((num_paths, utils.SAMPLE_LENGTH))
+
+
+@functools.lru_cache(maxsize=None)
+def synthetic_market(num_paths):
+    # prices and implied vols of standard normal paths, mu 1.0 and sigma 0.8
+    _, prices, rv = runStrategy.price_paths(synthetic_paths(num_paths), 1.0, 0.8, 2000, utils.SAMPLE_LENGTH)
+    return prices, runStrategy.implied_vols(prices, rv, 0.05)
+
+
+def _options(size):
+    rng = np.random.default_rng(SEED)
+    S = rng.uniform(1000, 3000, size)
+    K = S * rng.uniform(0.8, 1.5, size)
+    T = rng.uniform(1, 7, size) / 365
+    sigma = rng.uniform(0.3, 1.5, size)
+    return S, K, T, sigma
+
+
+@benchmark('bs_price_scalar_10k')
+def bs_price_scalar():
+    options = list(zip(*[x.tolist() for x in _options(10000)]))
+    def run():
+        for S, K, T, sigma in options:
+            black_scholes.bs_price(S, K, T, sigma, 'call')
+    return run
+
+
+@benchmark('bs_greeks_batch_1m')
+def bs_greeks_batch():
+    S, K, T, sigma = _options(10**6)
+    return lambda: black_scholes.bs_greeks(S, K, T, sigma, 'call')
+
+
+def _strike_inputs(size):
+    S, _, T, sigma = _options(size)
+    timestamp = np.full(size, utils.start_time.timestamp())
+    return S, sigma, timestamp, timestamp + T * black_scholes.SECONDS_PER_YEAR
+
+
+@benchmark('strike_for_delta_call_scalar_1k')
+def strike_for_delta_call_scalar():
+    S, sigma, timestamp, expiration = [x.tolist() for x in _strike_inputs(1000)]
+    def run():
+        for i in range(len(S)):
+            black_scholes.strike_for_delta_call(0.1, timestamp[i], S[i], expiration[i], sigma[i])
+    return run
+
+
+@benchmark('strike_for_delta_put_scalar_1k')
+def strike_for_delta_put_scalar():
+    S, sigma, timestamp, expiration = [x.tolist() for x in _strike_inputs(1000)]
+    def run():
+        for i in range(len(S)):
+            black_scholes.strike_for_delta_put(-0.1, timestamp[i], S[i], expiration[i], sigma[i])
+    return run
+
+
+@benchmark('strike_for_delta_batch_100k')
+def strike_for_delta_batch():
+    S, sigma, timestamp, expiration = _strike_inputs(10**5)
+    return lambda: black_scholes.strike_for_delta(0.1, timestamp, S, expiration, sigma, 'call')
+
+
+@benchmark('create_sample_path')
+def create_sample_path():
+    returns = np.random.default_rng(SEED).standard_normal(30000)
+    rng = np.random.default_rng(SEED)
+    return lambda: eth_price_simulation.create_sample_path(returns, sample_length=utils.SAMPLE_LENGTH, rng=rng)
+
+
+@benchmark('create_sample_paths_100')
+def create_sample_paths():
+    returns = np.random.default_rng(SEED).standard_normal(30000)
+    rng = np.random.default_rng(SEED)
+    return lambda: eth_price_simulation.create_sample_paths(returns, 100, sample_length=utils.SAMPLE_LENGTH, rng=rng)
+
+
+@benchmark('calculateRV_1path')
+def calculate_rv():
+    prices, _ = synthetic_market(1)
+    series = prices[0]
+    return lambda: volatility.calculateRV(series, utils.IV_WINDOW, 24)
+
+
+@benchmark('calculateRVBatch_100paths')
+def calculate_rv_batch():
+    prices, _ = synthetic_market(100)
+    prices = prices.to_numpy()
+    return lambda: volatility.calculateRVBatch(prices, utils.IV_WINDOW, 24)
+
+
+@benchmark('amm_trades_1k')
+def amm_trades():
+    # quotes and trades of two markets, 5 trades and 2 quotes per hourly step
+    rng = np.random.default_rng(SEED)
+    prices = 2000 * np.exp(np.cumsum(rng.normal(0, 0.01, 200)))
+    sizes = rng.uniform(0.1, 2, (200, 5))
+    timestamp = utils.start_time.timestamp()
+    def run():
+        amm = amm_market.MinterAmm(1000.0, 0.3, [], 0.8/np.sqrt(black_scholes.SECONDS_PER_YEAR), 1e-9, timestamp)
+        amm.setCurrentPrice(prices[0])
+        amm.addMarkets([amm_market.Market(2200.0, timestamp + 30*86400), amm_market.Market(1800.0, timestamp + 30*86400)])
+        for i, price in enumerate(prices):
+            amm.setTimestamp(timestamp + 3600*i)
+            amm.setCurrentPrice(price)
+            amm.getPriceForMarket(0, 'call')
+            amm.getPriceForMarket(1, 'put')
+            for k, size in enumerate(sizes[i]):
+                optionType = 'call' if k % 2 == 0 else 'put'
+                if k % 3 == 0:
+                    amm.bTokenBuy(k % 2, size, optionType)
+                elif k % 3 == 1:
+                    amm.bTokenSell(k % 2, size/2, optionType)
+                else:
+                    amm.wTokenSell(k % 2, size/10, optionType)
+    return run
+
+
+@benchmark('amm_slippage_curve_500')
+def amm_slippage_curve():
+    timestamp = utils.start_time.timestamp()
+    amm = amm_market.MinterAmm(1000.0, 0.3, [], 0.8/np.sqrt(black_scholes.SECONDS_PER_YEAR), 1e-9, timestamp)
+    amm.setCurrentPrice(2000.0)
+    amm.addMarkets([amm_market.Market(2200.0, timestamp + 30*86400)])
+    amm.bTokenBuy(0, 5.0, 'call')
+    sizes = np.linspace(0.01, 20, 500)
+    return lambda: (amm.getSlippage(0, sizes, 'call'), amm.getSlippage(0, sizes, 'call', buy=False))
+
+
+@functools.lru_cache(maxsize=None)
+def synthetic_order_flow(rate, hours):
+    # call markets of orderFlow.py with its default strikes and orders of rate per hour on a path of mu 1.0 and sigma 0.8
+    start = int(utils.start_time.timestamp())
+    timestamps = start + 3600 * np.arange(hours, dtype=np.int64)
+    prices = orderFlow.price_path(hours, 1.0, 0.8, 2000, SEED)
+    markets = orderFlow.weekly_markets(start, int(timestamps[-1]), [2000, 2200, 2400])
+    expirations = np.array([market.expiration for market in markets])
+    orders = order_flow.poisson_orders(start, start + 3600 * hours, rate, len(markets), seed=SEED, expirations=expirations)
+    return timestamps, prices, markets, orders
+
+
+def _order_flow_replay(rate, hours, engine):
+    def setup():
+        timestamps, prices, markets, orders = synthetic_order_flow(rate, hours)
+        def run():
+            amm = amm_market.MinterAmm(1000.0, 0.5, markets, 0.8/amm_market.SQRT_SECONDS_PER_YEAR, 1e-10, int(timestamps[0]))
+            order_flow.replay(amm, orders, timestamps, prices, 'call', engine)
+        run.items = len(orders)
+        return run
+    return setup
+
+
+# a quarter of hourly steps, about 1M orders for numba and 20k orders for python
+benchmark('order_flow_replay_python_20k', repeat=3, min_rate=10000)(_order_flow_replay(9.2, 24*7*13, 'python'))
+if order_flow.available():
+    benchmark('order_flow_replay_numba_1m', repeat=3, min_rate=1000000)(_order_flow_replay(460, 24*7*13, 'numba'))
+
+
+def _simulation_1path(name, strategyArgs):
+    def setup():
+        prices, ivs = synthetic_market(1)
+        my_strategy = dict(runStrategy.strategies)[name]
+        return lambda: simulation.simulation(0, prices[0], ivs[0], ivs.index[0], 10e8, my_strategy(*strategyArgs))
+    return setup
+
+
+def _simulation_100paths(name, strategyArgs, engine, targetDelta=0.1):
+    def setup():
+        prices, ivs = synthetic_market(100)
+        run = lambda: runStrategy.simulate_paths('c', prices, ivs, 0.0, 10e8, (name, strategyArgs, targetDelta), engine)
+        if engine == 'numba':
+            # compile outside the timings
+            run()
+        return run
+    return setup
+
+
+for _name, _args in STRATEGIES:
+    benchmark(f'simulation_1path_{_name}')(_simulation_1path(_name, _args))
+    benchmark(f'simulation_100paths_python_{_name}', repeat=1)(_simulation_100paths(_name, _args, 'python'))
+    benchmark(f'simulation_100paths_vectorized_{_name}', repeat=3)(_simulation_100paths(_name, _args, 'vectorized'))
+    if simulation_numba.available():
+        benchmark(f'simulation_100paths_numba_{_name}', repeat=3)(_simulation_100paths(_name, _args, 'numba'))
+# three strikes of weekly and monthly markets
+benchmark('simulation_100paths_vectorized_ladder', repeat=3)(_simulation_100paths(*STRATEGIES[1], 'vectorized', Ladder([0.1, 0.25, 0.4], [1, 4])))
+
+
+def _write(fmt):
+    def setup():
+        prices, ivs = synthetic_market(100)
+        unStdPaths, _, _ = runStrategy.price_paths(synthetic_paths(100), 1.0, 0.8, 2000, utils.SAMPLE_LENGTH)
+        dfs, pool_values = runStrategy.simulate_paths('c', prices, ivs, 0.0, 10e8, ('AbstractStrategy', [], 0.1))
+        saveDir = tempfile.mkdtemp(prefix='benchmark-')
+        def run():
+            writer = results.get_writer(fmt, saveDir, 'AbstractStrategy', 100, 'c', 1.0, 0.8)
+            writer.prepare()
+            writer.write_chunk(0, unStdPaths, prices, dfs, pool_values)
+            writer.close(1)
+        run.cleanup = lambda: shutil.rmtree(saveDir)
+        return run
+    return setup
+
+
+benchmark('write_csv_100paths', repeat=1)(_write('csv'))
+benchmark('write_parquet_100paths', repeat=3)(_write('parquet'))
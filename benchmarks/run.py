@@ -0,0 +1,123 @@
+import os,sys
+import json
+import time
+import argparse
+import platform
+import numpy as np
+import pandas as pd
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks import cases
+
+# Runs the benchmarks of benchmarks/cases.py, writes the timings as JSON
+# and compares them with a stored baseline:
+#   python3 benchmarks/run.py --output results.json --baseline benchmarks/baseline.json
+# A benchmark regresses when its best time is slower than threshold times the baseline
+# or when its throughput is below its min_rate, the exit status is 1 if any benchmark regresses.
+# Like timeit, fast benchmarks are called number times per timing so that a timing lasts MIN_TIME.
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+MIN_TIME = 0.1
+
+
+def machine():
+    return {
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def run_benchmark(setup, repeat):
+    fn = setup()
+    try:
+        start = time.perf_counter()
+        fn()
+        first = time.perf_counter() - start
+        # the first call is a warmup unless it is slow enough to count as a timing
+        if first >= MIN_TIME:
+            number, times = 1, [first]
+        else:
+            number, times = int(np.ceil(MIN_TIME / max(first, 1e-6))), []
+        while len(times) < repeat:
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            times.append((time.perf_counter() - start) / number)
+    finally:
+        cleanup = getattr(fn, 'cleanup', None)
+        if cleanup is not None:
+            cleanup()
+    timing = {'min': min(times), 'median': float(np.median(times)), 'repeat': repeat, 'number': number}
+    items = getattr(fn, 'items', None)
+    if items is not None:
+        timing['items'] = items
+        timing['rate'] = items / timing['min']
+    return timing
+
+
+def below_target(timing, min_rate):
+    return min_rate is not None and timing.get('rate', np.inf) < min_rate
+
+
+def compare(current, baseline, threshold, min_rates={}):
+    rows = []
+    for name, timing in current.items():
+        min_rate = min_rates.get(name)
+        row = {'benchmark': name, 'seconds': timing['min'], 'rate': timing.get('rate', np.nan),
+            'min_rate': np.nan if min_rate is None else min_rate}
+        if name not in baseline:
+            rows.append(dict(row, baseline=np.nan, ratio=np.nan, regression=below_target(timing, min_rate)))
+            continue
+        ratio = timing['min'] / baseline[name]['min']
+        rows.append(dict(row, baseline=baseline[name]['min'], ratio=ratio, regression=ratio > threshold or below_target(timing, min_rate)))
+    return pd.DataFrame(rows).set_index('benchmark')
+
+
+def main(args):
+    selected = [name for name in cases.BENCHMARKS if not args.bench or any(k in name for k in args.bench)]
+    timings = {}
+    min_rates = {}
+    for name in selected:
+        setup, repeat, min_rates[name] = cases.BENCHMARKS[name]
+        timings[name] = run_benchmark(setup, args.repeat or repeat)
+        rate = f" {timings[name]['rate']:14.0f} items/s" if 'rate' in timings[name] else ''
+        print(f"{name:60s} {timings[name]['min']:10.4f} s{rate}")
+    report = {'machine': machine(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'), 'benchmarks': timings}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=1)
+        return 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['machine'] != report['machine']:
+            print("[!] Baseline was recorded on another machine:", baseline['machine'])
+    else:
+        # throughput targets are still checked
+        print(f"[!] No baseline {args.baseline}, run with --save-baseline to store one")
+        baseline = {'benchmarks': {}}
+    table = compare(timings, baseline['benchmarks'], args.threshold, min_rates)
+    with pd.option_context('display.float_format', '{:.4g}'.format, 'display.width', 200, 'display.max_rows', None, 'display.max_columns', None):
+        print(table)
+    regressions = table.index[table['regression']].tolist()
+    if regressions:
+        print(f"[!] {len(regressions)} benchmarks slower than {args.threshold}x baseline or below their min_rate: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", "--bench", nargs="*", default=[], help="run the benchmarks whose name contains any of these")
+    parser.add_argument("--repeat", default=None,type=int, help="timings of every benchmark, by default set per benchmark")
+    parser.add_argument("--output", default=None,type=str, help="json file for the timings")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,type=str, help="json baseline to compare with")
+    parser.add_argument("--threshold", default=1.25,type=float, help="ratio to the baseline above which a benchmark regresses")
+    parser.add_argument("--save-baseline", action="store_true", help="store the timings as the baseline instead of comparing")
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -1,12 +1,12 @@
 import os,sys
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
 import argparse
 import pickle 
+from joblib import Parallel, delayed
 currentdir = os.path.dirname(os.getcwd())
 sys.path.insert(0,currentdir)
-from BlackScholes import eth_price_simulation
+from BlackScholes import eth_price_simulation, path_store
 from Market import utils
 
 
@@ -21,14 +21,14 @@ def YtHsigma(sigma):
     return sigma/np.sqrt(365*24)
 
 
-def loadStdReturns(file):
+def loadStdReturns(file, dtype=np.float64):
     eth = pd.read_csv(file)
     df_eth = eth.sort_values('date')
 
     # we need to drop 0 values at first line !!!!
     df_eth = df_eth.iloc[1:].reset_index(drop=True)
     eth_returns = eth_price_simulation.log_returns(df_eth.open,1)
-    eth_returns = eth_returns.astype(np.longdouble)
+    eth_returns = eth_returns.astype(dtype)
     return eth_price_simulation.standardized_returns(eth_returns)
 
 
@@ -36,34 +36,55 @@ def genReturns(stdDistRet, num_paths,sample_length,**kwargs):
     min_connected=kwargs.get('min_connected',1)
     max_connected=kwargs.get('max_connected',3)
     with_replacement=kwargs.get('with_replacement',0)
-    paths = []
-    for i in tqdm(range(num_paths),total=num_paths):
-        ret =  eth_price_simulation.create_sample_path(
-        list(stdDistRet),
+    rng=kwargs.get('rng',None)
+    dtype=kwargs.get('dtype',np.float64)
+    paths = eth_price_simulation.create_sample_paths(
+        np.asarray(stdDistRet),
+        num_paths,
         sample_length = sample_length,
         min_connected_original = min_connected,
         max_connected_original = max_connected,
-        with_replacement = with_replacement)
-        paths.append(ret)
-    return np.array(paths,dtype=np.longdouble)
+        with_replacement = with_replacement,
+        rng = rng)
+    return np.array(paths,dtype=dtype)
+
+
+def genChunk(file, stdDistRet, start, stop, seed, sample_length, **kwargs):
+    # every path has its own stream, a chunk gives the same paths in any process
+    store, header = path_store.open_path_store(file, mode='r+')
+    store[start:stop] = genReturns(stdDistRet,stop - start,sample_length,
+        rng=eth_price_simulation.path_rngs(seed, start, stop),**kwargs)
+    store.flush()
 
 
-    
 def main(args):
     print(args)
-    stdDistRet = loadStdReturns(args.pricesFile)
+    # float32 paths are standardized with float64 and rounded when stored
+    dtype = utils.STORE_PRECISIONS[args.precision]
+    stdDistRet = np.asarray(loadStdReturns(args.pricesFile, np.longdouble if args.precision == 'longdouble' else np.float64))
     samples = args.paths
-
-
-    paths = genReturns(stdDistRet,samples,utils.SAMPLE_LENGTH,
+    params = dict(
         min_connected=24,
         max_connected=24*3,
         with_replacement=0)
-    paths = np.array(paths)
-    with open(f'{args.saveDir}/{samples}.pickle', 'wb') as handle:
-        pickle.dump(paths, handle, protocol=pickle.HIGHEST_PROTOCOL)
-    
-    
+    # without --seed a fresh seed is drawn and recorded, so the run can be repeated
+    seed = args.seed if args.seed is not None else np.random.SeedSequence().entropy
+
+    if args.format == 'pickle':
+        paths = genReturns(stdDistRet,samples,utils.SAMPLE_LENGTH,
+            rng=eth_price_simulation.path_rngs(seed, 0, samples),dtype=dtype,**params)
+        paths = np.array(paths)
+        with open(f'{args.saveDir}/{samples}.pickle', 'wb') as handle:
+            pickle.dump(paths, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        return
+
+    # paths are written chunk by chunk, so path sets larger than memory can be generated
+    file = f'{args.saveDir}/{samples}{path_store.EXTENSION}'
+    header = dict(params, sample_length=utils.SAMPLE_LENGTH, pricesFile=args.pricesFile)
+    store = path_store.create_path_store(file, (samples, utils.SAMPLE_LENGTH), dtype, params=header, seed=seed)
+    del store
+    chunks = [(start, min(start + args.chunkSize, samples)) for start in range(0, samples, args.chunkSize)]
+    Parallel(n_jobs=args.cores,verbose=10,backend='multiprocessing')(delayed(genChunk)(file,stdDistRet,start,stop,seed,utils.SAMPLE_LENGTH,dtype=dtype,**params) for start, stop in chunks)
 
     
 
@@ -72,6 +93,11 @@ if __name__ == "__main__":
     parser.add_argument("--saveDir", default='output',type=str,help="Where to save the outputs")
     parser.add_argument("-p", "--paths", default=3000,type=int, help="Number of paths per simulation")
     parser.add_argument("--pricesFile", required=True,type=str,help="1h price data")
+    parser.add_argument("--format", default='paths', choices=['paths', 'pickle'], help="paths is a raw file that runStrategy.py memory-maps, pickle is the previous format")
+    parser.add_argument("--chunkSize", default=1000,type=int, help="Paths generated and written at once")
+    parser.add_argument("--seed", default=None,type=int, help="Seed of the paths, the same seed gives the same paths for any number of cores or chunk size")
+    parser.add_argument("--precision", default=utils.DEFAULT_PRECISION, choices=list(utils.STORE_PRECISIONS), help="dtype of the stored paths, float32 halves the file, longdouble is the previous format")
+    parser.add_argument("-c", "--cores", default=2,type=int,help="Number of cores to use (do not include virtuals)")
     args = parser.parse_args()
     main(args)
 
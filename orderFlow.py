@@ -0,0 +1,111 @@
+import os,sys
+import json
+import time
+import datetime
+import argparse
+import numpy as np
+currentdir = os.path.dirname(os.getcwd())
+sys.path.insert(0,currentdir)
+from BlackScholes import eth_price_simulation
+from Market import amm_market, order_flow, utils
+import runStrategy
+
+# Replays trader orders through a MinterAmm on a seeded price path (see Market/order_flow.py).
+# Orders are generated as a Poisson process or read with --orders from a file of order_flow.write_orders.
+# The amm lists one market per strike (--moneyness times --initPrice) for every weekly expiry of the path.
+
+
+def price_path(hours, mu, sigma, p0, seed):
+    returns = np.random.default_rng(seed).standard_normal((1, hours - 1))
+    unStd = eth_price_simulation.unstandardized_returns(returns, runStrategy.YtHmu(mu), runStrategy.YtHsigma(sigma))
+    return eth_price_simulation.get_prices_np(unStd, p0)[0]
+
+
+def weekly_markets(start, stop, strikes):
+    # markets of every strike for every expiry after start, up to the first expiry after stop
+    markets = []
+    expiry = utils.get_next_expiry(datetime.datetime.fromtimestamp(start, datetime.timezone.utc))
+    while True:
+        if expiry.timestamp() > start:
+            markets.extend(amm_market.Market(strike, int(expiry.timestamp())) for strike in strikes)
+            if expiry.timestamp() > stop:
+                return markets
+        expiry += datetime.timedelta(days=7)
+
+
+def main(args):
+    print(args)
+    optionType = 'call' if args.calls else 'put'
+    if args.orders:
+        orders = order_flow.read_orders(args.orders)
+        if len(orders) == 0:
+            print("[!] No orders in", args.orders)
+            return 1
+        start = int(orders['timestamp'][0]) // 3600 * 3600
+        hours = int(orders['timestamp'][-1] - start) // 3600 + 1
+    else:
+        start = int(utils.start_time.timestamp())
+        hours = args.hours
+    timestamps = start + 3600 * np.arange(hours, dtype=np.int64)
+    prices = price_path(hours, args.mu, args.sigma, args.initPrice, args.seed)
+    strikes = [round(args.initPrice * m, 2) for m in args.moneyness]
+    markets = weekly_markets(start, int(timestamps[-1]), strikes)
+    if not args.orders:
+        expirations = np.array([market.expiration for market in markets])
+        orders = order_flow.poisson_orders(start, start + 3600 * hours, args.rate, len(markets), args.meanSize,
+            np.asarray(args.mix) / np.sum(args.mix), args.seed, expirations)
+    amm = amm_market.MinterAmm(args.collateral, args.feePercent, markets,
+        args.iv / amm_market.SQRT_SECONDS_PER_YEAR, args.ivDecayRate, start)
+    print(f"[*] {len(orders)} orders, {len(markets)} markets, {hours} hours")
+
+    if args.engine == 'numba' and order_flow.available():
+        # compile with one order on another amm, so the timing is of the replay only
+        warmup = orders[:1].copy()
+        warmup['market'] = 0
+        order_flow.replay(amm_market.MinterAmm(args.collateral, args.feePercent, markets[:1],
+            args.iv / amm_market.SQRT_SECONDS_PER_YEAR, args.ivDecayRate, start), warmup, timestamps[:1], prices[:1], optionType)
+    seconds = time.perf_counter()
+    events, steps = order_flow.replay(amm, orders, timestamps, prices, optionType, args.engine)
+    seconds = time.perf_counter() - seconds
+
+    report = order_flow.summary(events, steps, seconds)
+    for key, value in report.items():
+        print(f"{key:20s} {value}")
+    os.makedirs(args.saveDir, exist_ok=True)
+    name = f'order_flow-{optionType}-{len(orders)}'
+    np.save(os.path.join(args.saveDir, name + '-events.npy'), events)
+    order_flow.steps_frame(timestamps, steps).assign(price=prices).to_csv(os.path.join(args.saveDir, name + '-steps.csv'))
+    with open(os.path.join(args.saveDir, name + '-summary.json'), 'w') as f:
+        json.dump(dict(report, engine=args.engine, args=vars(args)), f, indent=1)
+    if args.saveOrders:
+        order_flow.write_orders(os.path.join(args.saveDir, name + '-orders' + args.saveOrders), orders)
+    print(f"[*] Saved {name} to {args.saveDir}")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", default=None,type=str, help="order file (.npy, .csv or .parquet) to replay instead of generated orders")
+    parser.add_argument("--rate", default=100,type=float, help="generated orders per hour")
+    parser.add_argument("--meanSize", default=1.0,type=float, help="mean amount of generated orders")
+    parser.add_argument("--mix", default=order_flow.DEFAULT_MIX,type=float, nargs=4, help="weights of bToken buys, bToken sells, wToken buys and wToken sells")
+    parser.add_argument("--hours", default=24*7*13,type=int, help="hours of the price path of generated orders")
+    parser.add_argument("--seed", default=0,type=int, help="seed of the price path and the generated orders")
+    parser.add_argument("-m", "--mu", default=1.0,type=float, help="Log APY of the price path")
+    parser.add_argument("-s", "--sigma", default=0.8,type=float, help="Volatility of the price path")
+    parser.add_argument("--initPrice", default=2000,type=float, help='Initial price of the path')
+    parser.add_argument("--moneyness", default=[1.0, 1.1, 1.2],type=float, nargs="+", help="strikes listed every week, as multiples of initPrice")
+    parser.add_argument("--iv", default=0.8,type=float, help="target IV of the amm, per year")
+    parser.add_argument("--ivDecayRate", default=1e-10,type=float, help="decay of the IV towards the target, per second")
+    parser.add_argument("--feePercent", default=0.5,type=float, help="fee in percent of the traded amount")
+    parser.add_argument("--collateral", default=1000,type=float, help="initial collateral reserve of the amm")
+    parser.add_argument("--engine", default='numba', choices=order_flow.ENGINES, help="numba replays in a compiled kernel (falls back to python without numba), python calls the MinterAmm methods")
+    parser.add_argument("--saveDir", default='output',type=str, help="Where to save the event log, the steps and the summary")
+    parser.add_argument("--saveOrders", default=None, choices=['.npy', '.csv', '.parquet'], help="also save the replayed orders in this format")
+    group = parser.add_argument_group(title='Option type')
+    group.add_argument("--calls", help="call markets", action="store_true")
+    group.add_argument("--puts", help="put markets", action="store_true")
+    args = parser.parse_args()
+    if args.calls == args.puts:
+        parser.error("Just One option type must be specified")
+    sys.exit(main(args))
@@ -0,0 +1,89 @@
+import os,sys
+import time
+import argparse
+import numpy as np
+import pandas as pd
+currentdir = os.path.dirname(os.getcwd())
+sys.path.insert(0,currentdir)
+from Market import utils
+import runStrategy
+
+# Pool values of float64 and float32 paths against the longdouble baseline
+# (paths and simulation in np.longdouble, as before the precision mode).
+# Only the python engine simulates in np.longdouble, the vectorized and numba engines in float64,
+# so the baseline always runs on the python engine and the other modes on --engine.
+MODES = [
+    ('longdouble', np.longdouble, np.longdouble, 'python'),
+    ('float64', np.float64, np.float64, None),
+    ('float32 paths', np.float32, np.float64, None),
+]
+COLUMNS = ['pool_value_usd', 'pool_value', 'hedge_value', 'settled_pool_value', 'collateral_reserve']
+
+
+def compare(baseline, pool_value):
+    out = {}
+    for column in COLUMNS:
+        a = baseline[column].to_numpy(dtype=np.float64)
+        b = pool_value[column].to_numpy(dtype=np.float64)
+        diff = np.abs(a - b)
+        scale = np.nanmax(np.abs(a))
+        out[f'{column} max abs'] = np.nanmax(diff)
+        out[f'{column} max rel'] = np.nanmax(diff) / scale if scale > 0 else 0.0
+    # last row of every path, pandas does not group np.longdouble
+    last = baseline['pool_value_usd'].astype(np.float64).groupby(baseline['epoch_id']).last().to_numpy()
+    last_mode = pool_value['pool_value_usd'].astype(np.float64).groupby(pool_value['epoch_id']).last().to_numpy()
+    out['final pool_value_usd max rel'] = np.max(np.abs(last - last_mode) / np.abs(last))
+    return out
+
+
+def main(args):
+    print(args)
+    shm, shared_paths, num_paths = runStrategy.open_paths(args.runs)
+    try:
+        paths = runStrategy.load_shared_paths(shared_paths, 0, min(args.paths, num_paths))
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+    flag = 'p' if args.puts else 'c'
+    targetDelta = args.targetDelta if args.targetDelta is not None else (-0.1 if args.puts else 0.1)
+    strategy_setup = (args.strategy, runStrategy.parseStrategyArgs(args.strategyArgs), targetDelta)
+
+    report = {}
+    baseline = None
+    for name, store_dtype, dtype, engine in MODES:
+        engine = engine or args.engine
+        start = time.time()
+        _, _, _, pool_value = runStrategy.run_simulation(flag, paths.astype(store_dtype), args.mu, args.sigma,
+            args.ivc, args.minIV, args.initPrice, 10e8, utils.SAMPLE_LENGTH, strategy_setup,
+            engine, dtype=dtype)
+        row = {'engine': engine, 'seconds': time.time() - start, 'path bytes': paths.astype(store_dtype).nbytes}
+        if baseline is None:
+            baseline = pool_value
+        else:
+            row.update(compare(baseline, pool_value))
+        report[name] = row
+    report = pd.DataFrame(report)
+    with pd.option_context('display.float_format', '{:.3g}'.format, 'display.width', 200):
+        print(report)
+    if args.output:
+        report.to_csv(args.output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-r", "--runs",required=True,type=str, help="paths file (or pickle) of runs from generateRuns.py")
+    parser.add_argument("-p", "--paths", default=20,type=int, help="Number of paths to compare")
+    parser.add_argument('-m', '--mu', default=1.0,type=float, help="Log APY")
+    parser.add_argument('-s', '--sigma', default=1.0,type=float, help="Volatility")
+    parser.add_argument("--strategy", default='AbstractStrategy',choices=list(map(lambda x:x[0],runStrategy.strategies)), help="strategy")
+    parser.add_argument("--strategyArgs", nargs="*", default=[], help="Arguments to startegy: 1.2:float \"asd:str\" 1:int")
+    parser.add_argument("--ivc", default=0.05,type=float, help="IV premium/constant added to Realized Volatility 30 day window")
+    parser.add_argument("--minIV", default=0.00,type=float, help="Minimal IV for selling option")
+    parser.add_argument("--initPrice", default=2000,type=float, help='InitialPrice for simulation')
+    parser.add_argument("--targetDelta", default=None,type=float, help='Simulation finds closest Strike price, whichs delta is closed to the targetDelta, 0.1 for calls and -0.1 for puts by default')
+    parser.add_argument("--engine", default='vectorized', choices=runStrategy.ENGINES, help='Simulation engine of the float64 and float32 modes, the longdouble baseline runs on the python engine')
+    parser.add_argument("--puts", action="store_true", help="compare puts instead of calls")
+    parser.add_argument("--output", default=None,type=str, help="csv file for the report")
+    args = parser.parse_args()
+    main(args)
@@ -7,16 +7,24 @@ import itertools
 import argparse
 import inspect
 import pickle
+import json
+import time
+import shutil
+from multiprocessing import shared_memory, resource_tracker
 
 
 currentdir = os.path.dirname(os.getcwd())
 sys.path.insert(0,currentdir)
 
-from BlackScholes import volatility,eth_price_simulation
-from Market import simulation, strategy, utils
+from BlackScholes import volatility,eth_price_simulation,path_store
+from Market import simulation, simulation_numba, strategy, utils, results, clock
+from Market import summary as summaries
+from Market import profiling
+from Market.ladder import Ladder
 
 
 strategies = list(filter(lambda x: inspect.isclass(x[1]),inspect.getmembers(strategy)))
+ENGINES = ['vectorized', 'python', 'numba']
 
 
 # input median for normal returns
@@ -27,60 +35,200 @@ def YtHsigma(sigma):
     return sigma/np.sqrt(365*24)
 
 
-def run_simulation(flag, paths, mu,sigma, ivC,minIV, p0, collateralReserve,sample_length, strategy_setup):
-    print('#'*30)
-    print(flag, mu, sigma,p0)
+# Returns, prices and realized vol depend only on mu and sigma,
+# they can be shared by every cell with the same mu and sigma
+def price_paths(paths, mu, sigma, p0, sample_length, epoch_offset=0, dtype=np.float64):
+    unStd = eth_price_simulation.unstandardized_returns(paths, YtHmu(mu), YtHsigma(sigma), dtype)
+    prices = eth_price_simulation.get_prices_np(unStd, p0)
+    # realized vol of every path, rows start IV_WINDOW days after the first price
+    rv = volatility.calculateRVBatch(prices.T,utils.IV_WINDOW,24)
+    unStdPaths, prices = path_frames(unStd, prices, epoch_offset, sample_length)
+    return unStdPaths, prices, rv
 
-    unStdPaths = [eth_price_simulation.unstandardized_returns(path,YtHmu(mu), YtHsigma(sigma)) for path in paths]
-    prices = [eth_price_simulation.get_price_np(path,p0) for path in unStdPaths]
+# returns and prices (one row per path) as DataFrames with one column per path
+def path_frames(unStd, prices, epoch_offset, sample_length):
+    epoch_ids = range(epoch_offset, epoch_offset + len(prices))
     start_time = utils.start_time
-    dateRange = pd.date_range(start=str(start_time), end=str(start_time + datetime.timedelta(hours=sample_length)), freq='1H',tz=datetime.timezone.utc)
+    dateRange = pd.date_range(start=str(start_time), end=str(start_time + datetime.timedelta(hours=sample_length)), freq='1H',tz=datetime.timezone.utc, name='date')
+    unStdPaths = pd.DataFrame(unStd.T, index=dateRange[1:], columns=epoch_ids)
+    prices = pd.DataFrame(prices.T, index=dateRange, columns=epoch_ids)
+    return unStdPaths, prices
 
-    unStdPaths = pd.DataFrame(unStdPaths).T
-    unStdPaths['date'] = dateRange[1:]
-    unStdPaths = unStdPaths.set_index(unStdPaths['date']).drop(['date'],axis=1)
+def implied_vols(prices, rv, ivC):
+    return pd.DataFrame(np.asarray(volatility.calculateIVConstant(rv,ivC, 2.7),dtype=np.float64), index=prices.index[utils.IV_WINDOW*24:], columns=prices.columns)
 
-    prices = pd.DataFrame(prices).T
-    prices['date'] = dateRange
-    prices = prices.set_index(prices['date']).drop(['date'],axis=1)
-    
-    ivs = []
-    dfs = []
-    pool_values = []
+# with a summary.Summary the records are reduced by it and the summary is returned instead of df and pool_value
+# targetDelta of strategy_setup is the target delta of the weekly market or a ladder.Ladder of markets
+def simulate_paths(flag, prices, ivs, minIV, collateralReserve, strategy_setup, engine='vectorized', summary=None):
+    epoch_ids = prices.columns
     selected_strategy,strategyArgs, targetDelta = strategy_setup
-    for epoch_id in range(len(paths)):
-        rv = volatility.calculateRV(prices[epoch_id],utils.IV_WINDOW,24)
-        iv = volatility.calculateIVConstant(rv,ivC, 2.7)
+    if flag != 'c' and flag != 'p':
+        raise ValueError("Invalid flag")
+    ladder = targetDelta if isinstance(targetDelta, Ladder) else Ladder([targetDelta])
+
+    my_strategy = dict(strategies)[selected_strategy](*strategyArgs)
+    if engine == 'numba' and not (simulation_numba.supports(my_strategy) and ladder.is_single()):
+        if not simulation_numba.available():
+            reason = "numba is not installed"
+        elif not ladder.is_single():
+            reason = "the numba kernel lists a single weekly market"
+        else:
+            reason = f"{selected_strategy} has no numba kernel"
+        engine = 'vectorized' if not ladder.is_single() and simulation.supports_batch(my_strategy) else 'python'
+        print(f"[!] {reason}, using the {engine} engine")
+    if engine == 'numba':
+        return simulation_numba.simulation_numba(
+                epoch_ids,
+                prices,
+                ivs,
+                ivs.index[0],
+                collateralReserve,
+                my_strategy,
+                min_iv = minIV,
+                target_delta = ladder.target_deltas[0],
+                isPut=flag == 'p',
+                summary=summary)
+    if engine == 'vectorized' and simulation.supports_batch(my_strategy):
+        return simulation.simulation_batch(
+                epoch_ids,
+                prices,
+                ivs,
+                ivs.index[0],
+                collateralReserve,
+                my_strategy,
+                min_iv = minIV,
+                isPut=flag == 'p',
+                summary=summary,
+                ladder=ladder)
+
+    # records of all paths in one allocation, a summary reuses the records of one path.
+    # Columns first, so the (paths, steps) array of every column is contiguous
+    sim_clock = clock.Clock(ivs[utils.get_next_expiry(ivs.index[0]):].index)
+    record = np.empty((len(simulation.RECORD_COLUMNS), 1 if summary is not None else len(epoch_ids), sim_clock.n_steps))
+    if summary is not None:
+        summary.start(epoch_ids, sim_clock)
+    for row, epoch_id in enumerate(epoch_ids):
+        iv = ivs[epoch_id]
         start_timestamp = iv.index[0]
         my_strategy = dict(strategies)[selected_strategy](*strategyArgs)
-        if flag == 'c' or flag == 'p':
-            df, pool_value = simulation.simulation(
-                    epoch_id, 
-                    prices[epoch_id], 
-                    iv, 
-                    start_timestamp,
-                    collateralReserve,
-                    my_strategy,
-                    min_iv = minIV,
-                    target_delta = targetDelta,
-                    isPut=flag == 'p')
-        else:
-            raise ValueError("Invalid flag")
-        ivs.append(iv)
-        dfs.append(df)
-        pool_values.append(pool_value)
-    return unStdPaths, prices, pd.concat(dfs), pd.concat(pool_values) 
+        simulation.simulation(
+                epoch_id, 
+                prices[epoch_id], 
+                iv, 
+                start_timestamp,
+                collateralReserve,
+                my_strategy,
+                min_iv = minIV,
+                isPut=flag == 'p',
+                record=record[:, 0 if summary is not None else row],
+                ladder=ladder)
+        if summary is not None:
+            with profiling.phase('record'):
+                summary.update([row], slice(0, sim_clock.n_steps), {column: record[k] for k, column in enumerate(simulation.RECORD_COLUMNS)})
+    if summary is not None:
+        return summary
+    with profiling.phase('record'):
+        return simulation.records_to_frames(epoch_ids, sim_clock.dates, {column: record[k] for k, column in enumerate(simulation.RECORD_COLUMNS)})
 
+def run_simulation(flag, paths, mu,sigma, ivC,minIV, p0, collateralReserve,sample_length, strategy_setup, engine='vectorized', epoch_offset=0, dtype=np.float64):
+    print('#'*30)
+    print(flag, mu, sigma,p0, epoch_offset)
+    unStdPaths, prices, rv = price_paths(paths, mu, sigma, p0, sample_length, epoch_offset, dtype)
+    ivs = implied_vols(prices, rv, ivC)
+    df, pool_value = simulate_paths(flag, prices, ivs, minIV, collateralReserve, strategy_setup, engine)
+    return unStdPaths, prices, df, pool_value
+
+
+# Every job reads just its chunk of paths. Path files are memory-mapped by the jobs,
+# pickled paths are placed in shared memory once.
+def share_paths(paths):
+    shm = shared_memory.SharedMemory(create=True, size=max(paths.nbytes, 1))
+    shared = np.ndarray(paths.shape, dtype=paths.dtype, buffer=shm.buf)
+    shared[:] = paths
+    return shm, ('shm', shm.name, paths.shape, paths.dtype.str)
+
+def open_paths(runs):
+    if path_store.is_path_store(runs):
+        paths, _ = path_store.open_path_store(runs)
+        return None, ('file', runs), paths.shape[0]
+    with open(runs, 'rb') as handle:
+        paths = pickle.load(handle)
+    shm, shared_paths = share_paths(paths)
+    return shm, shared_paths, paths.shape[0]
 
-def job(params,paths,ivC,minIV,p0,initcollateralReserve,sample_length,saveDir,strategy_setup):
+def attach_shared_paths(name):
+    # Before Python 3.13 attaching also registers the segment with the resource tracker, which unlinks it
+    # (with a leak warning) when a tracker of a worker exits, and unregistering it from the tracker shared with
+    # the parent drops the registration of share_paths. Workers attach without registering, share_paths owns it.
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+def load_shared_paths(shared_paths, start, stop):
+    if shared_paths[0] == 'file':
+        paths, _ = path_store.open_path_store(shared_paths[1])
+        return np.array(paths[start:stop])
+    _, name, shape, dtype = shared_paths
+    shm = attach_shared_paths(name)
+    paths = np.ndarray(shape, dtype=dtype, buffer=shm.buf)[start:stop].copy()
+    shm.close()
+    return paths
+
+def chunk_ranges(num_paths, chunk_size):
+    return [(start, min(start + chunk_size, num_paths)) for start in range(0, num_paths, chunk_size)]
+
+def default_chunk_size(num_paths, num_cells, cores):
+    # about 4 chunks per core, so one slow chunk does not leave the other cores idle
+    chunks_per_cell = int(np.ceil(4 * cores / num_cells))
+    return max(1, int(np.ceil(num_paths / chunks_per_cell)))
+
+
+# Every chunk is written by the worker, the writer merges the chunks in path order
+# so the output does not depend on scheduling
+# With profile (see main) the job runs under a profiling.Profiler and returns its report
+def job(params,shared_paths,chunk_id,chunk,ivC,minIV,p0,initcollateralReserve,sample_length,strategy_setup,engine,precision,writer,summary_names=None,profile=None):
         flag, dist = params
         mu, sigma = dist
-        selected_strategy,_, _ = strategy_setup 
-        unStdPaths, prices, dfs,pool_values = run_simulation(flag,paths,mu,sigma,ivC,minIV,p0,initcollateralReserve,sample_length,strategy_setup)
-        unStdPaths.to_csv(f'{saveDir}/unStdPaths-{selected_strategy}-{paths.shape[0]}-{flag}-{mu}-{sigma}.csv')
-        prices.to_csv(f'{saveDir}/prices-{selected_strategy}-{paths.shape[0]}-{flag}-{mu}-{sigma}.csv') 
-        dfs.to_csv(f'{saveDir}/dfs-{selected_strategy}-{paths.shape[0]}-{flag}-{mu}-{sigma}.csv')
-        pool_values.to_csv(f'{saveDir}/pool_values-{selected_strategy}-{paths.shape[0]}-{flag}-{mu}-{sigma}.csv')
+        profiler = None
+        if profile is not None:
+            profiler = profiling.Profiler(cprofile=profile['cprofile'])
+            profiler.start()
+        try:
+            run_job(flag,mu,sigma,shared_paths,chunk_id,chunk,ivC,minIV,p0,initcollateralReserve,sample_length,strategy_setup,engine,precision,writer,summary_names)
+        finally:
+            if profiler is not None:
+                profiler.stop()
+        if profiler is None:
+            return None
+        report = dict(profiler.report(), flag=flag, mu=mu, sigma=sigma, chunk_id=chunk_id, paths=chunk[1] - chunk[0])
+        if profiler.cprofile is not None:
+            profiler.cprofile.dump_stats(os.path.join(profile['dir'], profiling.job_stats_name(report['pid'], chunk_id, flag, mu, sigma)))
+        return report
+
+def run_job(flag,mu,sigma,shared_paths,chunk_id,chunk,ivC,minIV,p0,initcollateralReserve,sample_length,strategy_setup,engine,precision,writer,summary_names):
+        start, stop = chunk
+        print('#'*30)
+        print(flag, mu, sigma,p0, start)
+        with profiling.phase('paths'):
+            paths = load_shared_paths(shared_paths, start, stop)
+            unStdPaths, prices, rv = price_paths(paths,mu,sigma,p0,sample_length,start,utils.PRECISIONS[precision])
+            ivs = implied_vols(prices, rv, ivC)
+        if summary_names:
+            # summaries only, neither records nor path matrices are written
+            with profiling.phase('simulation'):
+                summary = simulate_paths(flag,prices,ivs,minIV,initcollateralReserve,strategy_setup,engine,summaries.Summary(summary_names))
+            with profiling.phase('write'):
+                writer.write_chunk(chunk_id, **summary.results())
+            return
+        with profiling.phase('simulation'):
+            dfs, pool_values = simulate_paths(flag,prices,ivs,minIV,initcollateralReserve,strategy_setup,engine)
+        with profiling.phase('write'):
+            writer.write_chunk(chunk_id, unStdPaths, prices, dfs, pool_values)
 
 def parseStrategyArgs(args):
     out = []
@@ -106,7 +254,7 @@ def main(args):
     ivC = args.ivc
     initcollateralReserve = 10e8
     cores = args.cores
-    targetDelta = args.targetDelta
+    targetDelta = Ladder(args.targetDelta, args.tenors)
 
     dists = list(zip(args.mus, args.sigmas))
     minIV = args.minIV
@@ -119,9 +267,61 @@ def main(args):
     strategyArgs = parseStrategyArgs(args.strategyArgs)
     print("[*] Args strategy: ",strategyArgs)
     strategy_setup = (args.strategy, strategyArgs,targetDelta) 
-    with open(args.runs, 'rb') as handle:
-        paths = pickle.load(handle)
-    Parallel(n_jobs=cores,verbose=100,backend='multiprocessing')(delayed(job)(params,paths,ivC,minIV,p0,initcollateralReserve,sample_length,args.saveDir,strategy_setup) for params in itertools.product(flags,dists))
+    shm, shared_paths, num_paths = open_paths(args.runs)
+    try:
+        cells = list(itertools.product(flags,dists))
+        chunk_size = args.chunkSize or default_chunk_size(num_paths, len(cells), cores)
+        chunks = chunk_ranges(num_paths, chunk_size)
+        print(f"[*] {len(cells)} cells x {len(chunks)} chunks of {chunk_size} paths")
+
+        summary_names = args.summaries if args.summary_only else None
+        written = summary_names or results.RESULTS
+        writers = [results.get_writer(args.format, args.saveDir, args.strategy, num_paths, flag, mu, sigma, written) for flag, (mu, sigma) in cells]
+        for writer in writers:
+            writer.prepare()
+
+        profile = None
+        if args.profile or args.cprofile:
+            profile = {'cprofile': args.cprofile, 'dir': os.path.join(args.saveDir, f'profile-{args.strategy}-{num_paths}')}
+            if os.path.isdir(profile['dir']):
+                shutil.rmtree(profile['dir'])
+            if args.cprofile:
+                os.makedirs(profile['dir'])
+        wall = time.perf_counter()
+        reports = Parallel(n_jobs=cores,verbose=100,backend='multiprocessing')(delayed(job)(params,shared_paths,chunk_id,chunk,ivC,minIV,p0,initcollateralReserve,sample_length,strategy_setup,args.engine,args.precision,writer,summary_names,profile) for params, writer in zip(cells, writers) for chunk_id, chunk in enumerate(chunks))
+        wall = time.perf_counter() - wall
+    finally:
+        if shm is not None:
+            shm.close()
+            shm.unlink()
+    for writer in writers:
+        writer.close(len(chunks))
+    if summary_names and summaries.PathSummary.name in summary_names:
+        # cross-path quantiles of every cell, from the merged path summaries
+        for flag, (mu, sigma) in cells:
+            path_summary = results.load_results(args.saveDir, summaries.PathSummary.name, args.strategy, num_paths, flag, mu, sigma)
+            quantiles = summaries.quantiles(path_summary, args.quantiles)
+            quantiles.to_csv(os.path.join(args.saveDir, results.result_name('quantiles', args.strategy, num_paths, flag, mu, sigma) + '.csv'))
+            print(flag, mu, sigma)
+            print(quantiles)
+    if profile is not None:
+        write_profile(args, profile, reports, wall, num_paths, len(chunks))
+
+def write_profile(args, profile, reports, wall, num_paths, num_chunks):
+    report = profiling.run_report(reports, wall, strategy=args.strategy, engine=args.engine, num_paths=num_paths,
+        chunks=num_chunks, cores=args.cores, summary_only=args.summary_only, format=args.format)
+    reportFile = profile['dir'] + '.json'
+    with open(reportFile, 'w') as f:
+        json.dump(report, f, indent=1)
+    total = report['total']
+    print(f"[*] Profile of {total['jobs']} jobs: wall {wall:.2f} s, job wall {total['wall']:.2f} s, job cpu {total['cpu']:.2f} s")
+    phases = profiling.JOB_PHASES + profiling.SIMULATION_PHASES + ['simulation_other']
+    print(pd.Series({name: total['phases'].get(name, 0.0) for name in phases}, name='seconds').to_string())
+    print(pd.Series(total['bs_calls'], name='Black-Scholes calls', dtype=np.int64).to_string())
+    print(f"[*] Profile saved to {reportFile}")
+    if args.cprofile:
+        workers = profiling.merge_stats(profile['dir'])
+        print(f"[*] cProfile stats of {len(workers)} workers saved to {profile['dir']}")
     
     
 
@@ -137,13 +337,23 @@ if __name__ == "__main__":
                     help="Volatility: -s 0.1 1")
     parser.add_argument("-c", "--cores", default=2,type=int,help="Number of cores to use (do not include virtuals)")
     parser.add_argument("--saveDir", default='output',type=str,help="Where to save the outputs")
-    parser.add_argument("-r", "--runs",required=True,type=str, help="pickle file of runs")
+    parser.add_argument("-r", "--runs",required=True,type=str, help="paths file (or pickle) of runs from generateRuns.py")
     parser.add_argument("--strategy",required=True,choices=list(map(lambda x:x[0],strategies)), help="strategy")
     parser.add_argument("--strategyArgs", nargs="*", default=[], help="Arguments to startegy: 1.2:float \"asd:str\" 1:int")
     parser.add_argument("--ivc", default=0.05,type=float, help="IV premium/constant added to Realized Volatility 30 day window")
     parser.add_argument("--minIV", default=0.00,type=float, help="Minimal IV for selling option")
     parser.add_argument("--initPrice", default=2000,type=float, help='InitialPrice for simulation')
-    parser.add_argument("--targetDelta", default=0.1,type=float, help='Simulation finds closest Strike price, whichs delta is closed to the targetDelta')
+    parser.add_argument("--targetDelta", default=[0.1],type=float, nargs='+', help='Simulation finds closest Strike price, whichs delta is closed to the targetDelta, several target deltas list a ladder of strikes')
+    parser.add_argument("--tenors", default=[1],type=int, nargs='+', help='Tenors in weeks of the markets listed for every target delta, 1 4 lists weekly and monthly markets')
+    parser.add_argument("--format", default='parquet', choices=list(results.WRITERS), help="Output format, parquet needs pyarrow, csv is the previous format")
+    parser.add_argument("--chunkSize", default=None,type=int, help="Paths per job, by default the paths of each cell are split into about 4 chunks per core")
+    parser.add_argument("--engine", default='vectorized', choices=ENGINES, help='vectorized advances all paths together when the strategy supports it, python simulates path by path, numba runs every path in a compiled kernel (falls back to python without numba)')
+    parser.add_argument("--precision", default=utils.DEFAULT_PRECISION, choices=list(utils.PRECISIONS), help='dtype of returns and prices, longdouble is the previous behaviour')
+    parser.add_argument("--summary-only", action="store_true", help='Write per-path and per-week summaries reduced during the simulation instead of the per-hour records')
+    parser.add_argument("--summaries", nargs="+", default=list(summaries.ACCUMULATORS), choices=list(summaries.ACCUMULATORS), help='Summaries written with --summary-only')
+    parser.add_argument("--profile", action="store_true", help='Time the phases of every job, count Black-Scholes calls and save a JSON report to saveDir')
+    parser.add_argument("--cprofile", action="store_true", help='--profile and a cProfile dump (pstats) per worker')
+    parser.add_argument("--quantiles", nargs="+", type=float, default=summaries.DEFAULT_QUANTILES, help='Cross-path quantiles of the path summary written with --summary-only')
     group = parser.add_argument_group(title='Option type')
     group.add_argument("--calls", help="find calls",
                     action="store_true")
@@ -154,9 +364,11 @@ if __name__ == "__main__":
         parser.error("Option type required")
     if args.calls and args.puts:
         parser.error("Just One option type must be specified")
-    if args.calls and not (0.0 <= args.targetDelta <= 1.0):
+    if args.calls and not all(0.0 <= delta <= 1.0 for delta in args.targetDelta):
         parser.error("Target delta for calls has to be in <0,1> interval")
-    if args.puts and not (-1.0 <= args.targetDelta <= 0.0):
+    if args.puts and not all(-1.0 <= delta <= 0.0 for delta in args.targetDelta):
         parser.error("Target delta for puts has to be in <-1,0> interval")
+    if min(args.tenors) < 1:
+        parser.error("Tenors have to be at least 1 week")
     main(args)
 
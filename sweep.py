@@ -0,0 +1,251 @@
+import os,sys
+import json
+import hashlib
+import itertools
+import argparse
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+currentdir = os.path.dirname(os.getcwd())
+sys.path.insert(0,currentdir)
+from BlackScholes import path_store
+from Market import utils, results
+import runStrategy
+
+# Runs every cell of a parameter grid, the grid spec is a YAML or JSON file:
+#
+#   runs: generatedRuns/100.paths
+#   saveDir: sweep
+#   cores: 4
+#   grid:
+#     flag: [c, p]
+#     mu: [1.0, 0.5]
+#     sigma: [0.8, 1.0]
+#     ivc: [0.05, 0.1]
+#     minIV: [0.0]
+#     targetDelta: [0.1, -0.1]
+#     strategy:
+#       - AbstractStrategy
+#       - name: DeltaIntervalHedgeStrategy
+#         args: ["1:h", " -0.4:float", "0.1:float"]
+#
+# A cell is one value of every grid key, cells whose targetDelta does not match the option type are left out.
+# Returns, prices and realized vol depend only on mu and sigma, they are computed once into
+# saveDir/intermediates/<hash> and memory-mapped by the cells.
+# Results of a cell are saved in saveDir/cells/<hash>, a hash of everything they depend on
+# (paths file, grid values, initPrice, precision, format), cells with saved results are skipped.
+# The engine is left out since every engine gives the same results.
+# saveDir/sweep.csv lists the hash of every cell.
+
+DEFAULTS = {
+    'saveDir': 'sweep',
+    'cores': 2,
+    'format': 'parquet',
+    'engine': 'vectorized',
+    'precision': utils.DEFAULT_PRECISION,
+    'initPrice': 2000,
+    'chunkSize': None,
+}
+GRID_DEFAULTS = {
+    'flag': ['c'],
+    'ivc': [0.05],
+    'minIV': [0.0],
+    'targetDelta': [0.1],
+    'strategy': ['AbstractStrategy'],
+}
+GRID_KEYS = ['flag', 'mu', 'sigma', 'ivc', 'minIV', 'targetDelta', 'strategy']
+COLLATERAL_RESERVE = 10e8
+INTERMEDIATES = ['unStdPaths', 'prices', 'rv']
+DONE = 'done.json'
+
+
+def _import_yaml():
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError("YAML grid specs require pyyaml: pip install pyyaml, or use a JSON spec")
+    return yaml
+
+
+def load_spec(file):
+    with open(file) as f:
+        if file.endswith('.json'):
+            spec = json.load(f)
+        else:
+            spec = _import_yaml().safe_load(f)
+    if 'runs' not in spec:
+        raise ValueError("Grid spec needs runs")
+    grid = dict(GRID_DEFAULTS, **spec.get('grid', {}))
+    unknown = set(grid) - set(GRID_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown grid keys {sorted(unknown)}")
+    for key in ['mu', 'sigma']:
+        if key not in grid:
+            raise ValueError(f"Grid spec needs {key}")
+    for key in GRID_KEYS:
+        if not isinstance(grid[key], list):
+            grid[key] = [grid[key]]
+    grid['strategy'] = [_strategy_entry(entry) for entry in grid['strategy']]
+    spec = dict(DEFAULTS, **spec)
+    spec['grid'] = grid
+    return spec
+
+
+def _strategy_entry(entry):
+    if isinstance(entry, str):
+        entry = {'name': entry}
+    name = entry['name']
+    if name not in dict(runStrategy.strategies):
+        raise ValueError(f"Unknown strategy {name}")
+    args = [str(arg) for arg in entry.get('args', [])]
+    runStrategy.parseStrategyArgs(args)
+    return {'name': name, 'args': args}
+
+
+def grid_cells(grid):
+    cells = []
+    for flag, mu, sigma, ivc, minIV, targetDelta, strategy in itertools.product(*[grid[key] for key in GRID_KEYS]):
+        if flag not in ('c', 'p'):
+            raise ValueError("Invalid flag")
+        if (flag == 'c' and not 0.0 <= targetDelta <= 1.0) or (flag == 'p' and not -1.0 <= targetDelta <= 0.0):
+            continue
+        cells.append({
+            'flag': flag, 'mu': float(mu), 'sigma': float(sigma), 'ivc': float(ivc), 'minIV': float(minIV),
+            'targetDelta': float(targetDelta), 'strategy': strategy['name'], 'strategyArgs': strategy['args'],
+        })
+    return cells
+
+
+def runs_fingerprint(runs):
+    # the paths file is identified by its header, size and modification time, not read
+    stat = os.stat(runs)
+    fingerprint = {'runs': os.path.basename(runs), 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    if path_store.is_path_store(runs):
+        header = path_store.read_header(runs)
+        fingerprint['header'] = {key: header[key] for key in ['dtype', 'shape', 'params', 'seed']}
+    return fingerprint
+
+
+def content_hash(key):
+    return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def dist_key(spec, fingerprint, mu, sigma):
+    return {
+        'paths': fingerprint, 'mu': mu, 'sigma': sigma, 'initPrice': float(spec['initPrice']),
+        'precision': spec['precision'], 'sample_length': utils.SAMPLE_LENGTH,
+    }
+
+
+def cell_key(spec, fingerprint, cell):
+    return dict(dist_key(spec, fingerprint, cell['mu'], cell['sigma']), collateralReserve=COLLATERAL_RESERVE, format=spec['format'], **cell)
+
+
+def intermediate_file(directory, name):
+    return os.path.join(directory, name + '.npy')
+
+
+def create_intermediates(directory, num_paths, dtype):
+    os.makedirs(directory, exist_ok=True)
+    num_returns = utils.SAMPLE_LENGTH
+    shapes = [(num_paths, num_returns), (num_paths, num_returns + 1), (num_paths, num_returns + 1 - utils.IV_WINDOW*24)]
+    for name, shape in zip(INTERMEDIATES, shapes):
+        np.lib.format.open_memmap(intermediate_file(directory, name), mode='w+', dtype=dtype, shape=shape).flush()
+
+
+# intermediates are stored one row per path, so a chunk of paths is contiguous
+def price_chunk(shared_paths, directory, start, stop, mu, sigma, p0, dtype):
+    paths = runStrategy.load_shared_paths(shared_paths, start, stop)
+    unStdPaths, prices, rv = runStrategy.price_paths(paths, mu, sigma, p0, utils.SAMPLE_LENGTH, start, dtype)
+    for name, values in zip(INTERMEDIATES, [unStdPaths.to_numpy().T, prices.to_numpy().T, rv.T]):
+        store = np.load(intermediate_file(directory, name), mmap_mode='r+')
+        store[start:stop] = values
+        store.flush()
+
+
+def cell_chunk(directory, cell, writer, chunk_id, start, stop, engine):
+    unStd, prices, rv = [np.array(np.load(intermediate_file(directory, name), mmap_mode='r')[start:stop]) for name in INTERMEDIATES]
+    _, prices = runStrategy.path_frames(unStd, prices, start, utils.SAMPLE_LENGTH)
+    ivs = runStrategy.implied_vols(prices, rv.T, cell['ivc'])
+    strategy_setup = (cell['strategy'], runStrategy.parseStrategyArgs(cell['strategyArgs']), cell['targetDelta'])
+    dfs, pool_values = runStrategy.simulate_paths(cell['flag'], prices, ivs, cell['minIV'], COLLATERAL_RESERVE, strategy_setup, engine)
+    writer.write_chunk(chunk_id, None, None, dfs, pool_values)
+
+
+def is_done(directory):
+    return os.path.exists(os.path.join(directory, DONE))
+
+
+def mark_done(directory, key):
+    with open(os.path.join(directory, DONE), 'w') as f:
+        json.dump(key, f, indent=1, sort_keys=True)
+
+
+def main(args):
+    print(args)
+    spec = load_spec(args.spec)
+    if args.cores is not None:
+        spec['cores'] = args.cores
+    saveDir = spec['saveDir']
+    cores = spec['cores']
+    dtype = utils.PRECISIONS[spec['precision']]
+    fingerprint = runs_fingerprint(spec['runs'])
+
+    cells = grid_cells(spec['grid'])
+    dists = sorted(set((cell['mu'], cell['sigma']) for cell in cells))
+    dist_dirs = {dist: os.path.join(saveDir, 'intermediates', content_hash(dist_key(spec, fingerprint, *dist))) for dist in dists}
+    cell_hashes = [content_hash(cell_key(spec, fingerprint, cell)) for cell in cells]
+    cell_dirs = [os.path.join(saveDir, 'cells', cell_hash) for cell_hash in cell_hashes]
+    pending = [i for i, directory in enumerate(cell_dirs) if not is_done(directory)]
+    pending_dists = [dist for dist in dists if not is_done(dist_dirs[dist]) and any((cells[i]['mu'], cells[i]['sigma']) == dist for i in pending)]
+    print(f"[*] {len(cells)} cells, {len(cells) - len(pending)} already saved, {len(pending_dists)} of {len(dists)} mu/sigma to price")
+
+    index = pd.DataFrame(cells)
+    index.insert(0, 'cell', cell_hashes)
+    index['strategyArgs'] = [' '.join(cell['strategyArgs']) for cell in cells]
+    index['cached'] = [i not in pending for i in range(len(cells))]
+    if args.dry_run:
+        with pd.option_context('display.width', 200, 'display.max_columns', None):
+            print(index)
+        return
+
+    num_paths = None
+    if pending_dists:
+        shm, shared_paths, num_paths = runStrategy.open_paths(spec['runs'])
+        try:
+            chunks = runStrategy.chunk_ranges(num_paths, spec['chunkSize'] or runStrategy.default_chunk_size(num_paths, len(pending_dists), cores))
+            for dist in pending_dists:
+                create_intermediates(dist_dirs[dist], num_paths, dtype)
+            Parallel(n_jobs=cores,verbose=10,backend='multiprocessing')(delayed(price_chunk)(shared_paths,dist_dirs[dist],start,stop,dist[0],dist[1],spec['initPrice'],dtype) for dist in pending_dists for start, stop in chunks)
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        for dist in pending_dists:
+            mark_done(dist_dirs[dist], dist_key(spec, fingerprint, *dist))
+
+    if pending:
+        if num_paths is None:
+            cell = cells[pending[0]]
+            num_paths = np.load(intermediate_file(dist_dirs[(cell['mu'], cell['sigma'])], 'prices'), mmap_mode='r').shape[0]
+        chunks = runStrategy.chunk_ranges(num_paths, spec['chunkSize'] or runStrategy.default_chunk_size(num_paths, len(pending), cores))
+        writers = {}
+        for i in pending:
+            cell = cells[i]
+            writers[i] = results.get_writer(spec['format'], cell_dirs[i], cell['strategy'], num_paths, cell['flag'], cell['mu'], cell['sigma'], results.RECORD_RESULTS)
+            writers[i].prepare()
+        Parallel(n_jobs=cores,verbose=10,backend='multiprocessing')(delayed(cell_chunk)(dist_dirs[(cells[i]['mu'], cells[i]['sigma'])],cells[i],writers[i],chunk_id,start,stop,spec['engine']) for i in pending for chunk_id, (start, stop) in enumerate(chunks))
+        for i in pending:
+            writers[i].close(len(chunks))
+            mark_done(cell_dirs[i], cell_key(spec, fingerprint, cells[i]))
+
+    index.to_csv(os.path.join(saveDir, 'sweep.csv'), index=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("spec", type=str, help="grid spec, YAML or JSON")
+    parser.add_argument("-c", "--cores", default=None,type=int, help="Number of cores to use, overrides cores of the spec")
+    parser.add_argument("--dry-run", action="store_true", help="list the cells and whether they are saved, without running them")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,4 @@
+import os, sys
+
+# the modules are imported from the root of the repository, as in the scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
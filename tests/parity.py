@@ -0,0 +1,52 @@
+import datetime
+import functools
+import numpy as np
+
+from Market import utils
+import runStrategy
+
+# Records of the engines on the same seeded paths, for every strategy with a batched and a numba kernel.
+CASES = [
+    ('AbstractStrategy', []),
+    ('DeltaIntervalHedgeStrategy', [datetime.timedelta(hours=3), -0.4, 0.1]),
+    ('DeltaNonPositiveHedgeStrategy', [datetime.timedelta(hours=3), -0.5]),
+]
+PATHS = 2
+SEED = 0
+
+
+@functools.lru_cache(maxsize=None)
+def paths():
+    return np.random.default_rng(SEED).standard_normal((PATHS, utils.SAMPLE_LENGTH))
+
+
+@functools.lru_cache(maxsize=None)
+def simulate(flag, case, minIV, engine, targetDelta=None):
+    # (df, pool_value) of CASES[case], targetDelta is 0.1 for calls and -0.1 for puts by default (or a Ladder)
+    name, strategyArgs = CASES[case]
+    if targetDelta is None:
+        targetDelta = 0.1 if flag == 'c' else -0.1
+    _, _, df, pool_value = runStrategy.run_simulation(flag, paths(), 1.0, 0.8, 0.05, minIV, 2000, 10e8,
+        utils.SAMPLE_LENGTH, (name, strategyArgs, targetDelta), engine)
+    return df, pool_value
+
+
+def max_scaled_diff(expected, actual):
+    # largest difference over all columns, scaled by the largest value of the column
+    worst = 0.0
+    for column in expected.columns:
+        a = expected[column].to_numpy(dtype=np.float64)
+        b = actual[column].to_numpy(dtype=np.float64)
+        if (np.isnan(a) != np.isnan(b)).any():
+            return np.inf
+        scale = np.nanmax(np.abs(a)) if np.isfinite(a).any() else 0.0
+        if scale > 0:
+            worst = max(worst, np.nanmax(np.abs(a - b)) / scale)
+    return worst
+
+
+def assert_same_records(expected, actual, tolerance):
+    for a, b in zip(expected, actual):
+        assert list(a.columns) == list(b.columns)
+        assert a.index.equals(b.index)
+        assert max_scaled_diff(a, b) <= tolerance
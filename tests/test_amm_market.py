@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from Market import amm_market
+
+TOLERANCE = 1e-12
+
+TIMESTAMP = 1_600_000_000
+SIZES = [0.1, 1.0, 10.0, 100.0]
+
+
+def make_amm(optionType):
+    # one market a week away with reserves of a previous trade, so the virtual reserves are not symmetric
+    markets = [amm_market.Market(2200.0 if optionType == 'call' else 1800.0, TIMESTAMP + 7 * 86400)]
+    amm = amm_market.MinterAmm(1000.0, 0.003, markets, 0.8 / amm_market.SQRT_SECONDS_PER_YEAR, 1e-10, TIMESTAMP)
+    amm.setCurrentPrice(2000.0)
+    amm.bTokenBuy(0, 50.0, optionType)
+    return amm
+
+
+def collateral(amm, size, optionType, buy):
+    if buy:
+        return amm.bTokenGetCollateralIn(0, size, optionType)
+    return amm.bTokenGetCollateralOut(0, size, optionType)
+
+
+@pytest.mark.parametrize('optionType', ['call', 'put'])
+@pytest.mark.parametrize('buy', [True, False])
+def test_quotes_match_get_collateral(optionType, buy):
+    amm = make_amm(optionType)
+    sign = -1 if buy else 1
+    collateralAmount, fee, price = amm.bTokenQuotes(0, sign * np.array(SIZES), optionType)
+    for k, size in enumerate(SIZES):
+        expected = collateral(amm, size, optionType, buy)
+        np.testing.assert_allclose([collateralAmount[k], fee[k], price[k]], [*expected, expected[0] / size], rtol=TOLERANCE)
+        scalar = amm.bTokenQuotes(0, sign * size, optionType)
+        np.testing.assert_allclose(scalar, [*expected, expected[0] / size], rtol=TOLERANCE)
+
+
+@pytest.mark.parametrize('optionType', ['call', 'put'])
+@pytest.mark.parametrize('buy', [True, False])
+def test_slippage_matches_get_collateral(optionType, buy):
+    amm = make_amm(optionType)
+    spotPrice = amm.getPriceForMarket(0, optionType)
+    expected = [(collateral(amm, size, optionType, buy)[0] / size / spotPrice - 1) * 100 for size in SIZES]
+    slippage = amm.getSlippage(0, SIZES, optionType, buy)
+    assert slippage.shape == (len(SIZES),)
+    np.testing.assert_allclose(slippage, expected, rtol=TOLERANCE)
+    for size, slippage in zip(SIZES, expected):
+        scalar = amm.getSlippage(0, size, optionType, buy)
+        assert np.ndim(scalar) == 0
+        np.testing.assert_allclose(scalar, slippage, rtol=TOLERANCE)
+    # buying costs more and selling pays less than the spot price
+    assert all(s > 0 for s in expected) if buy else all(s < 0 for s in expected)
@@ -0,0 +1,108 @@
+import itertools
+import numpy as np
+import pytest
+
+from BlackScholes import black_scholes
+
+vollib = pytest.importorskip('py_vollib.black_scholes')
+from py_vollib.black_scholes.greeks import analytical
+
+TOLERANCE = 1e-10
+
+S = [500.0, 2000.0, 3500.0]
+MONEYNESS = [0.5, 0.9, 1.0, 1.1, 2.0]
+T = [1 / (24 * 365), 7 / 365, 0.25, 1.0]
+SIGMA = [0.1, 0.8, 2.0]
+CASES = [(s, s * m, t, sigma) for s, m, t, sigma in itertools.product(S, MONEYNESS, T, SIGMA)]
+
+
+def vollib_greeks(S, K, T, sigma, option):
+    flag = option[0]
+    return black_scholes.Greeks(
+        vollib.black_scholes(flag, S, K, T, 0.0, sigma),
+        analytical.delta(flag, S, K, T, 0.0, sigma),
+        analytical.gamma(flag, S, K, T, 0.0, sigma),
+        analytical.vega(flag, S, K, T, 0.0, sigma),
+        analytical.theta(flag, S, K, T, 0.0, sigma)
+    )
+
+
+def assert_close(actual, expected):
+    np.testing.assert_allclose(actual, expected, rtol=TOLERANCE, atol=TOLERANCE)
+
+
+@pytest.mark.parametrize('option', ['call', 'put'])
+def test_scalar_greeks(option):
+    for S, K, T, sigma in CASES:
+        greeks = black_scholes.bs_greeks(S, K, T, sigma, option)
+        expected = vollib_greeks(S, K, T, sigma, option)
+        for field in black_scholes.Greeks._fields:
+            assert_close(getattr(greeks, field), getattr(expected, field))
+        assert_close(black_scholes.bs_price(S, K, T, sigma, option), expected.price)
+        assert_close(black_scholes.bs_delta(S, K, T, sigma, option), expected.delta)
+        assert_close(black_scholes.bs_gamma(S, K, T, sigma), expected.gamma)
+        assert_close(black_scholes.bs_vega(S, K, T, sigma), expected.vega)
+        assert_close(black_scholes.bs_theta(S, K, T, sigma), expected.theta)
+
+
+@pytest.mark.parametrize('option', ['call', 'put'])
+def test_array_greeks(option):
+    S, K, T, sigma = (np.array(column) for column in zip(*CASES))
+    greeks = black_scholes.bs_greeks(S, K, T, sigma, option)
+    expected = [vollib_greeks(*case, option) for case in CASES]
+    for k, field in enumerate(black_scholes.Greeks._fields):
+        assert greeks[k].shape == S.shape
+        assert_close(greeks[k], [e[k] for e in expected])
+    assert_close(black_scholes.bs_price(S, K, T, sigma, option), [e.price for e in expected])
+    assert_close(black_scholes.bs_delta(S, K, T, sigma, option), [e.delta for e in expected])
+    assert_close(black_scholes.bs_gamma(S, K, T, sigma), [e.gamma for e in expected])
+    assert_close(black_scholes.bs_vega(S, K, T, sigma), [e.vega for e in expected])
+    assert_close(black_scholes.bs_theta(S, K, T, sigma), [e.theta for e in expected])
+
+
+def test_array_broadcast():
+    # paths (rows) against markets (columns), as in BatchMinterAmm.getMarketGreeks
+    S = np.array([[1800.0], [2000.0]])
+    K = np.array([[1900.0, 2100.0, 2500.0], [2000.0, 2200.0, 3000.0]])
+    greeks = black_scholes.bs_greeks(S, K, 7 / 365, np.array([[0.6], [0.9]]), 'call')
+    for row, col in itertools.product(range(2), range(3)):
+        sigma = 0.6 if row == 0 else 0.9
+        expected = vollib_greeks(S[row, 0], K[row, col], 7 / 365, sigma, 'call')
+        for k in range(len(expected)):
+            assert_close(greeks[k][row, col], expected[k])
+
+
+@pytest.mark.parametrize('option', ['call', 'put'])
+def test_seconds_wrappers(option):
+    timestamp, expiration = 1_600_000_000.0, 1_600_000_000.0 + 5 * 86400
+    T = (expiration - timestamp) / black_scholes.SECONDS_PER_YEAR
+    for S, K in [(2000.0, 1800.0), (2000.0, 2400.0)]:
+        expected = vollib_greeks(S, K, T, 0.8, option)
+        assert_close(black_scholes.black_scholes(timestamp, S, K, expiration, 0.8, option), expected.price)
+        delta_fn = black_scholes.black_scholes_delta_put if option == 'put' else black_scholes.black_scholes_delta_call
+        assert_close(delta_fn(timestamp, S, K, expiration, 0.8), expected.delta)
+        assert_close(black_scholes.black_scholes_vega_call(timestamp, S, K, expiration, 0.8), expected.vega)
+
+
+def test_expired_is_intrinsic():
+    assert black_scholes.bs_price(2000.0, 1800.0, 0.0, 0.8, 'call') == 200.0
+    assert black_scholes.bs_price(2000.0, 1800.0, 0.0, 0.8, 'put') == 0.0
+    assert_close(black_scholes.bs_price(np.array([2000.0, 1500.0]), 1800.0, 0.0, 0.8, 'put'), [0.0, 300.0])
+
+
+
+@pytest.mark.parametrize('option', ['call', 'put'])
+def test_strike_for_delta_not_worse_than_bisect(option):
+    # the analytic strike is at least as close to the target delta as the previous bisection solver
+    timestamp = 1_600_000_000.0
+    delta_fn = black_scholes.black_scholes_delta_put if option == 'put' else black_scholes.black_scholes_delta_call
+    targets = [-0.05, -0.1, -0.25, -0.5, -0.75] if option == 'put' else [0.05, 0.1, 0.25, 0.5, 0.75]
+    cases = list(itertools.product(targets, S, [timestamp + days * 86400 for days in [1, 7, 30, 90]], SIGMA[:2]))
+    target, price, expiration, sigma = (np.array(column) for column in zip(*cases))
+    strikes = black_scholes.strike_for_delta(target, timestamp, price, expiration, sigma, option)
+    for case, array_strike in zip(cases, strikes):
+        strike = black_scholes.strike_for_delta(case[0], timestamp, *case[1:], option)
+        bisect = black_scholes.strike_for_delta_bisect(case[0], timestamp, *case[1:], option)
+        assert strike == array_strike
+        error = abs(delta_fn(timestamp, case[1], strike, *case[2:]) - case[0])
+        assert error <= abs(delta_fn(timestamp, case[1], bisect, *case[2:]) - case[0]) + TOLERANCE
@@ -0,0 +1,27 @@
+import pytest
+
+from Market.ladder import Ladder
+from parity import CASES, simulate, assert_same_records
+
+# Records of the vectorized engine (BatchMinterAmm, hedgeBatch) against the python engine on the same seeded paths.
+TOLERANCE = 1e-12
+
+
+@pytest.mark.parametrize('minIV', [0.0, 0.85])
+@pytest.mark.parametrize('flag', ['c', 'p'])
+@pytest.mark.parametrize('case', range(len(CASES)), ids=[name for name, _ in CASES])
+def test_vectorized_matches_python(case, flag, minIV):
+    assert_same_records(simulate(flag, case, minIV, 'python'), simulate(flag, case, minIV, 'vectorized'), TOLERANCE)
+
+
+# weekly and 4-week markets at two strikes, sums over several markets round differently in the two engines
+LADDER_TOLERANCE = 1e-11
+
+
+@pytest.mark.parametrize('flag', ['c', 'p'])
+@pytest.mark.parametrize('case', range(len(CASES)), ids=[name for name, _ in CASES])
+def test_ladder_vectorized_matches_python(case, flag):
+    ladder = Ladder([0.1, 0.3] if flag == 'c' else [-0.1, -0.3], [1, 4])
+    expected = simulate(flag, case, 0.0, 'python', ladder)
+    assert_same_records(expected, simulate(flag, case, 0.0, 'vectorized', ladder), LADDER_TOLERANCE)
+    assert expected[0]['market_index'].max() > simulate(flag, case, 0.0, 'python')[0]['market_index'].max()
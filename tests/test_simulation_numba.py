@@ -0,0 +1,14 @@
+import pytest
+
+pytest.importorskip('numba')
+from parity import CASES, simulate, assert_same_records
+
+# Records of the numba engine against the python engine on the same seeded paths,
+# for every strategy with a kernel, calls and puts.
+TOLERANCE = 1e-12
+
+
+@pytest.mark.parametrize('flag', ['c', 'p'])
+@pytest.mark.parametrize('case', range(len(CASES)), ids=[name for name, _ in CASES])
+def test_numba_matches_python(case, flag):
+    assert_same_records(simulate(flag, case, 0.0, 'python'), simulate(flag, case, 0.0, 'numba'), TOLERANCE)